@@ -1,21 +1,35 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, g, Response
+from flask import Flask, Blueprint, request, jsonify, g, Response
 from flask_cors import CORS
-from model import train_model
-from db import init_db, add_user, check_user
+from db import add_user, check_user
 import re
-from db import init_exception_form_db, store_exception_form
+from db import ensure_db_initialized, store_exception_form, bump_data_version, log_audit, FORM_ROW_FIELDS
+from db import decode_audit_cursor, AUDIT_PAGE_SIZE, MAX_AUDIT_PAGE_SIZE
+from audit_archive import search_audit_trail, archive_audit_trail
+from audit_sink import AUDIT_SINK
+from form_values import form_fingerprint
+from dedup import dedupe_entries
+from search_index import search_forms, search_available, SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE
+from form_patch import patch_form, full_form_fields, bulk_patch_forms, select_form_ids
+from field_mapping import (
+    process_single_form, get_flexible_field, flexible_view, PASS_NUMBER_KEYS,
+    combined_mapped_columns, pure_extraction_rows
+)
+from raw_payloads import (
+    DEFAULT_ENTRY_FORM_TYPE, compact_json, entry_document_json, response_employee_data, merge_entry,
+    RAW_COLUMNS, hydrate_raw_columns, prune_raw_payloads
+)
+import fast_json
+from response_cache import cached_response
+from export_jobs import init_export_jobs_db, submit_export_job, get_export_job
+from remap import start_remap_job, get_remap_status, MAX_REMAP_WORKERS
+from duplicate_cleanup import cleanup_duplicates as run_duplicate_cleanup, start_cleanup_job, get_cleanup_status
 from exception_codes import exception_codes
 import sqlite3
-import csv
-import requests
-import google.generativeai as genai
 import datetime
-import pdfplumber
-from PIL import Image
 import io
-import json
+import threading
 from typing import Dict, Any, List, Tuple
 
 # Load environment variables from .env file
@@ -26,26 +40,57 @@ PURE_GEMINI_EXTRACTION = True  # Set to True to use pure extraction
 ENHANCED_FORM_DETECTION = True  # Enable advanced form detection for maximum overtime slip extraction
 MAX_SEGMENTS_PER_PAGE = 6  # Maximum number of segments to extract per PDF page
 
-app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+# Routes are registered on this blueprint; create_app() builds the Flask app around it.
+# Heavy dependencies (Gemini SDK, pdfplumber, PIL, scikit-learn) are imported on first use,
+# so importing this module for its extraction helpers stays cheap.
+api = Blueprint('api', __name__)
 
 UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-model = train_model()
-init_db()
-init_exception_form_db()    
-# Enable WAL mode for better SQLite concurrency
-with sqlite3.connect('forms.db', timeout=10) as conn:
-    conn.execute('PRAGMA journal_mode=WAL;')
+_app = None
+_app_lock = threading.Lock()
+
+def create_app():
+    """Build the Flask app. Database setup runs once per process, however many apps are created."""
+    app = Flask(__name__)
+    app.json = fast_json.FastJSONProvider(app)
+    CORS(app, resources={r"/*": {"origins": "*"}})
+    app.register_blueprint(api)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    ensure_db_initialized()
+    init_export_jobs_db()
+    return app
+
+def get_app():
+    """Return this process's app, creating it on first use."""
+    global _app
+    with _app_lock:
+        if _app is None:
+            _app = create_app()
+        return _app
+
+def __getattr__(name):
+    # Keep `app:app` (WSGI servers) and `from app import app` working without building the app at import time
+    if name == 'app':
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Utility: Google Gemini extraction
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-else:
-    gemini_model = None
+_gemini_model = None
+_gemini_lock = threading.Lock()
+
+def get_gemini_model():
+    """Configure the Gemini SDK on first use. Returns None if GEMINI_API_KEY is not set."""
+    global _gemini_model
+    if not GEMINI_API_KEY:
+        return None
+    with _gemini_lock:
+        if _gemini_model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_model = genai.GenerativeModel('gemini-1.5-flash')
+        return _gemini_model
 
 def _segment_similarity(segment1_data, segment2_data):
     """
@@ -134,9 +179,11 @@ def gemini_extract_file_details(file_path, prompt=None, form_type=None):
     Optimized for maximum overtime slip extraction.
     Returns Gemini's response text or None if not configured.
     """
+    gemini_model = get_gemini_model()
     if not gemini_model:
         print("Gemini API key not set. Skipping Gemini extraction.")
         return None
+    import google.generativeai as genai
     
     # Enhanced prompt for maximum overtime slip extraction
     if prompt is None:
@@ -235,10 +282,9 @@ def gemini_extract_file_details(file_path, prompt=None, form_type=None):
 
 def clean_and_map_gemini_output(gemini_output, form_type=None):
     cleaned = re.sub(r"^```json|^```|```$", "", gemini_output.strip(), flags=re.MULTILINE).strip()
-    import json
     try:
-        data = json.loads(cleaned)
-        raw_gemini_json = json.dumps(data)  # Store the raw Gemini output
+        data = fast_json.loads(cleaned)
+        raw_gemini_json = fast_json.dumps(data)  # Store the raw Gemini output
     except Exception as e:
         print("Error parsing cleaned Gemini output:", e)
         return {}, []
@@ -255,7 +301,7 @@ def clean_and_map_gemini_output(gemini_output, form_type=None):
                 "form_type": data.get("form_type", "SUPERVISOR'S OVERTIME AUTHORIZATION"),
                 "entry": entry
             }
-            forms_data.append((form_data, rows, json.dumps(individual_json)))
+            forms_data.append((form_data, rows, fast_json.dumps(individual_json)))
         return forms_data, raw_gemini_json
     else:
         # Single form response
@@ -263,18 +309,23 @@ def clean_and_map_gemini_output(gemini_output, form_type=None):
         form_data, rows = process_single_form(data, form_type)
         return [(form_data, rows, raw_gemini_json)], raw_gemini_json
 
+def parse_gemini_output(gemini_output: str):
+    """Strip markdown fences from Gemini output and parse it. Returns (data, compact_json) or (None, '')."""
+    cleaned = re.sub(r"^```json|^```|```$", "", gemini_output.strip(), flags=re.MULTILINE).strip()
+    try:
+        raw_data = fast_json.loads(cleaned)
+    except Exception as e:
+        print("Error parsing cleaned Gemini output:", e)
+        return None, ""
+    return raw_data, compact_json(raw_data)
+
 def process_gemini_extraction_hybrid(gemini_output: str, form_type: str = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]], str]:
     """
     Hybrid approach: Store both mapped fields and raw Gemini JSON.
     Can switch between pure extraction and mapped extraction modes.
     """
-    cleaned = re.sub(r"^```json|^```|```$", "", gemini_output.strip(), flags=re.MULTILINE).strip()
-    
-    try:
-        raw_data = json.loads(cleaned)
-        raw_gemini_json = json.dumps(raw_data, indent=2)
-    except Exception as e:
-        print("Error parsing cleaned Gemini output:", e)
+    raw_data, raw_gemini_json = parse_gemini_output(gemini_output)
+    if raw_data is None:
         return {}, [], ""
     
     if PURE_GEMINI_EXTRACTION:
@@ -289,13 +340,8 @@ def process_gemini_extraction_dual(gemini_output: str, form_type: str = None) ->
     Process forms in BOTH extraction modes simultaneously.
     Returns a single form with both pure and mapped data stored.
     """
-    cleaned = re.sub(r"^```json|^```|```$", "", gemini_output.strip(), flags=re.MULTILINE).strip()
-    
-    try:
-        raw_data = json.loads(cleaned)
-        raw_gemini_json = json.dumps(raw_data, indent=2)
-    except Exception as e:
-        print("Error parsing cleaned Gemini output:", e)
+    raw_data, raw_gemini_json = parse_gemini_output(gemini_output)
+    if raw_data is None:
         return [], ""
     
     all_forms = []
@@ -305,46 +351,41 @@ def process_gemini_extraction_dual(gemini_output: str, form_type: str = None) ->
         print("Detected multi-form response with entries array")
         
         # Extract employee data from main response for supervisor forms
-        employee_data = {}
-        if form_type == 'supervisor':
-            # Handle both old and new formats
-            if 'employee' in raw_data:
-                employee_data = raw_data['employee'] or {}
-                print(f"Extracted employee data (old format): {employee_data}")
-            elif 'employeeDetails' in raw_data:
-                employee_data = raw_data['employeeDetails'] or {}
-                print(f"Extracted employee data (new format): {employee_data}")
+        employee_data = response_employee_data(raw_data, form_type)
+        if employee_data:
+            print(f"Extracted employee data: {employee_data}")
         
+        document_form_type = raw_data.get("form_type", DEFAULT_ENTRY_FORM_TYPE)
         for i, entry in enumerate(raw_data['entries']):
             print(f"Processing entry {i+1}: {entry}")
             
             # Merge employee data with entry data for supervisor forms
-            if form_type == 'supervisor' and employee_data:
-                merged_entry = {**employee_data, **entry}
-                print(f"Merged entry with employee data: {merged_entry}")
-            else:
-                merged_entry = entry
+            merged_entry = merge_entry(entry, employee_data, form_type)
             
-            form_data, rows = process_single_form_combined(merged_entry, form_type, raw_gemini_json)
-            individual_json = {
-                "form_type": raw_data.get("form_type", "SUPERVISOR'S OVERTIME AUTHORIZATION"),
-                "entry": merged_entry
-            }
-            all_forms.append((form_data, rows, json.dumps(individual_json)))
+            entry_json = compact_json(merged_entry)
+            form_data, rows = process_single_form_combined(merged_entry, form_type, raw_gemini_json, entry_json)
+            # The response is stored once; the form keeps a reference to its entry
+            form_data['raw_payload'] = raw_gemini_json
+            form_data['raw_entry_index'] = i
+            all_forms.append((form_data, rows, entry_document_json(document_form_type, entry_json)))
     else:
         # Single form response
         print("Processing as single form")
-        form_data, rows = process_single_form_combined(raw_data, form_type, raw_gemini_json)
+        form_data, rows = process_single_form_combined(raw_data, form_type, raw_gemini_json, raw_gemini_json)
+        form_data['raw_payload'] = raw_gemini_json
+        form_data['raw_entry_index'] = None
         all_forms.append((form_data, rows, raw_gemini_json))
     
     return all_forms, raw_gemini_json
 
-def process_single_form_combined(data: Dict[str, Any], form_type: str, raw_gemini_json: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+def process_single_form_combined(data: Dict[str, Any], form_type: str, raw_gemini_json: str, entry_json: str = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
     Process a single form and combine both pure and mapped extraction into one form record.
+    The pure and mapped modes both keep the entry as-is, so one serialization
+    (entry_json) backs raw_extracted_data, raw_extracted_data_pure and raw_extracted_data_mapped.
     """
-    # Process pure extraction
-    pure_form_data, pure_rows = extract_single_form_pure(data, form_type)
+    if entry_json is None:
+        entry_json = compact_json(data)
     
     # Process mapped extraction
     mapped_form_data, mapped_rows = process_single_form(data, form_type)
@@ -354,56 +395,18 @@ def process_single_form_combined(data: Dict[str, Any], form_type: str, raw_gemin
         'form_type': form_type,
         'status': 'processed',
         # Store both extraction modes
-        'raw_extracted_data_pure': pure_form_data.get('raw_extracted_data', ''),
-        'raw_extracted_data_mapped': json.dumps(data),  # Store original raw data for mapped mode
-        # Use mapped data as the primary fields (for backward compatibility)
-        'pass_number': mapped_form_data.get('pass_number', ''),
-        'title': mapped_form_data.get('title', ''),
-        'employee_name': mapped_form_data.get('employee_name', ''),
-        'rdos': mapped_form_data.get('rdos', ''),
-        'actual_ot_date': mapped_form_data.get('actual_ot_date', ''),
-        'div': mapped_form_data.get('div', ''),
-        'comments': mapped_form_data.get('comments', ''),
-        'supervisor_name': mapped_form_data.get('supervisor_name', ''),
-        'supervisor_pass_no': mapped_form_data.get('supervisor_pass_no', ''),
-        'oto': mapped_form_data.get('oto', ''),
-        'oto_amount_saved': mapped_form_data.get('oto_amount_saved', ''),
-        'entered_in_uts': mapped_form_data.get('entered_in_uts', ''),
-        'regular_assignment': mapped_form_data.get('regular_assignment', ''),
-        'report': mapped_form_data.get('report', ''),
-        'relief': mapped_form_data.get('relief', ''),
-        'todays_date': mapped_form_data.get('todays_date', ''),
-        'reg': mapped_form_data.get('reg', ''),
-        'superintendent_authorization_signature': mapped_form_data.get('superintendent_authorization_signature', ''),
-        'superintendent_authorization_pass': mapped_form_data.get('superintendent_authorization_pass', ''),
-        'superintendent_authorization_date': mapped_form_data.get('superintendent_authorization_date', ''),
-        'entered_into_uts': mapped_form_data.get('entered_into_uts', ''),
-        'overtime_hours': mapped_form_data.get('overtime_hours', ''),
-        'report_loc': mapped_form_data.get('report_loc', ''),
-        'overtime_location': mapped_form_data.get('overtime_location', ''),
-        'report_time': mapped_form_data.get('report_time', ''),
-        'relief_time': mapped_form_data.get('relief_time', ''),
-        'date_of_overtime': mapped_form_data.get('date_of_overtime', ''),
-        'job_number': mapped_form_data.get('job_number', ''),
-        'rc_number': mapped_form_data.get('rc_number', ''),
-        'acct_number': mapped_form_data.get('acct_number', ''),
-        'amount': mapped_form_data.get('amount', ''),
-        'reason_rdo': mapped_form_data.get('reason_rdo', False),
-        'reason_absentee_coverage': mapped_form_data.get('reason_absentee_coverage', False),
-        'reason_no_lunch': mapped_form_data.get('reason_no_lunch', False),
-        'reason_early_report': mapped_form_data.get('reason_early_report', False),
-        'reason_late_clear': mapped_form_data.get('reason_late_clear', False),
-        'reason_save_as_oto': mapped_form_data.get('reason_save_as_oto', False),
-        'reason_capital_support_go': mapped_form_data.get('reason_capital_support_go', False),
-        'reason_other': mapped_form_data.get('reason_other', False),
-        # Store raw JSON for both modes
-        'raw_gemini_json': raw_gemini_json,
-        'raw_extracted_data': json.dumps(data),  # Store original raw data
-        'extraction_mode': 'combined'  # Mark as combined extraction
+        'raw_extracted_data_pure': entry_json,
+        'raw_extracted_data_mapped': entry_json,
     }
+    # Use mapped data as the primary fields (for backward compatibility)
+    combined_form_data.update(combined_mapped_columns(mapped_form_data))
+    # Store raw JSON for both modes
+    combined_form_data['raw_gemini_json'] = raw_gemini_json
+    combined_form_data['raw_extracted_data'] = entry_json
+    combined_form_data['extraction_mode'] = 'combined'  # Mark as combined extraction
     
     # Use mapped rows as primary rows
-    rows = mapped_rows if mapped_rows else pure_rows
+    rows = mapped_rows if mapped_rows else pure_extraction_rows(data)
     
     return combined_form_data, rows
 
@@ -415,29 +418,27 @@ def process_pure_extraction(data: Dict[str, Any], form_type: str, raw_gemini_jso
     if isinstance(data, dict) and 'entries' in data and isinstance(data['entries'], list):
         print("Detected multi-form response with entries array")
         forms_data = []
+        document_form_type = data.get("form_type", DEFAULT_ENTRY_FORM_TYPE)
         for i, entry in enumerate(data['entries']):
             print(f"Processing entry {i+1}: {entry}")
-            form_data, rows = extract_single_form_pure(entry, form_type)
-            individual_json = {
-                "form_type": data.get("form_type", "SUPERVISOR'S OVERTIME AUTHORIZATION"),
-                "entry": entry
-            }
-            forms_data.append((form_data, rows, json.dumps(individual_json)))
+            entry_json = compact_json(entry)
+            form_data, rows = extract_single_form_pure(entry, form_type, entry_json)
+            forms_data.append((form_data, rows, entry_document_json(document_form_type, entry_json)))
         return forms_data, raw_gemini_json
     else:
         # Single form response
         print("Processing as single form")
-        form_data, rows = extract_single_form_pure(data, form_type)
+        form_data, rows = extract_single_form_pure(data, form_type, raw_gemini_json)
         return [(form_data, rows, raw_gemini_json)], raw_gemini_json
 
-def extract_single_form_pure(data: Dict[str, Any], form_type: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+def extract_single_form_pure(data: Dict[str, Any], form_type: str, entry_json: str = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
     """
     Extract a single form using pure Gemini output without field mapping.
     """
     # Store all top-level fields as-is
     form_data = {
         'form_type': form_type,
-        'raw_extracted_data': json.dumps(data),  # Store complete raw data
+        'raw_extracted_data': entry_json if entry_json is not None else compact_json(data),  # Store complete raw data
         'extraction_mode': 'pure'
     }
     
@@ -447,9 +448,7 @@ def extract_single_form_pure(data: Dict[str, Any], form_type: str) -> Tuple[Dict
         form_data['employee_name'] = data['employee_name']
     
     # Flexible pass number extraction
-    pass_number = get_flexible_field(data, [
-        'pass_number', 'pass', 'PASS', 'pass_no', 'pass no', 'passnumber', 'pass number'
-    ])
+    pass_number = get_flexible_field(data, PASS_NUMBER_KEYS)
     if pass_number:
         form_data['pass_number'] = pass_number
     
@@ -459,11 +458,7 @@ def extract_single_form_pure(data: Dict[str, Any], form_type: str) -> Tuple[Dict
         form_data['comments'] = data['comments']
     
     # Handle rows/entries if they exist
-    rows = []
-    if 'rows' in data and isinstance(data['rows'], list):
-        rows = data['rows']
-    elif 'entries' in data and isinstance(data['entries'], list):
-        rows = data['entries']
+    rows = pure_extraction_rows(data)
     
     return form_data, rows
 
@@ -475,627 +470,44 @@ def process_mapped_extraction(data: Dict[str, Any], form_type: str, raw_gemini_j
     if isinstance(data, dict) and 'entries' in data and isinstance(data['entries'], list):
         print("Detected multi-form response with entries array")
         forms_data = []
+        document_form_type = data.get("form_type", DEFAULT_ENTRY_FORM_TYPE)
         for i, entry in enumerate(data['entries']):
             print(f"Processing entry {i+1}: {entry}")
             form_data, rows = process_single_form(entry, form_type)
             # Add raw JSON to form data
-            form_data['raw_extracted_data'] = json.dumps(entry)
+            entry_json = compact_json(entry)
+            form_data['raw_extracted_data'] = entry_json
             form_data['extraction_mode'] = 'mapped'
-            individual_json = {
-                "form_type": data.get("form_type", "SUPERVISOR'S OVERTIME AUTHORIZATION"),
-                "entry": entry
-            }
-            forms_data.append((form_data, rows, json.dumps(individual_json)))
+            forms_data.append((form_data, rows, entry_document_json(document_form_type, entry_json)))
         return forms_data, raw_gemini_json
     else:
         # Single form response
         print("Processing as single form")
         form_data, rows = process_single_form(data, form_type)
         # Add raw JSON to form data
-        form_data['raw_extracted_data'] = json.dumps(data)
+        form_data['raw_extracted_data'] = raw_gemini_json
         form_data['extraction_mode'] = 'mapped'
         return [(form_data, rows, raw_gemini_json)], raw_gemini_json
 
-def process_single_form(data, form_type=None):
-
-    # Normalize keys for mapping
-    def normalize_key(k):
-        # Handle special cases first
-        if k == "RC#":
-            return "rc"
-        if k == "REPORT LOC.":
-            return "report_loc"
-        if k == "S/M":
-            return "sm"
-        
-        # General normalization
-        normalized = k.lower().replace(" ", "_").replace(".", "").replace("#", "").replace("/", "_").replace("'", "").replace("-", "_")
-        return normalized
-
-    # Full slot list for supervisor overtime form and exception claim (hourly) form
-    all_fields = [
-        # Supervisor/Overtime fields
-        "reg_assignment", "reg", "pass_number", "title", "rc_number", "employee_name", "report_loc", "date", "rdos", "date_of_overtime",
-        "job_number", "overtime_location", "report_time", "relief_time", "overtime_hours",
-        "reason_rdo", "reason_absentee_coverage", "reason_no_lunch", "reason_early_report", "reason_late_clear", "reason_save_as_oto", "reason_capital_support_go", "reason_other",
-        "acct_number", "amount",
-        "superintendent_authorization_signature", "superintendent_authorization_pass", "superintendent_authorization_date", "entered_into_uts",
-        # Exception claim (hourly) fields
-        "regular_assignment", "report", "relief", "todays_date", "title", "employee_name", "rdos", "actual_ot_date", "div", "pass_number",
-        "exception_code", "line_location", "run_no", "exception_time_from_hh", "exception_time_from_mm", "exception_time_to_hh", "exception_time_to_mm",
-        "overtime_hh", "overtime_mm", "ta_job_no", "comments", "oto", "oto_amount_saved_hh", "oto_amount_saved_mm", "entered_in_uts_yes", "entered_in_uts_no", "supervisor_name", "supervisor_pass_no"
-    ]
-    # Enhanced mapping for L Line forms - handle all Gemini field variations
-    enhanced_mapping = {
-        # Employee identification - multiple variations
-        'employee_name': ['employee_name', 'name', 'employee', 'employee name', 'EMPLOYEE NAME'],
-        'pass_number': ['pass_number', 'pass', 'PASS', 'assignment', 'reg', 'pass no', 'passnumber', 'pass number'],
-        'title': ['title', 'TITLE', 'position', 'job_title', 'role', 'job title', 'employee_title'],
-        
-        # Job and location fields
-        'job_number': ['job_number', 'job', 'JOB #', 'job no', 'job_no', 'job#', 'job number', 'ta_job_no', 'ta job no'],
-        'rc_number': ['rc_number', 'rc', 'RC#', 'rc#', 'rc no', 'rc_no', 'rc number'],
-        'report_loc': ['report_loc', 'report location', 'REPORT LOC.', 'location', 'reportloc', 'report', 'loc'],
-        'overtime_location': ['overtime_location', 'overtime location', 'OVERTIME LOCATION', 'ot_location', 'otloc', 'ot location'],
-        
-        # Time fields
-        'report_time': ['report_time', 'report time', 'REPORT TIME', 'report-time', 'report.time', 'reporttime'],
-        'relief_time': ['relief_time', 'relief time', 'RELIEF TIME', 'relief-time', 'relief.time', 'relieftime'],
-        'overtime_hours': ['overtime_hours', 'overtime hours', 'OVERTIME HOURS', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime'],
-        
-        # Date fields
-        'date_of_overtime': ['date_of_overtime', 'date of overtime', 'date', 'DATE', 's_m', 'W/T', 'w_t'],
-        'rdos': ['rdos', 'rdo', 'S/M', 'rdo\'s', 'rduos', 'sm'],
-        
-        # Account fields
-        'acct_number': ['acct_number', 'acct', 'ACCT #', 'acct#', 'acct no', 'acct_no', 'acct number', 'account_number', 'account number'],
-        'amount': ['amount'],
-        
-        # Reason fields
-        'reason_rdo': ['reason_rdo', 'rdo', 'RDO'],
-        'reason_absentee_coverage': ['reason_absentee_coverage', 'absentee_coverage', 'absenteeCoverage', 'absentee coverage', 'Absentee Coverage'],
-        'reason_no_lunch': ['reason_no_lunch', 'no_lunch', 'noLunch', 'no lunch', 'NO LUNCH'],
-        'reason_early_report': ['reason_early_report', 'early_report', 'earlyReport', 'early report'],
-        'reason_late_clear': ['reason_late_clear', 'late_clear', 'lateClear', 'late clear'],
-        'reason_save_as_oto': ['reason_save_as_oto', 'save_as_oto', 'saveAsOto', 'save as oto'],
-        'reason_capital_support_go': ['reason_capital_support_go', 'capital_support_go', 'capitalSupportGo', 'capital support go'],
-        'reason_other': ['reason_other', 'other', 'OTHER', 'other_reason']
-    }
-    
-    # Legacy key_map for backward compatibility
-    key_map = {
-        # Supervisor/Overtime fields (expanded variants for all possible Gemini outputs)
-        "reg": "reg",
-        "reg.": "reg",
-        "reg_assignment": "regular_assignment",
-        "assignment": "pass_number",
-        "pass": "pass_number",
-        "PASS": "pass_number",  # Direct mapping for original key
-        "rc": "rc_number",
-        "rc.": "rc_number",
-        "rc#": "rc_number",
-        "rc_#": "rc_number",
-        "rc number": "rc_number",
-        "rc ": "rc_number",  # Handle RC with space
-        "RC#": "rc_number",  # Direct mapping for original key
-        "employee_name": "employee_name",
-        "employee name": "employee_name",
-        "EMPLOYEE NAME": "employee_name",  # Direct mapping for original key
-        "job": "job_number",
-        "job.": "job_number",
-        "job#": "job_number",
-        "job_#": "job_number",
-        "job number": "job_number",
-        "JOB #": "job_number",  # Direct mapping for original key
-        "overtime_location": "overtime_location",
-        "overtime location": "overtime_location",
-        "OVERTIME LOCATION": "overtime_location",  # Direct mapping for original key
-        "report_loc": "report_loc",
-        "report_loc.": "report_loc",
-        "report_loc..": "report_loc",  # Handle double periods
-        "report location": "report_loc",
-        "REPORT LOC.": "report_loc",  # Direct mapping for original key
-        "report_time": "report_time",
-        "report time": "report_time",
-        "REPORT TIME": "report_time",  # Direct mapping for original key
-        "relief_time": "relief_time",
-        "relief time": "relief_time",
-        "RELIEF TIME": "relief_time",  # Direct mapping for original key
-        "overtime_hours": "overtime_hours",
-        "overtime hours": "overtime_hours",
-        "OVERTIME HOURS": "overtime_hours",  # Direct mapping for original key
-        "date": "todays_date",
-        "date_of_overtime": "date_of_overtime",
-        "date of overtime": "date_of_overtime",
-        "rdo's": "rdos",
-        "rdos": "rdos",
-        "sm": "rdos",  # Handle S/M field
-        "S/M": "rdos",  # Direct mapping for original key
-        "reason_for_overtime": "reason_for_overtime",
-        "reason for overtime": "reason_for_overtime",
-        "REASON FOR OVERTIME": "reason_for_overtime",  # Direct mapping for original key
-        "comments": "comments",
-        "COMMENTS": "comments",  # Direct mapping for original key
-        "acct": "acct_number",
-        "acct.": "acct_number",
-        "acct#": "acct_number",
-        "acct_#": "acct_number",
-        "acct number": "acct_number",
-        "ACCT #": "acct_number",  # Direct mapping for original key
-        "amount": "amount",
-        "supervisors_signature": "superintendent_authorization_signature",
-        "supervisor's_signature": "superintendent_authorization_signature",
-        "superintendent_authorization_signature": "superintendent_authorization_signature",
-        "superintendent's_authorization_-_signature": "superintendent_authorization_signature",
-        "superintendent_authorization_pass": "superintendent_authorization_pass",
-        "superintendent's_authorization_-_pass": "superintendent_authorization_pass",
-        "superintendent_authorization_date": "superintendent_authorization_date",
-        "superintendent's_authorization_-_date": "superintendent_authorization_date",
-        "entered_into_uts": "entered_into_uts",
-        # Additional mappings for specific Gemini output formats
-        "reg_assignment": "regular_assignment",
-        "report_loc": "report_loc",
-        "report loc": "report_loc",
-        "report location": "report_loc",
-        "overtime_location": "overtime_location",
-        "overtime location": "overtime_location",
-        "report_time": "report_time",
-        "report time": "report_time",
-        "relief_time": "relief_time",
-        "relief time": "relief_time",
-        "overtime_hours": "overtime_hours",
-        "overtime hours": "overtime_hours",
-        "rdo's": "rdos",
-        "rdos": "rdos",
-        "reason_for_overtime": "reason_for_overtime",
-        "reason for overtime": "reason_for_overtime",
-        "acct": "acct_number",
-        "acct#": "acct_number",
-        "acct number": "acct_number",
-        "superintendent's_authorization": "superintendent_authorization",
-        # Exception claim (hourly) fields
-        "regular_assignment": "regular_assignment",
-        "report": "report",
-        "relief": "relief",
-        "todays_date": "todays_date",
-        "today's_date": "todays_date",
-        "pass_number": "pass_number",
-        "title": "title",
-        "TITLE": "title",  # Direct mapping for original key
-        "employee_name": "employee_name",
-        "rdos": "rdos",
-        "actual_ot_date": "actual_ot_date",
-        "div": "div",
-        "code": "exception_code",
-        "line_location": "line_location",
-        "run_no": "run_no",
-        "exception_time_from_hh": "exception_time_from_hh",
-        "exception_time_from_mm": "exception_time_from_mm",
-        "exception_time_to_hh": "exception_time_to_hh",
-        "exception_time_to_mm": "exception_time_to_mm",
-        "overtime_hh": "overtime_hh",
-        "overtime_mm": "overtime_mm",
-        "ta_job_no": "ta_job_no",
-        "comments": "comments",
-        "oto": "oto",
-        "oto_amount_saved_hh": "oto_amount_saved_hh",
-        "oto_amount_saved_mm": "oto_amount_saved_mm",
-        "entered_in_uts_yes": "entered_in_uts_yes",
-        "entered_in_uts_no": "entered_in_uts_no",
-        "supv_name": "supervisor_name",
-        "supervisor_name": "supervisor_name",
-        "pass_no": "supervisor_pass_no",
-        "supervisor_pass_no": "supervisor_pass_no",
-        "job_": "job_number",
-        "rc_": "rc_number",
-        "acct_": "acct_number",
-        "report_time": "report_time",
-        "relief_time": "relief_time",
-        "overtime_hours": "overtime_hours",
-        "superintendent_s_authorization___pass": "superintendent_authorization_pass",
-        "superintendent_s_authorization___date": "superintendent_authorization_date",
-        "superintendent_s_authorization___signature": "superintendent_authorization_signature",
-        "entered_into_uts": "entered_into_uts"
-    }
-    # Robust time/location field variants
-    key_map.update({
-        "report_time": "report_time",
-        "report time": "report_time",
-        "report-time": "report_time",
-        "report.time": "report_time",
-        "reporttime": "report_time",
-        "relief_time": "relief_time",
-        "relief time": "relief_time",
-        "relief-time": "relief_time",
-        "relief.time": "relief_time",
-        "relieftime": "relief_time",
-        "report_loc": "report_loc",
-        "report loc": "report_loc",
-        "report-loc": "report_loc",
-        "report.loc": "report_loc",
-        "reportloc": "report_loc",
-        "overtime_location": "overtime_location",
-        "overtime location": "overtime_location",
-        "overtime-location": "overtime_location",
-        "overtime.location": "overtime_location",
-        "overtimelocation": "overtime_location",
-    })
-    # Checkbox mapping
-    checkbox_map = {
-        "rdo": "reason_rdo",
-        "absentee_coverage": "reason_absentee_coverage",
-        "no_lunch": "reason_no_lunch",
-        "early_report": "reason_early_report",
-        "late_clear": "reason_late_clear",
-        "save_as_oto": "reason_save_as_oto",
-        "capital_support_go": "reason_capital_support_go",
-        "other": "reason_other"
-    }
-    form_data = {field: False if field.startswith('reason_') else '' for field in all_fields}
-    row = {}
-    # Flatten nested dicts if needed
-    def flatten(d, parent_key=""):
-        items = []
-        for k, v in d.items():
-            new_key = f"{parent_key}_{k}" if parent_key else k
-            if isinstance(v, dict):
-                # Special handling for supervisor nested fields
-                if parent_key.lower().startswith("superintendent's_authorization") or k.lower().startswith("superintendent's_authorization"):
-                    # Map nested keys directly to their backend fields
-                    for subk, subv in v.items():
-                        subkey_norm = normalize_key(f"superintendent's_authorization_-_{subk}")
-                        items.append((subkey_norm, subv))
-                elif k.lower() == "superintendent's_authorization":
-                    # Handle the nested superintendent authorization object
-                    for subk, subv in v.items():
-                        subkey_norm = normalize_key(f"superintendent's_authorization_-_{subk}")
-                        items.append((subkey_norm, subv))
-                else:
-                    items.extend(flatten(v, new_key).items())
-            else:
-                items.append((new_key, v))
-        return dict(items)
-    flat_data = flatten(data)
-    print("FLATTENED GEMINI DATA:", flat_data)
-    # Enhanced field mapping using the comprehensive mapping dictionary
-    for k, v in flat_data.items():
-        norm_k = normalize_key(k)
-        print(f"Mapping: '{k}' -> '{norm_k}' = '{v}'")
-        
-        # Use enhanced mapping first
-        mapped = False
-        for target_field, source_variants in enhanced_mapping.items():
-            if k in source_variants or norm_k in [normalize_key(variant) for variant in source_variants]:
-                form_data[target_field] = v
-                print(f"  Enhanced mapping: '{k}' -> '{target_field}' = '{v}'")
-                mapped = True
-                break
-        
-        # If not mapped by enhanced mapping, use legacy logic
-        if not mapped:
-            # Handle nested employee data first
-            if k == "employee_pass_number" or k == "employee_pass":
-                form_data["pass_number"] = v
-            elif k == "employee_name" or k == "employee_name":
-                form_data["employee_name"] = v
-            elif k == "employee_title" or k == "employee_title":
-                form_data["title"] = v
-            elif k == "employee_rdoe" or k == "employee_rdo":
-                form_data["rdos"] = v
-            elif k == "employee_rc_number" or k == "employee_rc":
-                form_data["rc_number"] = v
-            
-            # Handle direct field mappings for merged data
-            elif k == "name":
-                form_data["employee_name"] = v
-            elif k == "rduos" or k == "rdo":
-                form_data["rdos"] = v
-            
-            # Handle new camelCase field names
-            elif k == "employeeName":
-                form_data["employee_name"] = v
-            elif k == "passNumber":
-                form_data["pass_number"] = v
-            elif k == "rDOs":
-                form_data["rdos"] = v
-            elif k == "rcNumber":
-                form_data["rc_number"] = v
-            elif k == "jobNumber":
-                form_data["job_number"] = v
-            elif k == "overtimeLocation":
-                form_data["overtime_location"] = v
-            elif k == "reportTime":
-                form_data["report_time"] = v
-            elif k == "reliefTime":
-                form_data["relief_time"] = v
-            elif k == "overtimeHours":
-                form_data["overtime_hours"] = v
-            elif k == "accountNumber":
-                form_data["acct_number"] = v
-            elif k == "reportLocation":
-                form_data["report_loc"] = v
-        
-        # Handle various date field formats
-        elif k in ["DATE", "date", "s_m", "W/T", "w_t"]:
-            # Map various date fields to date_of_overtime
-            if v and str(v).strip() and str(v).strip() != "None":
-                form_data["date_of_overtime"] = str(v).strip()
-                print(f"Mapped date field '{k}' -> date_of_overtime: {v}")
-        
-        # Handle assignment/job number variations
-        elif k in ["ASSIGNMENT", "assignment"]:
-            if v and str(v).strip() and str(v).strip() != "None":
-                form_data["pass_number"] = str(v).strip()
-                print(f"Mapped assignment field '{k}' -> pass_number: {v}")
-        elif k in ["RBG", "rbg"]:
-            if v and str(v).strip() and str(v).strip() != "None":
-                form_data["job_number"] = str(v).strip()
-                print(f"Mapped RBG field '{k}' -> job_number: {v}")
-        
-        # Handle reason_for_overtime as string or list
-        elif norm_k == "reason_for_overtime":
-            if isinstance(v, str):
-                v = [v]
-            for reason in v:
-                reason_norm = normalize_key(reason)
-                if reason_norm in checkbox_map:
-                    form_data[checkbox_map[reason_norm]] = True
-        # Handle reason field mapping for supervisor forms
-        elif norm_k == "reason":
-            # Map reason to appropriate checkbox
-            reason_lower = str(v).lower()
-            if "rdo" in reason_lower:
-                form_data["reason_rdo"] = True
-            elif "absentee" in reason_lower or "coverage" in reason_lower:
-                form_data["reason_absentee_coverage"] = True
-            elif "lunch" in reason_lower:
-                form_data["reason_no_lunch"] = True
-            elif "early" in reason_lower and "report" in reason_lower:
-                form_data["reason_early_report"] = True
-            elif "late" in reason_lower and "clear" in reason_lower:
-                form_data["reason_late_clear"] = True
-            elif "oto" in reason_lower:
-                form_data["reason_save_as_oto"] = True
-            elif "capital" in reason_lower or "support" in reason_lower:
-                form_data["reason_capital_support_go"] = True
-            else:
-                form_data["reason_other"] = True
-        
-        # Handle new reasonForOvertime object format
-        elif k == "reasonForOvertime" and isinstance(v, dict):
-            # Map boolean values from reasonForOvertime object
-            if v.get('rdo'):
-                form_data["reason_rdo"] = True
-            if v.get('absenteeCoverage'):
-                form_data["reason_absentee_coverage"] = True
-            if v.get('noLunch'):
-                form_data["reason_no_lunch"] = True
-            if v.get('earlyReport'):
-                form_data["reason_early_report"] = True
-            if v.get('lateClear'):
-                form_data["reason_late_clear"] = True
-            if v.get('saveAsOto'):
-                form_data["reason_save_as_oto"] = True
-            if v.get('capitalSupportGo'):
-                form_data["reason_capital_support_go"] = True
-            if v.get('other'):
-                form_data["reason_other"] = True
-        # Custom logic for ambiguous keys
-        elif norm_k == "pass":
-            if "superintendent_authorization" in k.lower():
-                form_data["superintendent_authorization_pass"] = v
-            else:
-                form_data["pass_number"] = v
-        elif norm_k == "date":
-            if "superintendent_authorization" in k.lower():
-                form_data["superintendent_authorization_date"] = v
-            elif "date_of_overtime" in k.lower():
-                form_data["date_of_overtime"] = v
-            elif form_type == 'supervisor':
-                form_data["todays_date"] = v
-            # else: do not map 'date' for hourly forms
-        elif norm_k == "job":
-            form_data["job_number"] = v
-        elif norm_k == "rc":
-            form_data["rc_number"] = v
-        elif norm_k == "rc_number":
-            form_data["rc_number"] = v
-        elif k in ["RC#", "RC#", "rc#"]:
-            form_data["rc_number"] = v
-        elif norm_k == "report_loc":
-            form_data["report_loc"] = v
-        elif norm_k == "reg_assignment":
-            form_data["regular_assignment"] = v
-        elif norm_k == "overtime_location":
-            form_data["overtime_location"] = v
-        elif norm_k == "report_time":
-            form_data["report_time"] = v
-        elif norm_k == "relief_time":
-            form_data["relief_time"] = v
-        elif norm_k == "overtime_hours":
-            form_data["overtime_hours"] = v
-        elif norm_k == "rdos":
-            form_data["rdos"] = v
-        elif norm_k == "sm":
-            form_data["rdos"] = v
-        elif norm_k == "acct":
-            form_data["acct_number"] = v
-        elif norm_k == "account_number":
-            form_data["acct_number"] = v
-        elif norm_k == "report_location":
-            form_data["report_loc"] = v
-        elif norm_k == "superintendents_authorization":
-            # Handle combined superintendent authorization field (e.g., "713026 07/06/25")
-            if isinstance(v, str) and ' ' in v:
-                parts = v.split(' ', 1)  # Split on first space
-                if len(parts) == 2:
-                    form_data["superintendent_authorization_pass"] = parts[0]
-                    form_data["superintendent_authorization_date"] = parts[1]
-                else:
-                    form_data["superintendent_authorization_pass"] = v
-            else:
-                form_data["superintendent_authorization_pass"] = v
-        elif norm_k in key_map:
-            form_data[key_map[norm_k]] = v
-        elif norm_k in checkbox_map:
-            form_data[checkbox_map[norm_k]] = bool(v)
-        elif norm_k.startswith("reason_for_overtime_"):
-            # e.g. reason_for_overtime_rdo: True
-            reason = norm_k.replace("reason_for_overtime_", "")
-            if reason in checkbox_map:
-                form_data[checkbox_map[reason]] = bool(v)
-        else:
-            print(f"Unmapped Gemini key: {k} -> {v}")
-    # Clean the form data to handle None values and lists
-    for key, value in form_data.items():
-        if value is None:
-            form_data[key] = ''
-        elif isinstance(value, list):
-            form_data[key] = ', '.join(str(item) for item in value if item is not None)
-        elif isinstance(value, bool):
-            form_data[key] = 1 if value else 0
-        elif key.startswith('reason_') and isinstance(value, str):
-            # Convert string boolean values to integers for reason fields
-            form_data[key] = 1 if value.lower() in ['true', '1', 'yes', 'on'] else 0
-        else:
-            form_data[key] = str(value) if value is not None else ''
-    print("FINAL FORM DATA (mapped):", form_data)
-    # Log dashboard-relevant fields
-    dashboard_fields = ['overtime_hours', 'job_number', 'title', 'report_loc', 'overtime_location']
-    for field in dashboard_fields:
-        print(f"DASHBOARD FIELD {field}: {form_data.get(field)}")
-
-    # --- PATCH: Ensure dashboard-relevant mapped fields are always set using flexible lookup from original Gemini data ---
-    dashboard_fields = {
-        'overtime_hours': [
-            'overtime_hours', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime', 'overtime total', 'ot total', 'ot time', 'total ot', 'total_ot', 'ot time (hh:mm)', 'overtime (hh:mm)'
-        ],
-        'job_number': [
-            'job_number', 'job no', 'job_no', 'job', 'job#', 'job number', 'ta_job_no', 'ta job no', 'jobnum', 'jobnumber', 'job id', 'jobid'
-        ],
-        'title': [
-            'title', 'position', 'job_title', 'role', 'job title', 'employee_title', 'employee title'
-        ],
-        'report_loc': [
-            'report_loc', 'report location', 'location', 'reportloc', 'report', 'loc', 'report station', 'station', 'reporting location'
-        ],
-        'overtime_location': [
-            'overtime_location', 'overtime location', 'overtimelocation', 'ot_location', 'otloc', 'location', 'ot location', 'ot station', 'overtime station'
-        ]
-    }
-    for field, variants in dashboard_fields.items():
-        if not form_data.get(field):
-            value = get_flexible_field(data, variants)
-            if value:
-                form_data[field] = value
-    # Log the final values for dashboard fields
-    print("DASHBOARD FIELD VALUES:")
-    for field in dashboard_fields:
-        print(f"  {field}: {form_data.get(field)}")
-    
-    # Debug: Show the final form_data after all processing
-    print("DEBUG: Final form_data after dashboard field lookup:")
-    for key, value in form_data.items():
-        if value and key in ['pass_number', 'employee_name', 'title', 'job_number', 'rc_number', 'overtime_hours', 'report_loc', 'overtime_location']:
-            print(f"  {key}: {value}")
-
-    # For exception claim (hourly) forms, build a row if relevant fields are present
-    row_fields = [
-        "exception_code", "line_location", "run_no",
-        "exception_time_from_hh", "exception_time_from_mm",
-        "exception_time_to_hh", "exception_time_to_mm",
-        "overtime_hh", "overtime_mm",
-        "bonus_hh", "bonus_mm",
-        "nite_diff_hh", "nite_diff_mm",
-        "ta_job_no"
-    ]
-    row = {field: form_data.get(field, '') for field in row_fields}
-    # Add a row if ANY of the key fields are present (not just code/location/run_no)
-    if any(str(v).strip() for v in row.values()):
-        rows = [row]
-    else:
-        rows = []
-    # Debug: Show what we're returning from process_single_form
-    print("DEBUG: Returning from process_single_form:")
-    for key, value in form_data.items():
-        if value and key in ['pass_number', 'employee_name', 'title', 'job_number', 'rc_number', 'overtime_hours', 'report_loc', 'overtime_location']:
-            print(f"  {key}: {value}")
-    
-    return form_data, rows
-
 def is_duplicate_form(form_data, form_type):
     """
-    Check if a form is a duplicate based on key fields.
-    Returns True if duplicate found, False otherwise.
+    Check if a form with the same natural key (see form_values.form_fingerprint) is already stored.
+    One lookup on the unique fingerprint index; store_exception_form enforces the same rule on insert.
     """
+    fingerprint = form_fingerprint(form_data, form_type)
+    if not fingerprint:
+        return False
     try:
-        import sqlite3
-        
-        # For Pure Extraction mode, be very lenient - only check for exact duplicates
-        if PURE_GEMINI_EXTRACTION:
-            print("Pure Extraction mode: Skipping strict duplicate detection")
-            return False
-        
-        # Key fields for duplicate detection
-        pass_number = form_data.get('pass_number', '')
-        employee_name = form_data.get('employee_name', '')
-        overtime_hours = form_data.get('overtime_hours', '')
-        date_of_overtime = form_data.get('date_of_overtime', '')
-        job_number = form_data.get('job_number', '')
-        
-        # If we don't have the key fields, we can't check for duplicates
-        if not pass_number or not overtime_hours or not date_of_overtime:
-            print(f"Cannot check for duplicates - missing key fields: pass_number={pass_number}, overtime_hours={overtime_hours}, date_of_overtime={date_of_overtime}")
-            return False
-        
         with sqlite3.connect('forms.db', timeout=10) as conn:
-            c = conn.cursor()
-            
-            # Check for existing forms with same key fields
-            query = '''
-                SELECT id, employee_name, overtime_hours, date_of_overtime, job_number 
-                FROM exception_forms 
-                WHERE form_type = ? 
-                AND pass_number = ? 
-                AND overtime_hours = ? 
-                AND date_of_overtime = ?
-            '''
-            
-            c.execute(query, (form_type, pass_number, overtime_hours, date_of_overtime))
-            existing_forms = c.fetchall()
-            
-            if existing_forms:
-                print(f"Duplicate detected: {len(existing_forms)} existing form(s) with same pass_number={pass_number}, overtime_hours={overtime_hours}, date_of_overtime={date_of_overtime}")
-                for existing in existing_forms:
-                    print(f"  Existing form ID {existing[0]}: {existing[1]} - {existing[2]} hours on {existing[3]} (Job: {existing[4]})")
-                return True
-            
-            # Additional check: if job_number is also the same, it's definitely a duplicate
-            if job_number:
-                query_with_job = '''
-                    SELECT id, employee_name, overtime_hours, date_of_overtime, job_number 
-                    FROM exception_forms 
-                    WHERE form_type = ? 
-                    AND pass_number = ? 
-                    AND overtime_hours = ? 
-                    AND date_of_overtime = ? 
-                    AND job_number = ?
-                '''
-                
-                c.execute(query_with_job, (form_type, pass_number, overtime_hours, date_of_overtime, job_number))
-                existing_with_job = c.fetchall()
-                
-                if existing_with_job:
-                    print(f"Duplicate detected (with job number): {len(existing_with_job)} existing form(s) with same pass_number={pass_number}, overtime_hours={overtime_hours}, date_of_overtime={date_of_overtime}, job_number={job_number}")
-                    return True
-            
-            print(f"No duplicates found for: {employee_name} - {overtime_hours} hours on {date_of_overtime}")
-            return False
-            
-    except Exception as e:
+            existing = conn.execute('SELECT id FROM exception_forms WHERE fingerprint = ?', (fingerprint,)).fetchone()
+    except sqlite3.Error as e:
         print(f"Error checking for duplicates: {e}")
         # If we can't check for duplicates, allow the form to be processed
         return False
+    if existing:
+        print(f"Duplicate detected: form {existing[0]} has the same pass_number={form_data.get('pass_number')}, overtime_hours={form_data.get('overtime_hours')}, date_of_overtime={form_data.get('date_of_overtime')}, job_number={form_data.get('job_number')}")
+        return True
+    return False
 
 def is_blank_or_crossed_out(image_path):
     # Enhanced blank/crossed-out detection: be less aggressive to capture more forms
@@ -1136,22 +548,6 @@ def is_blank_or_crossed_out(image_path):
         # If we can't determine, process the segment anyway
         return False
 
-# Flexible field lookup for raw JSON
-
-def get_flexible_field(data, possible_keys):
-    """
-    Search for a value in a dict by a list of possible field names (case-insensitive, with normalization).
-    Handles flat dicts only. For nested dicts, extend as needed.
-    """
-    def normalize(s):
-        return s.lower().replace(' ', '').replace('_', '').replace('-', '')
-    norm_data = {normalize(k): v for k, v in data.items()}
-    for key in possible_keys:
-        norm_key = normalize(key)
-        if norm_key in norm_data:
-            return norm_data[norm_key]
-    return None
-
 # --- PATCH: Set file_name using flexible lookup for both mapped and pure extraction modes ---
 def get_flexible_file_name(form_data, raw_json=None, fallback=None):
     file_name = form_data.get('pass_number')
@@ -1166,69 +562,37 @@ def get_flexible_file_name(form_data, raw_json=None, fallback=None):
         file_name = fallback
     return str(file_name) if file_name else 'N/A'
 
-@app.route('/upload/hourly', methods=['POST'])
+@api.route('/upload/hourly', methods=['POST'])
 def upload_hourly_file():
     return handle_upload(form_type='hourly')
 
-@app.route('/upload/supervisor', methods=['POST'])
+@api.route('/upload/supervisor', methods=['POST'])
 def upload_supervisor_file():
     return handle_upload(form_type='supervisor')
 
-@app.route('/cleanup-duplicates', methods=['POST'])
+@api.route('/cleanup-duplicates', methods=['POST'])
 def cleanup_duplicates():
     """
-    Clean up duplicate forms in the database.
-    Keeps the first occurrence and removes duplicates.
+    Remove duplicate forms, keeping the oldest copy of each.
+    Body: {form_type, dry_run}. A dry run returns the counts directly; a real
+    cleanup runs in the background in small chunks. Poll GET /cleanup-duplicates for progress.
     """
-    try:
-        import sqlite3
-        
-        with sqlite3.connect('forms.db', timeout=10) as conn:
-            c = conn.cursor()
-            
-            # Find and remove duplicates based on key fields
-            cleanup_query = '''
-                DELETE FROM exception_forms 
-                WHERE id NOT IN (
-                    SELECT MIN(id) 
-                    FROM exception_forms 
-                    WHERE form_type = 'supervisor'
-                    GROUP BY pass_number, overtime_hours, date_of_overtime, job_number
-                    HAVING pass_number IS NOT NULL 
-                    AND pass_number != '' 
-                    AND overtime_hours IS NOT NULL 
-                    AND overtime_hours != ''
-                    AND date_of_overtime IS NOT NULL 
-                    AND date_of_overtime != ''
-                )
-                AND form_type = 'supervisor'
-            '''
-            
-            # Get count before cleanup
-            c.execute("SELECT COUNT(*) FROM exception_forms WHERE form_type='supervisor'")
-            count_before = c.fetchone()[0]
-            
-            # Execute cleanup
-            c.execute(cleanup_query)
-            deleted_count = c.rowcount
-            
-            # Get count after cleanup
-            c.execute("SELECT COUNT(*) FROM exception_forms WHERE form_type='supervisor'")
-            count_after = c.fetchone()[0]
-            
-            conn.commit()
-            
-            return jsonify({
-                'message': 'Duplicate cleanup completed',
-                'deleted_count': deleted_count,
-                'count_before': count_before,
-                'count_after': count_after
-            }), 200
-            
-    except Exception as e:
-        return jsonify({'error': f'Cleanup failed: {str(e)}'}), 500
+    data = request.get_json(silent=True) or {}
+    form_type = data.get('form_type')
+    if data.get('dry_run'):
+        try:
+            return jsonify({'message': 'Duplicate cleanup dry run', 'stats': run_duplicate_cleanup(form_type=form_type, dry_run=True)}), 200
+        except Exception as e:
+            return jsonify({'error': f'Cleanup failed: {str(e)}'}), 500
+    if not start_cleanup_job(form_type=form_type):
+        return jsonify({'error': 'A duplicate cleanup is already running', 'cleanup': get_cleanup_status()}), 409
+    return jsonify({'cleanup': get_cleanup_status()}), 202
 
-@app.route('/enable-pure-extraction', methods=['POST'])
+@api.route('/cleanup-duplicates', methods=['GET'])
+def cleanup_duplicates_status():
+    return jsonify({'cleanup': get_cleanup_status()})
+
+@api.route('/enable-pure-extraction', methods=['POST'])
 def enable_pure_extraction():
     """
     Enable Pure Extraction mode to capture everything from PDFs.
@@ -1246,7 +610,7 @@ def enable_pure_extraction():
     except Exception as e:
         return jsonify({'error': f'Failed to enable Pure Extraction: {str(e)}'}), 500
 
-@app.route('/disable-pure-extraction', methods=['POST'])
+@api.route('/disable-pure-extraction', methods=['POST'])
 def disable_pure_extraction():
     """
     Disable Pure Extraction mode and return to normal mapped extraction.
@@ -1267,6 +631,8 @@ def disable_pure_extraction():
 # Refactor the upload logic into a helper
 
 def handle_upload(form_type):
+    import pdfplumber
+    from PIL import Image
     try:
         files = request.files.getlist('files')
         if not files:
@@ -1276,12 +642,12 @@ def handle_upload(form_type):
             else:
                 return jsonify({'error': 'No file(s) part in the request.'}), 400
 
-        from db import store_exception_form, log_audit
         username = request.form.get('username') or request.args.get('username') or (request.json.get('username') if request.is_json else None)
         if not username:
             username = 'unknown'
         success = 0
         failed = 0
+        duplicates = 0
         for file in files:
             if file.filename == '':
                 failed += 1
@@ -1390,6 +756,7 @@ def handle_upload(form_type):
                             print(f"Page {i+1} has {processed_segments} unique segments to process")
                             
                             # Process each unique segment with enhanced error handling
+                            page_forms = []
                             for j, segment_data in enumerate(unique_segments):
                                 segment_img = Image.open(io.BytesIO(segment_data))
                                 segment_path = os.path.join(target_folder, f"{os.path.splitext(file.filename)[0]}_page{i+1}_segment{j+1}.png")
@@ -1419,53 +786,65 @@ def handle_upload(form_type):
                                     forms_data, raw_gemini_json = [], ''
                                     continue
                                 
-                                # Process each form from the response with deduplication
                                 for form_data, rows, individual_json in forms_data:
-                                    # Use the individual_json for the raw_gemini_json
-                                    form_data['raw_gemini_json'] = individual_json
-                                    # --- PATCH: Set file_name using flexible lookup for both mapped and pure extraction modes ---
-                                    form_data['file_name'] = get_flexible_file_name(form_data, raw_gemini_json, os.path.basename(segment_path))
-                                    if form_data:
-                                        # For Pure Extraction mode, be more lenient with required fields
-                                        if PURE_GEMINI_EXTRACTION:
-                                            required_form_fields = [
-                                                'status', 'file_name'  # Only absolutely essential fields
-                                            ]
-                                        else:
-                                            required_form_fields = [
-                                                'pass_number', 'title', 'employee_name', 'rdos', 'actual_ot_date', 'div',
-                                                'comments', 'supervisor_name', 'supervisor_pass_no', 'oto', 'oto_amount_saved',
-                                                'entered_in_uts', 'regular_assignment', 'report', 'relief', 'todays_date', 'status', 'file_name'
-                                            ]
-                                        for key in required_form_fields:
-                                            if key not in form_data:
-                                                form_data[key] = 'N/A'
-                                        form_data['status'] = 'processed'
-                                        
-                                        # Check for duplicates based on overtime hours and date
-                                        # SKIP duplicate detection for Pure Extraction mode - we want everything!
-                                        if not PURE_GEMINI_EXTRACTION and is_duplicate_form(form_data, form_type):
-                                            print(f"Skipping duplicate form: {form_data.get('employee_name', 'Unknown')} - {form_data.get('overtime_hours', 'Unknown hours')} on {form_data.get('date_of_overtime', 'Unknown date')}")
-                                            continue
-                                        
+                                    page_forms.append((form_data, rows, individual_json, raw_gemini_json, segment_path))
+                            
+                            # Overlapping crops return the same slips several times; store each slip once
+                            page_forms, merged = dedupe_entries(page_forms, form_type)
+                            if merged:
+                                print(f"Page {i+1}: merged {merged} duplicate entries from overlapping segments")
+                                duplicates += merged
+                            
+                            # Process each form from the page
+                            for form_data, rows, individual_json, raw_gemini_json, segment_path in page_forms:
+                                # Use the individual_json for the raw_gemini_json
+                                form_data['raw_gemini_json'] = individual_json
+                                # --- PATCH: Set file_name using flexible lookup for both mapped and pure extraction modes ---
+                                form_data['file_name'] = get_flexible_file_name(form_data, raw_gemini_json, os.path.basename(segment_path))
+                                if form_data:
+                                    # For Pure Extraction mode, be more lenient with required fields
+                                    if PURE_GEMINI_EXTRACTION:
+                                        required_form_fields = [
+                                            'status', 'file_name'  # Only absolutely essential fields
+                                        ]
                                     else:
-                                        form_data = {key: '' for key in required_form_fields}
-                                        form_data['file_name'] = os.path.basename(img_path)
-                                        form_data['comments'] = f"Gemini extraction failed for {img_path}. Output: {gemini_output if gemini_output else 'None'}"
-                                        form_data['status'] = 'error'
-                                        if not rows:
-                                            rows = []
-                                    upload_date = datetime.datetime.now().isoformat()
-                                    form_id = store_exception_form(form_data, rows, username, form_type=form_type, upload_date=upload_date)
-                                    if not form_id:
-                                        failed += 1
+                                        required_form_fields = [
+                                            'pass_number', 'title', 'employee_name', 'rdos', 'actual_ot_date', 'div',
+                                            'comments', 'supervisor_name', 'supervisor_pass_no', 'oto', 'oto_amount_saved',
+                                            'entered_in_uts', 'regular_assignment', 'report', 'relief', 'todays_date', 'status', 'file_name'
+                                        ]
+                                    for key in required_form_fields:
+                                        if key not in form_data:
+                                            form_data[key] = 'N/A'
+                                    form_data['status'] = 'processed'
+                                    
+                                    # Overlapping segments often extract the same slip again
+                                    if is_duplicate_form(form_data, form_type):
+                                        print(f"Skipping duplicate form: {form_data.get('employee_name', 'Unknown')} - {form_data.get('overtime_hours', 'Unknown hours')} on {form_data.get('date_of_overtime', 'Unknown date')}")
+                                        duplicates += 1
                                         continue
-                                    # Safely get pass_number for audit log
-                                    pass_number = 'N/A'
-                                    if isinstance(form_data, dict):
-                                        pass_number = form_data.get('pass_number', 'N/A')
-                                    log_audit(username, 'upload', 'form', form_id, f"Form uploaded: {pass_number}")
-                                    success += 1
+                                    
+                                else:
+                                    form_data = {key: '' for key in required_form_fields}
+                                    form_data['file_name'] = os.path.basename(img_path)
+                                    form_data['comments'] = f"Gemini extraction failed for {img_path}. Output: {gemini_output if gemini_output else 'None'}"
+                                    form_data['status'] = 'error'
+                                    if not rows:
+                                        rows = []
+                                upload_date = datetime.datetime.now().isoformat()
+                                form_id = store_exception_form(form_data, rows, username, form_type=form_type, upload_date=upload_date)
+                                if not form_id:
+                                    if form_data.get('duplicate_of'):
+                                        duplicates += 1
+                                    else:
+                                        failed += 1
+                                    continue
+                                # Safely get pass_number for audit log
+                                pass_number = 'N/A'
+                                if isinstance(form_data, dict):
+                                    pass_number = form_data.get('pass_number', 'N/A')
+                                log_audit(username, 'upload', 'form', form_id, f"Form uploaded: {pass_number}")
+                                success += 1
                     continue  # Skip the rest of the loop for supervisor PDFs
 
                 # Enhanced processing for hourly forms to extract maximum overtime slips
@@ -1493,7 +872,7 @@ def handle_upload(form_type):
                         
                         # Combine all extracted forms
                         if all_forms_data:
-                            gemini_output = json.dumps({"entries": [form[0] for form in all_forms_data]})
+                            gemini_output = fast_json.dumps({"entries": [form[0] for form in all_forms_data]})
                             print(f"Successfully extracted {len(all_forms_data)} forms from multiple regions")
                         else:
                             gemini_output = None
@@ -1527,6 +906,10 @@ def handle_upload(form_type):
                 print(gemini_output)
                 print("--- END Gemini Output ---")
                 forms_data, raw_gemini_json = process_gemini_extraction_dual(gemini_output, form_type=form_type) if gemini_output else ([], '')
+                forms_data, merged = dedupe_entries(forms_data, form_type)
+                if merged:
+                    print(f"Merged {merged} duplicate entries from {file.filename}")
+                    duplicates += merged
                 
                 # Process each form from the response
                 for form_data, rows, individual_json in forms_data:
@@ -1557,7 +940,10 @@ def handle_upload(form_type):
                     print(f"DEBUG: rows content: {rows}")
                     form_id = store_exception_form(form_data, rows, username, form_type=form_type, upload_date=upload_date)
                     if not form_id:
-                        failed += 1
+                        if form_data.get('duplicate_of'):
+                            duplicates += 1
+                        else:
+                            failed += 1
                         continue
                     # Safely get pass_number for audit log
                     pass_number = 'N/A'
@@ -1575,12 +961,12 @@ def handle_upload(form_type):
                 import traceback
                 print(f"DEBUG: Full traceback: {traceback.format_exc()}")
                 failed += 1
-        return jsonify({'message': 'Batch upload complete', 'success': success, 'failed': failed})
+        return jsonify({'message': 'Batch upload complete', 'success': success, 'failed': failed, 'duplicates': duplicates})
     except Exception as e:
         print(f"Error in handle_upload: {e}")
         return jsonify({'error': str(e)}), 500
 
-# @app.route('/api/register', methods=['POST'])
+# @api.route('/api/register', methods=['POST'])
 # def register():
 #     data = request.json
 #     print("Register data received:", data)
@@ -1590,7 +976,7 @@ def handle_upload(form_type):
 #     print(f"User {data['username']} registration failed: already exists")
 #     return jsonify({"error": "Username already exists"}), 409
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     print("Login data received:", data)
@@ -1612,7 +998,7 @@ def login():
     print("Login failed")
     return jsonify({"error": "Invalid credentials"}), 401
 
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     data = request.json
     print("Registration data received:", data)
@@ -1643,7 +1029,8 @@ def register():
         print("Registration failed - username already exists")
         return jsonify({"error": "Username already exists"}), 409
 
-@app.route('/api/stats', methods=['GET'])
+@api.route('/api/stats', methods=['GET'])
+@cached_response()
 def get_stats():
     with sqlite3.connect('forms.db', timeout=10) as conn:
         c = conn.cursor()
@@ -1666,7 +1053,8 @@ def get_stats():
         'total_job_numbers': total_job_numbers
     })
 
-@app.route('/api/dashboard', methods=['GET'])
+@api.route('/api/dashboard', methods=['GET'])
+@cached_response()
 def get_dashboard_data():
     try:
         form_type = request.args.get('form_type')
@@ -1679,20 +1067,23 @@ def get_dashboard_data():
             # Get forms for statistics calculation with extraction mode filter
             if form_type:
                 if extraction_mode_filter == 'pure':
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed" AND form_type = ? AND (extraction_mode = ? OR extraction_mode = "combined")', (form_type, extraction_mode_filter))
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed" AND form_type = ? AND (extraction_mode = ? OR extraction_mode = "combined")', (form_type, extraction_mode_filter))
                 elif extraction_mode_filter == 'mapped':
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed" AND form_type = ? AND (extraction_mode = ? OR extraction_mode = "combined" OR extraction_mode IS NULL)', (form_type, extraction_mode_filter))
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed" AND form_type = ? AND (extraction_mode = ? OR extraction_mode = "combined" OR extraction_mode IS NULL)', (form_type, extraction_mode_filter))
                 else:
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed" AND form_type = ?', (form_type,))
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed" AND form_type = ?', (form_type,))
             else:
                 if extraction_mode_filter == 'pure':
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed" AND (extraction_mode = ? OR extraction_mode = "combined")', (extraction_mode_filter,))
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed" AND (extraction_mode = ? OR extraction_mode = "combined")', (extraction_mode_filter,))
                 elif extraction_mode_filter == 'mapped':
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed" AND (extraction_mode = ? OR extraction_mode = "combined" OR extraction_mode IS NULL)', (extraction_mode_filter,))
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed" AND (extraction_mode = ? OR extraction_mode = "combined" OR extraction_mode IS NULL)', (extraction_mode_filter,))
                 else:
-                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped FROM exception_forms WHERE status = "processed"')
+                    c.execute('SELECT id, pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json, overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index FROM exception_forms WHERE status = "processed"')
             
-            forms = c.fetchall()
+            # Rebuild raw JSON columns of forms that reference a stored response
+            form_columns = [desc[0] for desc in c.description]
+            payload_cache = {}
+            forms = [hydrate_raw_columns(conn, dict(zip(form_columns, form)), payload_cache) for form in c.fetchall()]
             
             # Calculate statistics using the new filtered function
             stats = calculate_dashboard_stats_with_raw_data(forms, form_type, extraction_mode_filter)
@@ -1718,13 +1109,15 @@ def get_dashboard_data():
                 # Get raw_extracted_data and extraction_mode for this form
                 form_id = row[0]
                 c2 = conn.cursor()
-                c2.execute('SELECT raw_extracted_data, raw_extracted_data_pure, raw_extracted_data_mapped, extraction_mode FROM exception_forms WHERE id = ?', (form_id,))
+                c2.execute('SELECT raw_extracted_data, raw_extracted_data_pure, raw_extracted_data_mapped, extraction_mode, raw_payload_id, raw_entry_index, form_type FROM exception_forms WHERE id = ?', (form_id,))
                 raw_data_row = c2.fetchone()
                 raw_json = None
                 form_extraction_mode = None
                 if raw_data_row:
                     raw_json = None
                     form_extraction_mode = raw_data_row[3]
+                    raw_form = hydrate_raw_columns(conn, dict(zip([desc[0] for desc in c2.description], raw_data_row)), payload_cache)
+                    raw_data_row = [raw_form[column] for column in ('raw_extracted_data', 'raw_extracted_data_pure', 'raw_extracted_data_mapped')]
                     
                     # Select the appropriate raw data based on extraction mode
                     if extraction_mode_filter == 'pure' and form_extraction_mode == 'combined':
@@ -1736,7 +1129,7 @@ def get_dashboard_data():
                     
                     if raw_data:
                         try:
-                            raw_json = json.loads(raw_data)
+                            raw_json = fast_json.loads(raw_data)
                         except Exception:
                             raw_json = None
                 
@@ -1810,7 +1203,6 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
     Calculate dashboard statistics using ONLY pure extraction data.
     All stats are derived from raw_extracted_data JSON, ignoring mapped fields entirely.
     """
-    import json
     from collections import Counter
     
     def safe_int(val):
@@ -1888,11 +1280,13 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
         # Process the form data
         if raw_data:
             try:
-                raw_json = json.loads(raw_data)
+                raw_json = fast_json.loads(raw_data)
+                # Normalize the raw keys once for all the flexible lookups below
+                raw_view = flexible_view(raw_json) if isinstance(raw_json, dict) else raw_json
                 
                 # --- Flexible Overtime Extraction ---
                 if current_form_type_for_processing == 'supervisor':
-                    overtime_hours = get_flexible_field(raw_json, [
+                    overtime_hours = get_flexible_field(raw_view, [
                         'overtime_hours', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime'
                     ])
                     if overtime_hours and overtime_hours != 'N/A':
@@ -1915,7 +1309,7 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                             pass
                     
                     # --- Flexible Job Number Extraction (Supervisor) ---
-                    job_num = get_flexible_field(raw_json, [
+                    job_num = get_flexible_field(raw_view, [
                         'job', 'job_number', 'job no', 'job_no', 'job#', 'job number', 'ta_job_no', 'ta job no', 'jobnum', 'jobnumber', 'job id', 'jobid'
                     ])
                     if job_num and job_num != 'N/A':
@@ -1947,14 +1341,14 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                             if line_loc and line_loc != 'N/A':
                                 locations.append(line_loc)
                     # Also check for overtime, job number, and location at the top level (in case some forms store them there)
-                    hh_top = get_flexible_field(raw_json, ['overtime_hh', 'ot_hh', 'hh'])
-                    mm_top = get_flexible_field(raw_json, ['overtime_mm', 'ot_mm', 'mm'])
+                    hh_top = get_flexible_field(raw_view, ['overtime_hh', 'ot_hh', 'hh'])
+                    mm_top = get_flexible_field(raw_view, ['overtime_mm', 'ot_mm', 'mm'])
                     try:
                         total_minutes += safe_int(hh_top) * 60 + safe_int(mm_top)
                     except:
                         pass
                     # Also check for overtime_hours at the top level (e.g., "00:30")
-                    overtime_hours_top = get_flexible_field(raw_json, [
+                    overtime_hours_top = get_flexible_field(raw_view, [
                         'overtime_hours', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime'
                     ])
                     if overtime_hours_top and overtime_hours_top != 'N/A':
@@ -1976,12 +1370,12 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                         except:
                             pass
                     # --- NEW: Also check for job number and location at the top level ---
-                    ta_job_top = get_flexible_field(raw_json, [
+                    ta_job_top = get_flexible_field(raw_view, [
                         'ta_job_no', 'job_no', 'jobnumber', 'jobnum', 'job number', 'TA Job No', 'TA Job Number'
                     ])
                     if ta_job_top and ta_job_top != 'N/A':
                         job_numbers.append(str(ta_job_top))
-                    line_loc_top = get_flexible_field(raw_json, [
+                    line_loc_top = get_flexible_field(raw_view, [
                         'Line/Location *', 'Line/Location', 'line_location', 'location', 'line', 'loc', 'line_loc', 'report_station'
                     ])
                     if line_loc_top and line_loc_top != 'N/A':
@@ -1991,7 +1385,7 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                 if current_form_type_for_processing == 'supervisor':
                     positions.append('Supervisor')
                 else:
-                    title = get_flexible_field(raw_json, [
+                    title = get_flexible_field(raw_view, [
                         'title', 'position', 'job_title', 'role'
                     ])
                     if title and title != 'N/A':
@@ -2000,17 +1394,17 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                 # --- Flexible Location Extraction ---
                 if current_form_type_for_processing == 'supervisor':
                     # Check for pure extraction field names first (same as hourly)
-                    line_loc = get_flexible_field(raw_json, [
+                    line_loc = get_flexible_field(raw_view, [
                         'Line/Location *', 'Line/Location', 'line_location', 'location', 'line', 'loc', 'line_loc'
                     ])
                     if line_loc and line_loc != 'N/A':
                         locations.append(line_loc)
                     else:
                         # Fallback to supervisor-specific field names
-                        report_loc = get_flexible_field(raw_json, [
+                        report_loc = get_flexible_field(raw_view, [
                             'report_loc', 'report_location', 'location', 'reportloc', 'report', 'loc'
                         ])
-                        overtime_loc = get_flexible_field(raw_json, [
+                        overtime_loc = get_flexible_field(raw_view, [
                             'overtime_location', 'location', 'overtimelocation', 'ot_location', 'otloc'
                         ])
                         # Only add unique locations per form to avoid double counting
@@ -2034,7 +1428,7 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                 
                 # --- Flexible Reason Extraction (Supervisor) ---
                 if current_form_type_for_processing == 'supervisor':
-                    reasons = get_flexible_field(raw_json, [
+                    reasons = get_flexible_field(raw_view, [
                         'reason_for_overtime', 'reason', 'overtime_reason', 'reasonovertime', 'reasonforot'
                     ])
                     if isinstance(reasons, str):
@@ -2058,7 +1452,7 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
                                 reason_counts['reason_capital_support_go'] += 1
                             else:
                                 reason_counts['reason_other'] += 1
-            except json.JSONDecodeError:
+            except fast_json.JSONDecodeError:
                 # Skip forms with invalid JSON
                 print(f"Error parsing JSON for form {form_dict.get('id')}")
                 continue
@@ -2159,25 +1553,78 @@ def calculate_dashboard_stats_with_raw_data(forms, form_type=None, extraction_mo
         "most_common_reason": most_common_reason
     }
 
-@app.route('/api/form/<int:form_id>', methods=['GET'])
+# Raw JSON and OCR text of a form: large, so GET /api/form/<id> leaves them out with include_raw=0
+# and GET /api/form/<id>/raw loads them on demand
+FORM_RAW_DETAIL_COLUMNS = RAW_COLUMNS + ['ocr_lines']
+# Header fields GET /api/form/<id> takes from the raw JSON of the requested extraction mode
+FORM_DETAIL_OVERRIDE_FIELDS = ['pass_number', 'title', 'employee_name', 'actual_ot_date', 'div', 'comments']
+# Always returned, and needed to pick the raw JSON of the extraction mode
+FORM_DETAIL_KEY_COLUMNS = ['id', 'form_type', 'extraction_mode']
+
+
+def _flag_param(name, default):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+
+def _fields_param(allowed):
+    """Comma separated column names of the 'fields' argument, or None if absent. Raises ValueError for unknown names."""
+    value = request.args.get('fields')
+    if value is None:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+
+def _query_form(conn, form_id, columns):
+    """One exception_forms row as a dict of the given columns, decoded and with raw columns hydrated; None if not found."""
+    if any(column in columns for column in RAW_COLUMNS):
+        columns = columns + [column for column in ('raw_payload_id', 'raw_entry_index') if column not in columns]
+    row = conn.execute(f"SELECT {', '.join(columns)} FROM exception_forms WHERE id = ?", (form_id,)).fetchone()
+    if row is None:
+        return None
+    return hydrate_raw_columns(conn, dict(zip(columns, row)))
+
+
+@api.route('/api/form/<int:form_id>', methods=['GET'])
+@cached_response()
 def get_form_details(form_id):
-    import sqlite3
-    import json
+    """
+    A form and its rows. ?fields=a,b returns only those form columns (plus
+    id, form_type and extraction_mode); include_raw=0 leaves out the raw JSON
+    and OCR columns, which are included by default unless fields is given.
+    """
     extraction_mode = request.args.get('extraction_mode', 'mapped')
     
     with sqlite3.connect('forms.db', timeout=10) as conn:
         c = conn.cursor()
+        table_columns = [row[1] for row in c.execute('PRAGMA table_info(exception_forms)')]
+        try:
+            fields = _fields_param(table_columns)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        include_raw = _flag_param('include_raw', fields is None)
+        if fields is None:
+            fields = [column for column in table_columns if column not in FORM_RAW_DETAIL_COLUMNS]
+        output_columns = list(dict.fromkeys(FORM_DETAIL_KEY_COLUMNS + fields))
+        if include_raw:
+            output_columns += [column for column in FORM_RAW_DETAIL_COLUMNS if column in table_columns and column not in output_columns]
+        query_columns = list(output_columns)
+        if any(field in output_columns for field in FORM_DETAIL_OVERRIDE_FIELDS):
+            mode_columns = ['raw_extracted_data', 'raw_extracted_data_pure', 'raw_extracted_data_mapped']
+            query_columns += [column for column in mode_columns if column not in query_columns]
+
         # Get form header - don't filter by extraction mode for existing forms
         # This allows access to legacy forms that only exist in one extraction mode
-        c.execute('SELECT * FROM exception_forms WHERE id = ?', (form_id,))
-        
-        form_row = c.fetchone()
-        if not form_row:
+        form_data = _query_form(conn, form_id, query_columns)
+        if form_data is None:
             return jsonify({'error': 'Form not found'}), 404
         
-        columns = [desc[0] for desc in c.description]
-        form_data = dict(zip(columns, form_row))
-        
         # Get the raw extracted data based on extraction mode
         raw_json = None
         form_extraction_mode = form_data.get('extraction_mode')
@@ -2194,8 +1641,8 @@ def get_form_details(form_id):
         
         if raw_data:
             try:
-                raw_json = json.loads(raw_data)
-            except json.JSONDecodeError:
+                raw_json = fast_json.loads(raw_data)
+            except fast_json.JSONDecodeError:
                 print(f"Error parsing JSON for form {form_id}: {raw_data}")
         
         # Function to get field value with proper extraction mode handling
@@ -2258,215 +1705,227 @@ def get_form_details(form_id):
         row_columns = [desc[0] for desc in c.description]
         form_rows = [dict(zip(row_columns, row)) for row in rows]
         conn.commit()
+    form_data = {column: form_data.get(column) for column in output_columns}
     return jsonify({'form': form_data, 'rows': form_rows})
 
-@app.route('/api/form/<int:form_id>', methods=['PUT'])
+@api.route('/api/form/<int:form_id>/raw', methods=['GET'])
+@cached_response()
+def get_form_raw(form_id):
+    """The raw JSON and OCR columns of one form, for clients that fetched it with include_raw=0. ?fields=a,b narrows them."""
+    try:
+        fields = _fields_param(FORM_RAW_DETAIL_COLUMNS) or FORM_RAW_DETAIL_COLUMNS
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        form = _query_form(conn, form_id, ['id', 'form_type'] + fields)
+    if form is None:
+        return jsonify({'error': 'Form not found'}), 404
+    return jsonify({'id': form_id, **{field: form.get(field) for field in fields}})
+
+@api.route('/api/form/<int:form_id>', methods=['PUT'])
 def update_form(form_id):
-    import sqlite3
+    """Save a whole form and its rows. Only what differs from the stored form is written."""
     data = request.json
     form = data.get('form', {})
     rows = data.get('rows', [])
     username = data.get('username', 'unknown')  # For audit logging
+    # Rows are submitted whole; fields they leave out are cleared, as before
+    full_rows = []
+    for row in rows:
+        if isinstance(row, dict):
+            full_row = {field: row.get(field, '') for field in FORM_ROW_FIELDS}
+            if row.get('id') is not None:
+                full_row['id'] = row['id']
+            full_rows.append(full_row)
     with sqlite3.connect('forms.db', timeout=10) as conn:
-        c = conn.cursor()
-        # Update form header
-        c.execute('''
-            UPDATE exception_forms SET
-                pass_number = ?,
-                title = ?,
-                employee_name = ?,
-                rdos = ?,
-                actual_ot_date = ?,
-                div = ?,
-                comments = ?,
-                supervisor_name = ?,
-                supervisor_pass_no = ?,
-                oto = ?,
-                oto_amount_saved = ?,
-                entered_in_uts = ?,
-                regular_assignment = ?,
-                report = ?,
-                relief = ?,
-                todays_date = ?,
-                status = ?,
-                reg = ?,
-                superintendent_authorization_signature = ?,
-                superintendent_authorization_pass = ?,
-                superintendent_authorization_date = ?,
-                entered_into_uts = ?,
-                overtime_hours = ?,
-                report_loc = ?,
-                overtime_location = ?,
-                report_time = ?,
-                relief_time = ?,
-                date_of_overtime = ?,
-                job_number = ?,
-                rc_number = ?,
-                acct_number = ?,
-                amount = ?,
-                reason_rdo = ?,
-                reason_absentee_coverage = ?,
-                reason_no_lunch = ?,
-                reason_early_report = ?,
-                reason_late_clear = ?,
-                reason_save_as_oto = ?,
-                reason_capital_support_go = ?,
-                reason_other = ?
-            WHERE id = ?
-        ''', (
-            form.get('pass_number', ''),
-            form.get('title', ''),
-            form.get('employee_name', ''),
-            form.get('rdos', ''),
-            form.get('actual_ot_date', ''),
-            form.get('div', ''),
-            form.get('comments', ''),
-            form.get('supervisor_name', ''),
-            form.get('supervisor_pass_no', ''),
-            form.get('oto', ''),
-            form.get('oto_amount_saved', ''),
-            form.get('entered_in_uts', ''),
-            form.get('regular_assignment', ''),
-            form.get('report', ''),
-            form.get('relief', ''),
-            form.get('todays_date', ''),
-            form.get('status', ''),
-            form.get('reg', ''),
-            form.get('superintendent_authorization_signature', ''),
-            form.get('superintendent_authorization_pass', ''),
-            form.get('superintendent_authorization_date', ''),
-            form.get('entered_into_uts', ''),
-            form.get('overtime_hours', ''),
-            form.get('report_loc', ''),
-            form.get('overtime_location', ''),
-            form.get('report_time', ''),
-            form.get('relief_time', ''),
-            form.get('date_of_overtime', ''),
-            form.get('job_number', ''),
-            form.get('rc_number', ''),
-            form.get('acct_number', ''),
-            form.get('amount', ''),
-            form.get('reason_rdo', False),
-            form.get('reason_absentee_coverage', False),
-            form.get('reason_no_lunch', False),
-            form.get('reason_early_report', False),
-            form.get('reason_late_clear', False),
-            form.get('reason_save_as_oto', False),
-            form.get('reason_capital_support_go', False),
-            form.get('reason_other', False),
-            form_id
-        ))
-        # PATCH: Update raw_gemini_json if present
-        if 'raw_gemini_json' in form:
-            print(f"Updating raw_gemini_json for form {form_id}: {form['raw_gemini_json'][:100]}...")
-            c.execute('UPDATE exception_forms SET raw_gemini_json = ? WHERE id = ?', (form['raw_gemini_json'], form_id))
-        # PATCH: Update raw_extracted_data if present
-        if 'raw_extracted_data' in form:
-            print(f"Updating raw_extracted_data for form {form_id}: {form['raw_extracted_data'][:100]}...")
-            c.execute('UPDATE exception_forms SET raw_extracted_data = ? WHERE id = ?', (form['raw_extracted_data'], form_id))
-        # Delete old rows
-        c.execute('DELETE FROM exception_form_rows WHERE form_id = ?', (form_id,))
-        # Insert new rows
-        for row in rows:
-            c.execute('''
-                INSERT INTO exception_form_rows (
-                    form_id, code, code_description, line_location, run_no,
-                    exception_time_from_hh, exception_time_from_mm,
-                    exception_time_to_hh, exception_time_to_mm,
-                    overtime_hh, overtime_mm, bonus_hh, bonus_mm,
-                    nite_diff_hh, nite_diff_mm, ta_job_no
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                form_id,
-                row.get('code', ''),
-                row.get('code_description', ''),
-                row.get('line_location', ''),
-                row.get('run_no', ''),
-                row.get('exception_time_from_hh', ''),
-                row.get('exception_time_from_mm', ''),
-                row.get('exception_time_to_hh', ''),
-                row.get('exception_time_to_mm', ''),
-                row.get('overtime_hh', ''),
-                row.get('overtime_mm', ''),
-                row.get('bonus_hh', ''),
-                row.get('bonus_mm', ''),
-                row.get('nite_diff_hh', ''),
-                row.get('nite_diff_mm', ''),
-                row.get('ta_job_no', '')
-            ))
+        try:
+            diff = patch_form(conn, form_id, fields=full_form_fields(form), rows=full_rows, replace_rows=True, username=username)
+        except ValueError as e:
+            conn.rollback()  # Leaving the with block would commit a partial edit
+            return jsonify({'error': str(e)}), 400
+        if diff is None:
+            return jsonify({'error': 'Form not found.'}), 404
+        conn.commit()
+    return jsonify({'message': 'Form updated successfully.', 'changes': diff})
+
+@api.route('/api/form/<int:form_id>', methods=['PATCH'])
+def patch_form_route(form_id):
+    """
+    Apply only the changes of an edit.
+    Body: {form: {changed fields}, rows: [{id, changed fields} or new rows without id],
+    delete_rows: [row ids], username}. Returns the diff that was written.
+    """
+    data = request.get_json(silent=True) or {}
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        try:
+            diff = patch_form(conn, form_id, fields=data.get('form') or {}, rows=data.get('rows') or [],
+                              delete_row_ids=data.get('delete_rows') or [], username=data.get('username', 'unknown'))
+        except ValueError as e:
+            conn.rollback()  # Leaving the with block would commit a partial edit
+            return jsonify({'error': str(e)}), 400
+        if diff is None:
+            return jsonify({'error': 'Form not found.'}), 404
         conn.commit()
-        # Audit log
-        c.execute('''
-            INSERT INTO audit_trail (username, action, target_type, target_id, details)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (username, 'edit', 'form', form_id, 'Form and rows edited via API'))
+    return jsonify({'message': 'Form updated successfully.', 'changes': diff})
+
+# Columns of the dashboard table, returned for the forms a bulk edit touched
+BULK_EDIT_RESULT_COLUMNS = ['id', 'pass_number', 'title', 'employee_name', 'actual_ot_date', 'div', 'comments', 'status', 'form_type', 'upload_date']
+
+@api.route('/api/forms/bulk-edit', methods=['POST'])
+def bulk_edit_forms():
+    """
+    Edit many forms in one transaction with one audit entry.
+    Body: {patches: [{id, form, rows, delete_rows}], username}, or
+    {filter: {ids, form_type, status, username, extraction_mode, upload_date_from, upload_date_to},
+    set: {field: value}, username} to assign the same fields to every matching form.
+    Returns the touched forms as dashboard table rows, so the UI can refresh them in place.
+    """
+    data = request.get_json(silent=True) or {}
+    username = data.get('username', 'unknown')
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        try:
+            if 'patches' in data:
+                patches = data['patches'] or []
+            elif 'filter' in data:
+                assignment = data.get('set') or {}
+                if not assignment:
+                    raise ValueError('set must name at least one field')
+                patches = [{'id': form_id, 'form': assignment} for form_id in select_form_ids(conn, data['filter'] or {})]
+            else:
+                raise ValueError('Send either patches or filter and set')
+            changes = bulk_patch_forms(conn, patches, username=username)
+        except (ValueError, TypeError) as e:
+            conn.rollback()  # Leaving the with block would commit a partial edit
+            return jsonify({'error': str(e)}), 400
         conn.commit()
-    return jsonify({'message': 'Form updated successfully.'})
+        form_ids = [int(patch['id']) for patch in patches]
+        forms = []
+        for start in range(0, len(form_ids), 500):
+            chunk = form_ids[start:start + 500]
+            c = conn.execute(f"SELECT {', '.join(BULK_EDIT_RESULT_COLUMNS)} FROM exception_forms WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            forms.extend(dict(zip(BULK_EDIT_RESULT_COLUMNS, row)) for row in c.fetchall())
+    return jsonify({
+        'message': f'{len(changes)} of {len(form_ids)} forms changed',
+        'changed': len(changes),
+        'unchanged': len(form_ids) - len(changes),
+        'changes': changes,
+        'forms': forms
+    })
 
-@app.route('/api/form/<int:form_id>', methods=['DELETE'])
+@api.route('/api/form/<int:form_id>', methods=['DELETE'])
 def delete_form(form_id):
     try:
         with sqlite3.connect('forms.db', timeout=10) as conn:
             c = conn.cursor()
+            payload_row = c.execute('SELECT raw_payload_id FROM exception_forms WHERE id = ?', (form_id,)).fetchone()
             c.execute('DELETE FROM exception_form_rows WHERE form_id = ?', (form_id,))
             c.execute('DELETE FROM exception_forms WHERE id = ?', (form_id,))
-            from db import log_audit
+            if payload_row:
+                prune_raw_payloads(conn, [payload_row[0]])
             log_audit('system', 'delete', 'form', form_id, "Form deleted via API", conn=conn)
+            bump_data_version(conn)
         return jsonify({'message': 'Form deleted successfully.'})
     except Exception as e:
         print(f"Error deleting form {form_id}: {e}")
         return jsonify({'error': str(e)}), 500
 
-def init_audit_db():
-    with sqlite3.connect('forms.db', timeout=10) as conn:
-        c = conn.cursor()
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS audit_trail (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT,
-                action TEXT,
-                target_type TEXT,
-                target_id INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                details TEXT
-            )
-        ''')
-        conn.commit()
-
-def log_audit(username, action, target_type, target_id, details="", conn=None):
-    close_conn = False
-    if conn is None:
-        conn = sqlite3.connect('forms.db', timeout=10)
-        close_conn = True
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO audit_trail (username, action, target_type, target_id, details)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (username, action, target_type, target_id, details))
-    if close_conn:
-        conn.commit()
-        conn.close()
+def _audit_time_param(name):
+    """Parse an ISO date/time query parameter into the stored UTC timestamp format."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
 
-@app.route('/api/audit-trail', methods=['GET'])
+@api.route('/api/audit-trail', methods=['GET'])
 def get_audit_trail():
+    """
+    Audit entries newest first, one page at a time.
+    Query: limit, cursor (next_cursor of the previous page), user, action,
+    target ('form' or 'form:12'), since, until (ISO date/time, until exclusive).
+    """
+    target_type = target_id = None
+    try:
+        limit = min(max(int(request.args.get('limit', AUDIT_PAGE_SIZE)), 1), MAX_AUDIT_PAGE_SIZE)
+        target = request.args.get('target')
+        if target:
+            target_type, _, target_id = target.partition(':')
+            target_id = int(target_id) if target_id else None
+        since = _audit_time_param('since')
+        until = _audit_time_param('until')
+        cursor = request.args.get('cursor')
+        if cursor:
+            decode_audit_cursor(cursor)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid audit trail query: {e}'}), 400
+    AUDIT_SINK.flush()  # Include entries still waiting in the buffer
+    # Continues into the monthly archives once forms.db runs out of matching entries
+    entries, next_cursor = search_audit_trail(
+        username=request.args.get('user'), action=request.args.get('action'),
+        target_type=target_type, target_id=target_id, since=since, until=until,
+        cursor=cursor, limit=limit
+    )
+    logs = [
+        {
+            "id": entry['id'],
+            "user": entry['username'],
+            "action": entry['action'],
+            "target": f"{entry['target_type']}:{entry['target_id']}",
+            "timestamp": entry['timestamp'],
+            "details": entry['details']
+        }
+        for entry in entries
+    ]
+    return jsonify({"logs": logs, "next_cursor": next_cursor})
+
+@api.route('/api/audit-trail/archive', methods=['POST'])
+def archive_audit_entries():
+    """
+    Move audit entries older than the retention age into monthly archive databases.
+    Body: {max_age_days} (default AUDIT_RETENTION_DAYS). Archived entries stay searchable.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        max_age_days = int(data['max_age_days']) if data.get('max_age_days') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_age_days must be an integer'}), 400
+    if max_age_days is not None and max_age_days < 0:
+        return jsonify({'error': 'max_age_days must not be negative'}), 400
+    try:
+        stats = archive_audit_trail(max_age_days=max_age_days)
+    except Exception as e:
+        return jsonify({'error': f'Audit archive failed: {str(e)}'}), 500
+    return jsonify({'message': 'Audit trail archived', 'stats': stats})
+
+@api.route('/api/search', methods=['GET'])
+def search():
+    """
+    Full-text search over forms, best match first.
+    Query: q (every word must match, as a prefix), form_type, limit, offset.
+    Matches are wrapped in <mark> in employee_name_highlight and snippet.
+    """
+    text = request.args.get('q', '')
+    form_type = request.args.get('form_type')
+    try:
+        limit = min(max(int(request.args.get('limit', SEARCH_PAGE_SIZE)), 1), MAX_SEARCH_PAGE_SIZE)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
     with sqlite3.connect('forms.db', timeout=10) as conn:
-        c = conn.cursor()
-        c.execute('SELECT id, username, action, target_type, target_id, timestamp, details FROM audit_trail ORDER BY timestamp DESC')
-        logs = [
-            {
-                "id": row[0],
-                "user": row[1],
-                "action": row[2],
-                "target": f"{row[3]}:{row[4]}",
-                "timestamp": row[5],
-                "details": row[6]
-            }
-            for row in c.fetchall()
-        ]
-        conn.commit()
-    return jsonify({"logs": logs})
+        if not search_available(conn):
+            return jsonify({'error': 'Full-text search is not available on this server'}), 501
+        try:
+            results, has_more = search_forms(conn, text, form_type=form_type, limit=limit, offset=offset)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'results': results,
+        'next_offset': offset + limit if has_more else None
+    })
 
-@app.route('/api/extraction-mode', methods=['GET', 'POST'])
+@api.route('/api/extraction-mode', methods=['GET', 'POST'])
 def extraction_mode():
     """Get or set the extraction mode (pure vs mapped)"""
     global PURE_GEMINI_EXTRACTION
@@ -2490,279 +1949,137 @@ def extraction_mode():
         }
     })
 
-@app.route('/api/forms/export', methods=['GET'])
+@api.route('/api/forms/export', methods=['GET'])
 def export_forms():
-    import sqlite3
-    import json
-    import io
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from openpyxl.utils import get_column_letter
+    import tempfile
+    from exporter import (open_export, write_xlsx, write_parquet, iter_csv,
+                          export_filename, stream_file, EXPORT_FORMATS)
     
     # Get query parameters
     form_type = request.args.get('form_type')
     extraction_mode = request.args.get('extraction_mode')
+    export_format = (request.args.get('format') or 'xlsx').lower()
     
-    with sqlite3.connect('forms.db', timeout=10) as conn:
-        c = conn.cursor()
-        
-        # Build query with filters
-        query = "SELECT * FROM exception_forms WHERE 1=1"
-        params = []
-        
-        if form_type:
-            query += " AND form_type = ?"
-            params.append(form_type)
-        
-        if extraction_mode:
-            # Handle combined extraction mode - when user wants 'mapped', also include 'combined' forms
-            if extraction_mode == 'mapped':
-                query += " AND (extraction_mode = ? OR extraction_mode = 'combined')"
-                params.append(extraction_mode)
-            elif extraction_mode == 'pure':
-                query += " AND (extraction_mode = ? OR extraction_mode = 'combined')"
-                params.append(extraction_mode)
-            else:
-                query += " AND extraction_mode = ?"
-                params.append(extraction_mode)
-        
-        c.execute(query, params)
-        rows = c.fetchall()
-        
-        # Get column names
-        columns = [desc[0] for desc in c.description]
-        
-        # Enhanced headers focusing on overtime data
-        header_map = {
-            'id': 'Form ID',
-            'pass_number': 'Pass Number',
-            'title': 'Title',
-            'employee_name': 'Employee Name',
-            'rdos': 'RDOS',
-            'actual_ot_date': 'Actual OT Date',
-            'div': 'DIV',
-            'comments': 'Comments',
-            'supervisor_name': 'Supervisor Name',
-            'supervisor_pass_no': 'Supervisor Pass No.',
-            'oto': 'OTO',
-            'oto_amount_saved': 'OTO Amount Saved',
-            'entered_in_uts': 'Entered in UTS',
-            'regular_assignment': 'Regular Assignment',
-            'report': 'Report',
-            'relief': 'Relief',
-            'todays_date': "Today's Date",
-            'form_type': 'Form Type',
-            'extraction_mode': 'Extraction Mode',
-            'raw_extracted_data': 'Raw Gemini Data (JSON)',
-            'raw_gemini_json': 'Raw Gemini JSON',
-            'upload_date': 'Upload Date'
-        }
-        
-        # Create enhanced headers with overtime focus
-        enhanced_headers = []
-        enhanced_columns = []
-        
-        # First: Essential overtime fields
-        overtime_fields = [
-            'id', 'pass_number', 'employee_name', 'actual_ot_date', 'form_type',
-            'overtime_hours', 'report_loc', 'overtime_location', 'report_time', 'relief_time',
-            'date_of_overtime', 'job_number', 'rc_number', 'acct_number', 'amount'
-        ]
-        
-        # Add overtime fields first (if they exist in the database)
-        for field in overtime_fields:
-            if field in columns:
-                enhanced_columns.append(field)
-                enhanced_headers.append(header_map.get(field, field.replace('_', ' ').title()))
-        
-        # Then: Other important fields
-        other_fields = [
-            'title', 'rdos', 'div', 'comments', 'supervisor_name', 'supervisor_pass_no',
-            'oto', 'oto_amount_saved', 'entered_in_uts', 'regular_assignment', 'report', 'relief',
-            'todays_date', 'extraction_mode', 'upload_date'
-        ]
-        
-        for field in other_fields:
-            if field in columns and field not in enhanced_columns:
-                enhanced_columns.append(field)
-                enhanced_headers.append(header_map.get(field, field.replace('_', ' ').title()))
-        
-        # Finally: Raw data fields for debugging
-        raw_fields = ['raw_extracted_data', 'raw_gemini_json']
-        for field in raw_fields:
-            if field in columns:
-                enhanced_columns.append(field)
-                enhanced_headers.append(header_map.get(field, field.replace('_', ' ').title()))
-        
-        conn.commit()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unsupported export format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
     
-    # Create a new Excel workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Exception Forms"
+    filename = export_filename(form_type, extraction_mode, export_format)
+    mimetype = EXPORT_FORMATS[export_format]
     
-    # Style definitions
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+    if export_format == 'csv':
+        # CSV is streamed straight from the database cursor, row by row
+        def generate_csv():
+            with sqlite3.connect('forms.db', timeout=10) as conn:
+                export_columns, headers, rows = open_export(conn, form_type, extraction_mode)
+                for chunk in iter_csv(headers, rows):
+                    yield chunk
+        return Response(
+            generate_csv(),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
     
-    # Add headers with styling
-    for col_num, header in enumerate(enhanced_headers, 1):
-        cell = ws.cell(row=1, column=col_num, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return jsonify({'error': 'Parquet export requires pyarrow to be installed on the server'}), 501
     
-    # Add data rows with overtime details
-    current_row = 2
-    for form_row in rows:
-            # Create a mapping of column names to values
-            form_data = dict(zip(columns, form_row))
-            
-            # Add main form data
-            for col_num, col_name in enumerate(enhanced_columns, 1):
-                item = form_data.get(col_name)
-                if item is None:
-                    cell_value = ''
-                elif col_name in ['raw_extracted_data', 'raw_gemini_json'] and item:
-                    # Format JSON data for Excel readability
-                    try:
-                        parsed_json = json.loads(item)
-                        formatted_json = json.dumps(parsed_json, indent=2)
-                        cell_value = formatted_json
-                    except:
-                        cell_value = str(item)
-                else:
-                    cell_value = str(item) if item is not None else ''
-                
-                ws.cell(row=current_row, column=col_num, value=cell_value)
-            
-            # Now add detailed overtime row data (what you specifically want to see)
-            form_id = form_data.get('id')
-            if form_id:
-                # Get overtime rows for this form
-                c.execute('SELECT * FROM exception_form_rows WHERE form_id = ?', (form_id,))
-                overtime_rows = c.fetchall()
-                
-                if overtime_rows:
-                    # Get overtime row column names
-                    overtime_columns = [desc[0] for desc in c.description]
-                    
-                    # Add overtime row headers if this is the first form with overtime data
-                    if current_row == 2:
-                        overtime_header_start = len(enhanced_columns) + 1
-                        overtime_headers = [
-                            'OT Row ID', 'Exception Code', 'Code Description', 'Line/Location', 'Run No.',
-                            'Exception Time From (HH:MM)', 'Exception Time To (HH:MM)',
-                            'Overtime Hours (HH:MM)', 'Bonus Hours (HH:MM)', 'Night Differential (HH:MM)',
-                            'TA Job No.'
-                        ]
-                        
-                        for col_num, header in enumerate(overtime_headers, overtime_header_start):
-                            cell = ws.cell(row=1, column=col_num, value=header)
-                            cell.font = header_font
-                            cell.fill = header_fill
-                            cell.alignment = header_alignment
-                    
-                    # Add overtime row data
-                    for overtime_row in overtime_rows:
-                        overtime_data = dict(zip(overtime_columns, overtime_row))
-                        
-                        # Add overtime row data starting after the main form data
-                        col_offset = len(enhanced_columns)
-                        
-                        # OT Row ID
-                        ws.cell(row=current_row, column=col_offset + 1, value=overtime_data.get('id', ''))
-                        
-                        # Exception Code
-                        ws.cell(row=current_row, column=col_offset + 2, value=overtime_data.get('code', ''))
-                        
-                        # Code Description (REASON for overtime)
-                        ws.cell(row=current_row, column=col_offset + 3, value=overtime_data.get('code_description', ''))
-                        
-                        # Line/Location
-                        ws.cell(row=current_row, column=col_offset + 4, value=overtime_data.get('line_location', ''))
-                        
-                        # Run No.
-                        ws.cell(row=current_row, column=col_offset + 5, value=overtime_data.get('run_no', ''))
-                        
-                        # Exception Time From (HH:MM) - START TIME
-                        time_from_hh = overtime_data.get('exception_time_from_hh', '')
-                        time_from_mm = overtime_data.get('exception_time_from_mm', '')
-                        time_from = f"{time_from_hh}:{time_from_mm}" if time_from_hh and time_from_mm else ''
-                        ws.cell(row=current_row, column=col_offset + 6, value=time_from)
-                        
-                        # Exception Time To (HH:MM) - END TIME
-                        time_to_hh = overtime_data.get('exception_time_to_hh', '')
-                        time_to_mm = overtime_data.get('exception_time_to_mm', '')
-                        time_to = f"{time_to_hh}:{time_to_mm}" if time_to_hh and time_to_mm else ''
-                        ws.cell(row=current_row, column=col_offset + 7, value=time_to)
-                        
-                        # Overtime Hours (HH:MM) - DURATION
-                        ot_hh = overtime_data.get('overtime_hh', '')
-                        ot_mm = overtime_data.get('overtime_mm', '')
-                        overtime_hours = f"{ot_hh}:{ot_mm}" if ot_hh and ot_mm else ''
-                        ws.cell(row=current_row, column=col_offset + 8, value=overtime_hours)
-                        
-                        # Bonus Hours (HH:MM)
-                        bonus_hh = overtime_data.get('bonus_hh', '')
-                        bonus_mm = overtime_data.get('bonus_mm', '')
-                        bonus_hours = f"{bonus_hh}:{bonus_mm}" if bonus_hh and bonus_mm else ''
-                        ws.cell(row=current_row, column=col_offset + 9, value=bonus_hours)
-                        
-                        # Night Differential (HH:MM)
-                        nite_hh = overtime_data.get('nite_diff_hh', '')
-                        nite_mm = overtime_data.get('nite_diff_mm', '')
-                        nite_diff = f"{nite_hh}:{nite_mm}" if nite_hh and nite_mm else ''
-                        ws.cell(row=current_row, column=col_offset + 10, value=nite_diff)
-                        
-                        # TA Job No.
-                        ws.cell(row=current_row, column=col_offset + 11, value=overtime_data.get('ta_job_no', ''))
-                        
-                        current_row += 1
+    # Write the file to a temp file row by row, then stream it back in chunks
+    fd, export_path = tempfile.mkstemp(suffix='.' + export_format)
+    try:
+        with os.fdopen(fd, 'wb') as export_file:
+            with sqlite3.connect('forms.db', timeout=10) as conn:
+                if export_format == 'parquet':
+                    export_columns, headers, rows = open_export(conn, form_type, extraction_mode, typed=True)
+                    write_parquet(export_file, export_columns, headers, rows)
                 else:
-                    current_row += 1
-            else:
-                current_row += 1
-    
-    # Auto-adjust column widths
-    for column in ws.columns:
-        max_length = 0
-        column_letter = get_column_letter(column[0].column)
-        for cell in column:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = min(max_length + 2, 50)  # Cap at 50 characters
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # Save to bytes buffer
-    excel_buffer = io.BytesIO()
-    wb.save(excel_buffer)
-    excel_buffer.seek(0)
-    
-    # Generate filename based on filters
-    filename_parts = ['exception_forms']
-    if form_type:
-        filename_parts.append(form_type)
-    if extraction_mode:
-        filename_parts.append(extraction_mode)
-    filename = '_'.join(filename_parts) + '.xlsx'
+                    export_columns, headers, rows = open_export(conn, form_type, extraction_mode)
+                    write_xlsx(export_file, export_columns, headers, rows)
+    except Exception:
+        os.remove(export_path)
+        raise
     
     return Response(
-        excel_buffer.getvalue(),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        stream_file(export_path, remove=True),
+        mimetype=mimetype,
         headers={
             'Content-Disposition': f'attachment; filename={filename}',
-            'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            'Content-Length': str(os.path.getsize(export_path))
         }
     )
 
+@api.route('/api/forms/export/jobs', methods=['POST'])
+def create_export_job():
+    """
+    Queue an export in the background. Body: {format, form_type, extraction_mode, username}.
+    An identical export at the same data version reuses the existing job/artifact.
+    """
+    data = request.get_json(silent=True) or {}
+    export_format = (data.get('format') or 'xlsx').lower()
+    try:
+        job, reused = submit_export_job(
+            export_format,
+            form_type=data.get('form_type'),
+            extraction_mode=data.get('extraction_mode'),
+            username=data.get('username')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    job['download_url'] = f"/api/forms/export/jobs/{job['id']}/download" if job['status'] == 'finished' else None
+    job['reused'] = reused
+    return jsonify({'job': job}), 200 if reused else 202
+
+@api.route('/api/forms/export/jobs/<int:job_id>', methods=['GET'])
+def get_export_job_status(job_id):
+    job = get_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    job['download_url'] = f"/api/forms/export/jobs/{job_id}/download" if job['status'] == 'finished' else None
+    return jsonify({'job': job})
+
+@api.route('/api/forms/export/jobs/<int:job_id>/download', methods=['GET'])
+def download_export_job(job_id):
+    from flask import send_file
+    from exporter import EXPORT_FORMATS
+    job = get_export_job(job_id, include_path=True)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    if job['status'] != 'finished' or not job['file_path'] or not os.path.exists(job['file_path']):
+        return jsonify({'error': f"Export job is {job['status']}", 'status': job['status']}), 409
+    return send_file(
+        os.path.abspath(job['file_path']),
+        mimetype=EXPORT_FORMATS.get(job['format']),
+        as_attachment=True,
+        download_name=job['file_name']
+    )
+
+@api.route('/api/forms/remap', methods=['POST'])
+def start_remap():
+    """
+    Rebuild mapped fields of stored forms from their raw JSON in the background.
+    Body: {form_type, workers, dry_run, include_edited}. Poll GET /api/forms/remap for progress.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        workers = min(max(int(data.get('workers') or 0), 0), MAX_REMAP_WORKERS)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'workers must be an integer'}), 400
+    started = start_remap_job(
+        form_type=data.get('form_type'),
+        workers=workers,
+        dry_run=bool(data.get('dry_run')),
+        include_edited=bool(data.get('include_edited'))
+    )
+    if not started:
+        return jsonify({'error': 'A re-map is already running', 'remap': get_remap_status()}), 409
+    return jsonify({'remap': get_remap_status()}), 202
+
+@api.route('/api/forms/remap', methods=['GET'])
+def remap_status():
+    return jsonify({'remap': get_remap_status()})
+
 if __name__ == "__main__":
-    init_audit_db()
-    init_exception_form_db()
-    app.run(port=8000, debug=True)
+    create_app().run(port=8000, debug=True)
 
     
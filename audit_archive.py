@@ -0,0 +1,161 @@
+# === audit_archive.py ===
+"""
+Time-partitioned retention for the audit trail.
+
+archive_audit_trail() moves audit_trail rows older than AUDIT_RETENTION_DAYS
+out of forms.db into one SQLite database per month
+(audit_archive/audit_YYYY_MM.db, same table and indexes, same ids). Rows are
+moved oldest first in batches: a batch is committed to its archives before it
+is deleted from forms.db, and archives insert with OR IGNORE, so an
+interrupted run is simply repeated.
+
+search_audit_trail() pages through forms.db and then the archives, newest
+month first, with the same filters and cursor as db.query_audit_trail. Live
+rows are always newer than archived ones, and ids are kept, so one cursor
+works across all partitions.
+
+Run from the command line (python audit_archive.py --help) or through
+POST /api/audit-trail/archive.
+"""
+import datetime
+import os
+import re
+import sqlite3
+import time
+
+from audit_sink import AUDIT_SINK
+from db import AUDIT_COLUMNS, AUDIT_PAGE_SIZE, create_audit_table, decode_audit_cursor, encode_audit_cursor, query_audit_trail
+
+AUDIT_RETENTION_DAYS = int(os.getenv('AUDIT_RETENTION_DAYS', '180'))
+AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', 'audit_archive')
+ARCHIVE_BATCH_SIZE = 1000
+
+_ARCHIVE_FILE = re.compile(r'audit_(\d{4})_(\d{2})\.db$')
+
+
+def archive_path(month, archive_dir=None):
+    """Archive database of a 'YYYY-MM' month."""
+    return os.path.join(archive_dir or AUDIT_ARCHIVE_DIR, f"audit_{month.replace('-', '_')}.db")
+
+
+def archived_months(archive_dir=None):
+    """'YYYY-MM' months that have an archive, newest first."""
+    archive_dir = archive_dir or AUDIT_ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for name in os.listdir(archive_dir):
+        match = _ARCHIVE_FILE.match(name)
+        if match:
+            months.append(f"{match.group(1)}-{match.group(2)}")
+    return sorted(months, reverse=True)
+
+
+def retention_cutoff(max_age_days=None):
+    """Timestamp before which audit rows are archived, in the stored format."""
+    age = AUDIT_RETENTION_DAYS if max_age_days is None else max_age_days
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=age)
+    return cutoff.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _write_archive(month, rows, archive_dir):
+    conn = sqlite3.connect(archive_path(month, archive_dir), timeout=10)
+    try:
+        create_audit_table(conn.cursor())
+        placeholders = ', '.join('?' * len(AUDIT_COLUMNS))
+        conn.executemany(f"INSERT OR IGNORE INTO audit_trail ({', '.join(AUDIT_COLUMNS)}) VALUES ({placeholders})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def archive_audit_trail(max_age_days=None, archive_dir=None, batch_size=ARCHIVE_BATCH_SIZE, db_path='forms.db', vacuum=False):
+    """
+    Move audit rows older than max_age_days (default AUDIT_RETENTION_DAYS) into
+    monthly archives. vacuum=True compacts forms.db afterwards; otherwise the freed
+    pages are reused by new writes. Returns the stats dict.
+    """
+    archive_dir = archive_dir or AUDIT_ARCHIVE_DIR
+    cutoff = retention_cutoff(max_age_days)
+    stats = {'cutoff': cutoff, 'archived': 0, 'months': {}}
+    start_time = time.time()
+    AUDIT_SINK.flush()
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        while True:
+            rows = conn.execute(f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_trail WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                                (cutoff, batch_size)).fetchall()
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(str(row[5])[:7], []).append(row)
+            for month, month_rows in by_month.items():
+                _write_archive(month, month_rows, archive_dir)
+                stats['months'][month] = stats['months'].get(month, 0) + len(month_rows)
+            # Only deleted once the archives are committed
+            conn.executemany('DELETE FROM audit_trail WHERE id = ?', [(row[0],) for row in rows])
+            conn.commit()
+            stats['archived'] += len(rows)
+            print(f"Audit archive: moved {stats['archived']} entries older than {cutoff}")
+        if vacuum and stats['archived']:
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+    stats['elapsed_seconds'] = round(time.time() - start_time, 1)
+    return stats
+
+
+def _month_in_range(month, since=None, until=None, cursor_timestamp=None):
+    if since and month < since[:7]:
+        return False
+    if until and month > until[:7]:
+        return False
+    if cursor_timestamp and month > cursor_timestamp[:7]:
+        return False
+    return True
+
+
+def search_audit_trail(username=None, action=None, target_type=None, target_id=None, since=None, until=None,
+                       cursor=None, limit=AUDIT_PAGE_SIZE, archive_dir=None, db_path='forms.db'):
+    """
+    One page of audit entries across forms.db and the archives, newest first,
+    as (entries, next_cursor). Takes the filters of db.query_audit_trail.
+    """
+    filters = dict(username=username, action=action, target_type=target_type, target_id=target_id, since=since, until=until)
+    cursor_timestamp = decode_audit_cursor(cursor)[0] if cursor else None
+    partitions = [db_path] + [archive_path(month, archive_dir) for month in archived_months(archive_dir)
+                              if _month_in_range(month, since, until, cursor_timestamp)]
+    entries = []
+    # Collect one entry past the page to know whether another page follows
+    for path in partitions:
+        conn = sqlite3.connect(path, timeout=10)
+        try:
+            page, _ = query_audit_trail(conn, cursor=cursor, limit=limit + 1 - len(entries), **filters)
+        finally:
+            conn.close()
+        entries.extend(page)
+        if len(entries) > limit:
+            break
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_audit_cursor(entries[-1]['timestamp'], entries[-1]['id'])
+    return entries, next_cursor
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import fast_json
+
+    parser = argparse.ArgumentParser(description='Move old audit trail entries into monthly archive databases.')
+    parser.add_argument('--max-age-days', type=int, default=AUDIT_RETENTION_DAYS)
+    parser.add_argument('--archive-dir', default=AUDIT_ARCHIVE_DIR)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true', help='Compact forms.db after archiving')
+    args = parser.parse_args()
+    result = archive_audit_trail(max_age_days=args.max_age_days, archive_dir=args.archive_dir,
+                                 batch_size=args.batch_size, vacuum=args.vacuum)
+    print(fast_json.dumps(result, indent=True))
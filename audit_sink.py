@@ -0,0 +1,128 @@
+# === audit_sink.py ===
+"""
+Buffered audit trail writer.
+
+AuditSink.log() only appends the entry to an in-memory buffer. A background
+thread writes the buffer to audit_trail in one transaction, at most
+flush_interval seconds after an entry is logged or as soon as max_batch
+entries are waiting. The buffer is flushed when the process exits
+(atexit), and flush() writes it immediately. Callers that already hold a
+write transaction should insert their audit row in it instead
+(db.log_audit with conn=).
+
+Entries are stamped when they are logged, not when they are written, so the
+audit order is unaffected by batching.
+"""
+import atexit
+import datetime
+import sqlite3
+import threading
+
+AUDIT_FLUSH_INTERVAL = 1.0  # seconds an entry may wait in the buffer
+AUDIT_MAX_BATCH = 200
+# Past this many pending entries (e.g. the database is locked) log() writes synchronously
+AUDIT_MAX_PENDING = 10000
+
+INSERT_AUDIT_SQL = 'INSERT INTO audit_trail (username, action, target_type, target_id, details, timestamp) VALUES (?, ?, ?, ?, ?, ?)'
+
+
+def audit_timestamp():
+    """
+    Current UTC time in the format of SQLite's CURRENT_TIMESTAMP plus milliseconds,
+    so entries of the same second keep their order and still sort with older rows.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class AuditSink:
+    def __init__(self, db_path='forms.db', flush_interval=AUDIT_FLUSH_INTERVAL, max_batch=AUDIT_MAX_BATCH,
+                 max_pending=AUDIT_MAX_PENDING):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()  # Guards _pending and _thread
+        self._write_lock = threading.Lock()  # One flush at a time
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def log(self, username, action, target_type, target_id, details=""):
+        """Queue one audit entry."""
+        entry = (username, action, target_type, target_id, details, audit_timestamp())
+        with self._lock:
+            if self._closed:
+                closed = True
+            else:
+                closed = False
+                self._pending.append(entry)
+                backlog = len(self._pending)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                    self._thread.start()
+        if closed:
+            # After close() there is no writer thread left, so this entry is written now or not at all
+            try:
+                self._write([entry])
+            except sqlite3.Error as e:
+                print(f"Audit write after close failed, entry lost: {entry}: {e}")
+        elif backlog >= self.max_pending:
+            # The entries stay queued if this fails; a caller's saved edit must not fail on its audit row
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Audit flush failed with {backlog} entries pending, will retry: {e}")
+        elif backlog >= self.max_batch:
+            self._wakeup.set()
+
+    def _write(self, entries):
+        with sqlite3.connect(self.db_path, timeout=10) as conn:
+            conn.executemany(INSERT_AUDIT_SQL, entries)
+        conn.close()
+
+    def flush(self):
+        """Write every pending entry now. Returns the number written."""
+        with self._write_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+            if not entries:
+                return 0
+            try:
+                self._write(entries)
+            except sqlite3.Error:
+                # Put them back in front of anything logged meanwhile and retry on the next flush
+                with self._lock:
+                    self._pending[:0] = entries
+                raise
+            return len(entries)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print(f"Audit flush failed, will retry: {e}")
+            with self._lock:
+                if self._closed and not self._pending:
+                    return
+
+    def close(self):
+        """Stop the writer thread after a final flush. Later entries are written synchronously."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._wakeup.set()
+            thread.join(timeout=10)
+        self.flush()
+
+
+AUDIT_SINK = AuditSink()
+atexit.register(AUDIT_SINK.close)
@@ -0,0 +1,45 @@
+import sqlite3
+from db import init_exception_form_db
+from form_values import form_fingerprint, FINGERPRINT_FIELDS
+
+BATCH_SIZE = 500
+
+def backfill_fingerprints(db_path='forms.db', batch_size=BATCH_SIZE):
+    """
+    Fill the fingerprint column of forms stored before it existed, oldest first.
+    A form whose fingerprint is already held by an older form is a duplicate and
+    keeps a NULL fingerprint (the unique index allows only one holder); those
+    are counted and left for the duplicate cleanup.
+    """
+    init_exception_form_db(db_path)
+    conn = sqlite3.connect(db_path, timeout=10)
+    c = conn.cursor()
+    last_id = 0
+    filled = 0
+    duplicates = 0
+    while True:
+        c.execute(f"SELECT id, form_type, status, {', '.join(FINGERPRINT_FIELDS)} FROM exception_forms WHERE id > ? AND fingerprint IS NULL ORDER BY id LIMIT ?",
+                  (last_id, batch_size))
+        batch = c.fetchall()
+        if not batch:
+            break
+        for row in batch:
+            form_id, form_type, status = row[0], row[1], row[2]
+            last_id = form_id
+            if status == 'error':
+                continue
+            fingerprint = form_fingerprint(dict(zip(FINGERPRINT_FIELDS, row[3:])), form_type)
+            if not fingerprint:
+                continue
+            updated = conn.execute('UPDATE OR IGNORE exception_forms SET fingerprint = ? WHERE id = ?', (fingerprint, form_id))
+            if updated.rowcount:
+                filled += 1
+            else:
+                duplicates += 1
+        conn.commit()
+        print(f"Fingerprinted forms up to id {last_id} ({filled} so far, {duplicates} duplicates)")
+    conn.close()
+    print(f"Backfill complete. {filled} forms fingerprinted; {duplicates} duplicates left without a fingerprint.")
+
+if __name__ == '__main__':
+    backfill_fingerprints()
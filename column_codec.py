@@ -0,0 +1,95 @@
+# === column_codec.py ===
+"""
+Transparent compression for the large text columns of exception_forms
+(raw JSON and OCR lines) and for raw_payloads.
+
+Compressed values are stored as BLOBs whose first byte names the codec:
+CODEC_ZLIB or CODEC_ZSTD (zstd is used for new writes when the optional
+zstandard package is installed). Plain TEXT values written before this
+layer existed are returned unchanged by decode_text(), so old and new rows
+can live side by side until compress_forms_db.py rewrites them.
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# Text shorter than this is stored as-is; compressing it saves nothing
+MIN_COMPRESS_BYTES = 256
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# exception_forms columns stored through the codec
+COMPRESSED_COLUMNS = ['raw_gemini_json', 'raw_extracted_data', 'raw_extracted_data_pure', 'raw_extracted_data_mapped', 'ocr_lines']
+
+_zstd_compressor = None
+_zstd_decompressor = None
+
+
+def default_codec():
+    return CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+
+
+def compress_bytes(data: bytes, codec=None) -> bytes:
+    """Compress bytes and prefix them with the codec byte."""
+    global _zstd_compressor
+    codec = codec or default_codec()
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compression requested but the zstandard package is not installed")
+        if _zstd_compressor is None:
+            _zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+        return bytes([CODEC_ZSTD]) + _zstd_compressor.compress(data)
+    if codec == CODEC_ZLIB:
+        return bytes([CODEC_ZLIB]) + zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Unknown codec {codec}")
+
+
+def decompress_bytes(blob: bytes) -> bytes:
+    """Reverse compress_bytes(). Raises ValueError for a BLOB that does not start with a known codec byte."""
+    global _zstd_decompressor
+    blob = bytes(blob)
+    if not blob:
+        return blob
+    codec = blob[0]
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(blob[1:])
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ValueError("Value is zstd-compressed but the zstandard package is not installed")
+        if _zstd_decompressor is None:
+            _zstd_decompressor = zstandard.ZstdDecompressor()
+        return _zstd_decompressor.decompress(blob[1:])
+    raise ValueError(f"Unknown codec byte {codec}")
+
+
+def encode_text(value, min_bytes=MIN_COMPRESS_BYTES):
+    """Prepare a text value for storage: long text becomes a compressed BLOB, everything else is unchanged."""
+    if value is None or isinstance(value, bytes):
+        return value
+    text = value if isinstance(value, str) else str(value)
+    data = text.encode('utf-8')
+    if len(data) < min_bytes:
+        return text
+    return compress_bytes(data)
+
+
+def decode_text(value):
+    """Return the text of a stored value, decompressing BLOBs written by encode_text()."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return decompress_bytes(value).decode('utf-8')
+    return value
+
+
+def decode_columns(form, columns=COMPRESSED_COLUMNS):
+    """Decode the compressed columns of a form dict in place and return it."""
+    for column in columns:
+        value = form.get(column)
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            form[column] = decode_text(value)
+    return form
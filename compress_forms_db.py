@@ -0,0 +1,50 @@
+import os
+import sqlite3
+from db import init_exception_form_db
+from column_codec import COMPRESSED_COLUMNS, encode_text
+
+BATCH_SIZE = 500
+
+def compress_existing_rows(db_path='forms.db', batch_size=BATCH_SIZE, vacuum=True):
+    """
+    One-shot backfill: compress the large text columns of existing forms, then
+    VACUUM so the freed pages are returned to the file system.
+    """
+    init_exception_form_db(db_path)
+    size_before = os.path.getsize(db_path)
+    conn = sqlite3.connect(db_path, timeout=10)
+    c = conn.cursor()
+
+    last_id = 0
+    compressed = 0
+    while True:
+        c.execute(f"SELECT id, {', '.join(COMPRESSED_COLUMNS)} FROM exception_forms WHERE id > ? ORDER BY id LIMIT ?",
+                  (last_id, batch_size))
+        batch = c.fetchall()
+        if not batch:
+            break
+        for row in batch:
+            last_id = row[0]
+            updates = {}
+            for column, value in zip(COMPRESSED_COLUMNS, row[1:]):
+                if isinstance(value, str):
+                    encoded = encode_text(value)
+                    if isinstance(encoded, bytes):
+                        updates[column] = encoded
+            if updates:
+                set_clause = ', '.join(f'{column} = ?' for column in updates)
+                conn.execute(f'UPDATE exception_forms SET {set_clause} WHERE id = ?', list(updates.values()) + [last_id])
+                compressed += len(updates)
+        conn.commit()
+        print(f"Processed forms up to id {last_id} ({compressed} values compressed so far)")
+
+    if vacuum:
+        print("Running VACUUM...")
+        conn.execute('VACUUM')
+    conn.close()
+    size_after = os.path.getsize(db_path)
+    print(f"Compressed {compressed} column values.")
+    print(f"forms.db size: {size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB")
+
+if __name__ == '__main__':
+    compress_existing_rows()
@@ -1,6 +1,8 @@
 # === db.py ===
 import sqlite3
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
+from audit_sink import AUDIT_SINK, INSERT_AUDIT_SQL, audit_timestamp
 
 def init_db():
     conn = sqlite3.connect('users.db')
@@ -39,9 +41,13 @@ def check_user(username, password):
     return False
 
 import sqlite3
+from raw_payloads import init_raw_payloads_table, store_raw_payload, prune_raw_payloads, RAW_COLUMNS
+from search_index import init_search_index, index_raw_text
+from column_codec import encode_text
+from form_values import form_fingerprint, FINGERPRINT_FIELDS
 
-def init_exception_form_db():
-    conn = sqlite3.connect('forms.db')
+def init_exception_form_db(db_path='forms.db'):
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS exception_forms (
@@ -353,71 +359,85 @@ def init_exception_form_db():
     except sqlite3.OperationalError:
         pass  # Column already exists
     
+    # Raw Gemini responses are stored once in raw_payloads and referenced by id
+    try:
+        c.execute("ALTER TABLE exception_forms ADD COLUMN raw_payload_id INTEGER")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    try:
+        c.execute("ALTER TABLE exception_forms ADD COLUMN raw_entry_index INTEGER")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    # Natural-key fingerprint (form_values.form_fingerprint); NULL when the key fields are incomplete
+    try:
+        c.execute("ALTER TABLE exception_forms ADD COLUMN fingerprint TEXT")
+    except sqlite3.OperationalError:
+        pass  # Column already exists
+    
+    init_raw_payloads_table(c)
+    init_search_index(c)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exception_forms_raw_payload_id ON exception_forms(raw_payload_id)')
+    # At most one form per fingerprint; store_exception_form relies on this to skip duplicates
+    c.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_exception_forms_fingerprint ON exception_forms(fingerprint) WHERE fingerprint IS NOT NULL')
+    
+    # Rows are always looked up by their form
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exception_form_rows_form_id ON exception_form_rows(form_id)')
+    
+    # Single-row counter bumped on every write, used to key cached API responses
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    c.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+    
     conn.commit()
     conn.close()
 
-import re
-from exception_codes import exception_codes
+# OCR parsing lives in ocr_parser; re-exported here for existing callers
+from ocr_parser import parse_exception_form  # noqa: F401
 
-def parse_exception_form(ocr_lines):
-    # This is a simplified parser. You may need to adjust regexes for your OCR output.
-    form_data = {
-        'pass_number': '',
-        'title': '',
-        'employee_name': '',
-        'rdos': '',
-        'actual_ot_date': '',
-        'div': '',
-        'comments': '',
-        'supervisor_name': '',
-        'supervisor_pass_no': '',
-        'oto': '',
-        'oto_amount_saved': '',
-        'entered_in_uts': ''
-    }
-    rows = []
+# (Removed example usage block that called parse_exception_form and store_exception_form)
 
-    # Example: parse header fields
-    for line in ocr_lines:
-        if "Pass Number" in line:
-            form_data['pass_number'] = line.split()[-1]
-        elif "Title" in line:
-            form_data['title'] = line.split()[-1]
-        elif "Employee Name" in line:
-            form_data['employee_name'] = line.split(":")[-1].strip()
-        # ...repeat for other fields
+FORM_ROW_FIELDS = [
+    'code', 'code_description', 'line_location', 'run_no',
+    'exception_time_from_hh', 'exception_time_from_mm',
+    'exception_time_to_hh', 'exception_time_to_mm',
+    'overtime_hh', 'overtime_mm', 'bonus_hh', 'bonus_mm',
+    'nite_diff_hh', 'nite_diff_mm', 'ta_job_no'
+]
 
-    # Example: parse table rows (very basic, you may need to improve this)
-    table_start = False
-    for line in ocr_lines:
-        if re.match(r'\d{2,4}', line.strip().split()[0]):  # If line starts with a code
-            table_start = True
-        if table_start:
-            parts = line.split()
-            if len(parts) >= 10:  # crude check for a table row
-                code = parts[0]
-                code_description = exception_codes.get(code, "")
-                row = {
-                    'code': code,
-                    'code_description': code_description,
-                    'line_location': parts[1],
-                    'run_no': parts[2],
-                    'exception_time_from_hh': parts[3],
-                    'exception_time_from_mm': parts[4],
-                    'exception_time_to_hh': parts[5],
-                    'exception_time_to_mm': parts[6],
-                    'overtime_hh': parts[7],
-                    'overtime_mm': parts[8],
-                    'bonus_hh': parts[9],
-                    'bonus_mm': parts[10],
-                    'nite_diff_hh': parts[11] if len(parts) > 11 else '',
-                    'nite_diff_mm': parts[12] if len(parts) > 12 else '',
-                    'ta_job_no': parts[13] if len(parts) > 13 else ''
-                }
-                rows.append(row)
-    return form_data, rows
+def insert_form_rows(c, form_id, rows):
+    """Insert a form's exception_form_rows. Only the fields a row actually has are written."""
+    for row in rows:
+        # Safety check: ensure row is a dictionary
+        if not isinstance(row, dict):
+            print(f"WARNING: row is not a dictionary, type: {type(row)}, content: {row}")
+            continue
+        insert_row_fields = ['form_id'] + [f for f in FORM_ROW_FIELDS if f in row]
+        insert_row_values = [form_id] + [row.get(f, '') for f in insert_row_fields[1:]]
+        row_placeholders = ', '.join(['?'] * len(insert_row_fields))
+        row_sql = f"INSERT INTO exception_form_rows ({', '.join(insert_row_fields)}) VALUES ({row_placeholders})"
+        c.execute(row_sql, insert_row_values)
 
-# (Removed example usage block that called parse_exception_form and store_exception_form)
+def refresh_fingerprint(conn, form_id):
+    """
+    Recompute a stored form's fingerprint after its key fields changed. If another form
+    already holds the new fingerprint, this one is left without one (a duplicate for cleanup).
+    Returns the fingerprint now stored.
+    """
+    row = conn.execute(f"SELECT form_type, status, {', '.join(FINGERPRINT_FIELDS)} FROM exception_forms WHERE id = ?", (form_id,)).fetchone()
+    if not row:
+        return None
+    form_type, status = row[0], row[1]
+    fingerprint = form_fingerprint(dict(zip(FINGERPRINT_FIELDS, row[2:])), form_type) if status != 'error' else None
+    conn.execute('UPDATE exception_forms SET fingerprint = NULL WHERE id = ?', (form_id,))
+    if fingerprint:
+        conn.execute('UPDATE OR IGNORE exception_forms SET fingerprint = ? WHERE id = ?', (fingerprint, form_id))
+    return conn.execute('SELECT fingerprint FROM exception_forms WHERE id = ?', (form_id,)).fetchone()[0]
 
 def store_exception_form(form_data, rows, username, form_type=None, upload_date=None):
     print(f"DEBUG: store_exception_form called with form_data type: {type(form_data)}, rows type: {type(rows)}")
@@ -425,14 +445,23 @@ def store_exception_form(form_data, rows, username, form_type=None, upload_date=
     import sqlite3
     with sqlite3.connect('forms.db', timeout=10) as conn:
         c = conn.cursor()
-        # Ensure the database is properly initialized
-        init_exception_form_db()
+        # Ensure the database is initialized (a no-op after the first call in this process)
+        ensure_db_initialized()
+        # Forms extracted from a stored response reference it instead of copying its JSON
+        raw_values = {column: encode_text(form_data.get(column, '')) for column in RAW_COLUMNS}
+        # Error placeholders are always stored; anything else with a complete natural key is stored once
+        fingerprint = form_fingerprint(form_data, form_type) if form_data.get('status') != 'error' else None
+        raw_payload_id = None
+        if form_data.get('raw_payload'):
+            raw_payload_id = store_raw_payload(conn, form_data['raw_payload'])
+            raw_values = dict.fromkeys(RAW_COLUMNS)
         # Insert form with form_type and upload_date
         c.execute('''
             INSERT INTO exception_forms (
                 pass_number, title, employee_name, rdos, actual_ot_date, div, comments, supervisor_name, supervisor_pass_no, oto, oto_amount_saved, entered_in_uts, regular_assignment, report, relief, todays_date, status, username, ocr_lines, form_type, upload_date, file_name, reg, superintendent_authorization_signature, superintendent_authorization_pass, superintendent_authorization_date, entered_into_uts, raw_gemini_json,
-                overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                overtime_hours, report_loc, overtime_location, report_time, relief_time, date_of_overtime, job_number, rc_number, acct_number, reason_rdo, reason_absentee_coverage, reason_no_lunch, reason_early_report, reason_late_clear, reason_save_as_oto, reason_capital_support_go, reason_other, amount, raw_extracted_data, extraction_mode, raw_extracted_data_pure, raw_extracted_data_mapped, raw_payload_id, raw_entry_index, fingerprint
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT DO NOTHING
         ''', (
             form_data.get('pass_number', ''),
             form_data.get('title', ''),
@@ -452,7 +481,7 @@ def store_exception_form(form_data, rows, username, form_type=None, upload_date=
             form_data.get('todays_date', ''),
             form_data.get('status', 'processed'),
             username,
-            str(form_data.get('ocr_lines', '')),
+            encode_text(str(form_data.get('ocr_lines', ''))),
             form_type or '',
             upload_date or '',
             form_data.get('file_name', ''),
@@ -461,7 +490,7 @@ def store_exception_form(form_data, rows, username, form_type=None, upload_date=
             form_data.get('superintendent_authorization_pass', ''),
             form_data.get('superintendent_authorization_date', ''),
             form_data.get('entered_into_uts', ''),
-            form_data.get('raw_gemini_json', ''),
+            raw_values['raw_gemini_json'],
             form_data.get('overtime_hours', ''),
             form_data.get('report_loc', ''),
             form_data.get('overtime_location', ''),
@@ -480,36 +509,34 @@ def store_exception_form(form_data, rows, username, form_type=None, upload_date=
             form_data.get('reason_capital_support_go', 0),
             form_data.get('reason_other', 0),
             form_data.get('amount', ''),
-            form_data.get('raw_extracted_data', ''),
+            raw_values['raw_extracted_data'],
             form_data.get('extraction_mode', ''),
-            form_data.get('raw_extracted_data_pure', ''),
-            form_data.get('raw_extracted_data_mapped', '')
+            raw_values['raw_extracted_data_pure'],
+            raw_values['raw_extracted_data_mapped'],
+            raw_payload_id,
+            form_data.get('raw_entry_index') if raw_payload_id else None,
+            fingerprint
         ))
+        if not c.rowcount:
+            # Same natural key as a stored form: report which one and drop the payload if nothing uses it
+            existing = c.execute('SELECT id FROM exception_forms WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            form_data['duplicate_of'] = existing[0] if existing else None
+            print(f"Duplicate form skipped: fingerprint {fingerprint} already stored as form {form_data['duplicate_of']}")
+            if raw_payload_id:
+                prune_raw_payloads(conn, [raw_payload_id])
+            conn.commit()
+            return None
         form_id = c.lastrowid
+        # The insert trigger indexed the plain columns; add the raw JSON values
+        index_raw_text(conn, form_id)
         # Insert rows if any
-        row_fields = [
-            'form_id', 'code', 'code_description', 'line_location', 'run_no',
-            'exception_time_from_hh', 'exception_time_from_mm',
-            'exception_time_to_hh', 'exception_time_to_mm',
-            'overtime_hh', 'overtime_mm', 'bonus_hh', 'bonus_mm',
-            'nite_diff_hh', 'nite_diff_mm', 'ta_job_no'
-        ]
-        for row in rows:
-            # Safety check: ensure row is a dictionary
-            if not isinstance(row, dict):
-                print(f"WARNING: row is not a dictionary, type: {type(row)}, content: {row}")
-                continue
-            insert_row_fields = [f for f in row_fields if f == 'form_id' or f in row]
-            insert_row_values = [form_id if f == 'form_id' else row.get(f, '') for f in insert_row_fields]
-            row_placeholders = ', '.join(['?'] * len(insert_row_fields))
-            row_sql = f"INSERT INTO exception_form_rows ({', '.join(insert_row_fields)}) VALUES ({row_placeholders})"
-            c.execute(row_sql, insert_row_values)
+        insert_form_rows(c, form_id, rows)
+        bump_data_version(conn)
         conn.commit()
         return form_id
 
-def init_audit_db():
-    conn = sqlite3.connect('forms.db')
-    c = conn.cursor()
+def create_audit_table(c):
+    """Create audit_trail and its indexes; shared by forms.db and the monthly audit archives."""
     c.execute('''
         CREATE TABLE IF NOT EXISTS audit_trail (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -521,19 +548,114 @@ def init_audit_db():
             details TEXT
         )
     ''')
+    # Keyset pagination walks (timestamp, id) newest first; id is the rowid, so every index below ends in it
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_trail_timestamp ON audit_trail(timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_trail_username ON audit_trail(username, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_trail_action ON audit_trail(action, timestamp)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_trail_target ON audit_trail(target_type, target_id, timestamp)')
+
+def init_audit_db():
+    conn = sqlite3.connect('forms.db')
+    c = conn.cursor()
+    create_audit_table(c)
     conn.commit()
     conn.close()
 
+AUDIT_COLUMNS = ['id', 'username', 'action', 'target_type', 'target_id', 'timestamp', 'details']
+AUDIT_PAGE_SIZE = 100
+MAX_AUDIT_PAGE_SIZE = 500
+
+def encode_audit_cursor(timestamp, audit_id):
+    return f"{timestamp}|{audit_id}"
+
+def decode_audit_cursor(cursor):
+    """Split a cursor from encode_audit_cursor into (timestamp, id). Raises ValueError if malformed."""
+    timestamp, _, audit_id = cursor.rpartition('|')
+    if not timestamp:
+        raise ValueError(f"Invalid audit cursor: {cursor!r}")
+    return timestamp, int(audit_id)
+
+def query_audit_trail(conn, username=None, action=None, target_type=None, target_id=None,
+                      since=None, until=None, cursor=None, limit=AUDIT_PAGE_SIZE):
+    """
+    One page of audit entries, newest first, as (entries, next_cursor).
+    since is inclusive and until exclusive ('YYYY-MM-DD HH:MM:SS', UTC like the
+    stored timestamps). Pass next_cursor back as cursor for the following page;
+    it is None on the last page.
+    """
+    conditions = []
+    params = []
+    for column, value in (('username', username), ('action', action), ('target_type', target_type), ('target_id', target_id)):
+        if value is not None:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+    if since:
+        conditions.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        conditions.append('timestamp < ?')
+        params.append(until)
+    if cursor:
+        conditions.append('(timestamp, id) < (?, ?)')
+        params.extend(decode_audit_cursor(cursor))
+    query = f"SELECT {', '.join(AUDIT_COLUMNS)} FROM audit_trail"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # Fetch one extra row to know whether another page follows
+    query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    entries = [dict(zip(AUDIT_COLUMNS, row)) for row in conn.execute(query, params).fetchall()]
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_audit_cursor(entries[-1]['timestamp'], entries[-1]['id'])
+    return entries, next_cursor
+
+_db_initialized = False
+_db_init_lock = threading.Lock()
+
+def ensure_db_initialized():
+    """Create/upgrade the users and forms.db tables and enable WAL, once per process."""
+    global _db_initialized
+    if _db_initialized:
+        return
+    with _db_init_lock:
+        if _db_initialized:
+            return
+        init_db()
+        init_exception_form_db()
+        init_audit_db()
+        # Enable WAL mode for better SQLite concurrency
+        with sqlite3.connect('forms.db', timeout=10) as conn:
+            conn.execute('PRAGMA journal_mode=WAL;')
+        _db_initialized = True
+
 def log_audit(username, action, target_type, target_id, details="", conn=None):
+    """
+    Record an audit entry. With conn, the row is inserted in the caller's open
+    transaction and committed with it; without, it is queued on AUDIT_SINK and
+    written in a batch shortly after.
+    """
+    if conn is None:
+        AUDIT_SINK.log(username, action, target_type, target_id, details)
+        return
+    conn.execute(INSERT_AUDIT_SQL, (username, action, target_type, target_id, details, audit_timestamp()))
+
+def get_data_version(conn=None):
+    """Return the current data version, or 0 if the counter table is missing."""
     close_conn = False
     if conn is None:
         conn = sqlite3.connect('forms.db', timeout=10)
         close_conn = True
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO audit_trail (username, action, target_type, target_id, details)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (username, action, target_type, target_id, details))
-    if close_conn:
-        conn.commit()
-        conn.close()
\ No newline at end of file
+    try:
+        row = conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()
+        return row[0] if row else 0
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        if close_conn:
+            conn.close()
+
+def bump_data_version(conn):
+    """Mark forms.db as changed. Call inside the writing transaction, before commit."""
+    conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
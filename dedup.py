@@ -0,0 +1,115 @@
+# === dedup.py ===
+"""
+In-memory deduplication of the entries extracted from one page or file.
+
+Supervisor pages are cut into overlapping crops (halves, quarters, eighths,
+tenths, full page) and each crop is extracted on its own, so the same slip
+usually comes back several times with small OCR differences. dedupe_entries()
+groups those copies before anything is stored and keeps the most complete one.
+
+Two entries are the same slip when their fingerprints (form_values.form_fingerprint)
+match, or when they agree on pass number, overtime date and hours and their
+other identifying fields are similar enough to be OCR variants of each other.
+Hourly entries keep their date in actual_ot_date and their hours in the rows,
+so for them the date falls back to actual_ot_date and the rows must match
+instead. Entries missing a date or hours are never merged fuzzily.
+"""
+from difflib import SequenceMatcher
+
+from form_values import form_fingerprint, normalize_identifier, parse_form_date, parse_overtime_minutes
+
+# Fields compared fuzzily once the exact keys agree
+SIMILARITY_FIELDS = ['job_number', 'employee_name', 'title', 'rc_number', 'overtime_location', 'report_loc']
+SIMILARITY_THRESHOLD = 0.85
+# Row fields that identify an overtime row, compared when an entry has no overtime_hours
+ROW_SIGNATURE_FIELDS = [
+    'code', 'line_location', 'run_no', 'exception_time_from_hh', 'exception_time_from_mm',
+    'exception_time_to_hh', 'exception_time_to_mm', 'overtime_hh', 'overtime_mm'
+]
+# Values that do not count towards an entry's completeness
+EMPTY_VALUES = ('', None, 'N/A', False, 0, '0')
+
+
+def _date_key(value):
+    parsed = parse_form_date(value)
+    return parsed.isoformat() if parsed else normalize_identifier(value)
+
+
+def _hours_key(value):
+    minutes = parse_overtime_minutes(value)
+    return str(minutes) if minutes is not None else normalize_identifier(value)
+
+
+def rows_signature(rows):
+    """The identifying values of an entry's rows, order-independent; () when no row has any."""
+    signature = []
+    for row in rows or []:
+        if isinstance(row, dict):
+            values = tuple(normalize_identifier(row.get(field)) for field in ROW_SIGNATURE_FIELDS)
+            if any(values):
+                signature.append(values)
+    return tuple(sorted(signature))
+
+
+class EntryKey:
+    """The comparable values of one entry, computed once."""
+    __slots__ = ('fingerprint', 'pass_number', 'date', 'hours', 'rows', 'fields')
+
+    def __init__(self, form_data, form_type=None, rows=None):
+        self.fingerprint = form_fingerprint(form_data, form_type)
+        self.pass_number = normalize_identifier(form_data.get('pass_number'))
+        self.date = _date_key(form_data.get('date_of_overtime') or form_data.get('actual_ot_date'))
+        self.hours = _hours_key(form_data.get('overtime_hours'))
+        self.rows = rows_signature(rows) if not self.hours else ()
+        self.fields = {field: normalize_identifier(form_data.get(field)) for field in SIMILARITY_FIELDS}
+
+    def same_slip(self, other, threshold=SIMILARITY_THRESHOLD):
+        if self.fingerprint and self.fingerprint == other.fingerprint:
+            return True
+        # Exact keys must agree; a different date or duration is a different slip
+        if not self.pass_number or self.pass_number != other.pass_number:
+            return False
+        if not self.date or self.date != other.date or self.hours != other.hours:
+            return False
+        if not self.hours and (not self.rows or self.rows != other.rows):
+            return False  # Without hours only identical rows show it is the same slip
+        shared = [field for field in SIMILARITY_FIELDS if self.fields[field] and other.fields[field]]
+        if not shared:
+            return True  # Nothing left that could tell them apart
+        total = 0.0
+        for field in shared:
+            a, b = self.fields[field], other.fields[field]
+            total += 1.0 if a == b else SequenceMatcher(None, a, b).ratio()
+        return total / len(shared) >= threshold
+
+
+def completeness(entry):
+    """Number of filled fields and rows of an extracted (form_data, rows, ...) entry."""
+    form_data, rows = entry[0], entry[1]
+    filled = sum(1 for value in form_data.values() if not isinstance(value, (dict, list)) and value not in EMPTY_VALUES)
+    return filled + len(rows or [])
+
+
+def dedupe_entries(entries, form_type=None, threshold=SIMILARITY_THRESHOLD):
+    """
+    Collapse copies of the same slip in a list of (form_data, rows, ...) tuples.
+    Keeps the most complete entry of each group (the first one on ties), in
+    first-seen order. Returns (kept_entries, number_dropped).
+    """
+    clusters = []  # [key of first entry, best entry, best completeness]
+    for entry in entries:
+        form_data = entry[0]
+        if not isinstance(form_data, dict) or form_data.get('status') == 'error':
+            clusters.append([None, entry, 0])
+            continue
+        key = EntryKey(form_data, form_type, entry[1])
+        score = completeness(entry)
+        for cluster in clusters:
+            if cluster[0] is not None and key.same_slip(cluster[0], threshold):
+                if score > cluster[2]:
+                    cluster[1], cluster[2] = entry, score
+                break
+        else:
+            clusters.append([key, entry, score])
+    kept = [cluster[1] for cluster in clusters]
+    return kept, len(entries) - len(kept)
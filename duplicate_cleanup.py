@@ -0,0 +1,191 @@
+# === duplicate_cleanup.py ===
+"""
+Incremental removal of duplicate forms already in forms.db.
+
+cleanup_duplicates() walks exception_forms in id-ordered chunks. A form
+without a fingerprint gets one computed (form_values.form_fingerprint) and
+looked up through the unique fingerprint index: if another form already holds
+it, the newer of the two is a duplicate and is deleted together with its
+exception_form_rows and its audit_trail entries; otherwise the form claims the
+fingerprint. Each chunk is its own short transaction, so uploads can write
+between chunks. All form types are handled; forms with an error status or
+without pass number, date or hours are never touched.
+
+Run from the command line (python duplicate_cleanup.py --help) or through
+POST /cleanup-duplicates.
+"""
+import datetime
+import sqlite3
+import threading
+import time
+
+import fast_json
+from audit_sink import AUDIT_SINK
+from db import bump_data_version, init_exception_form_db, init_audit_db, log_audit
+from form_values import form_fingerprint, FINGERPRINT_FIELDS
+from raw_payloads import prune_raw_payloads
+
+CLEANUP_CHUNK_SIZE = 500
+
+_cleanup_lock = threading.Lock()
+_cleanup_state = {'status': 'idle'}
+
+
+def _read_chunk(conn, after_id, chunk_size, form_type):
+    query = f"SELECT id, form_type, status, fingerprint, {', '.join(FINGERPRINT_FIELDS)} FROM exception_forms WHERE id > ?"
+    params = [after_id]
+    if form_type:
+        query += " AND form_type = ?"
+        params.append(form_type)
+    query += " ORDER BY id LIMIT ?"
+    params.append(chunk_size)
+    return conn.execute(query, params).fetchall()
+
+
+def _fingerprint_holder(conn, fingerprint, claimed):
+    """Id of the form holding fingerprint: claimed in this run (dry run) or in the index."""
+    if fingerprint in claimed:
+        return claimed[fingerprint]
+    row = conn.execute('SELECT id FROM exception_forms WHERE fingerprint = ?', (fingerprint,)).fetchone()
+    return row[0] if row else None
+
+
+def _count_links(conn, form_ids):
+    placeholders = ', '.join('?' * len(form_ids))
+    rows = conn.execute(f'SELECT COUNT(*) FROM exception_form_rows WHERE form_id IN ({placeholders})', form_ids).fetchone()[0]
+    audit = conn.execute(f"SELECT COUNT(*) FROM audit_trail WHERE target_type = 'form' AND target_id IN ({placeholders})",
+                         form_ids).fetchone()[0]
+    return rows, audit
+
+
+def _delete_forms(conn, form_ids):
+    """Delete forms with their rows and audit entries. Returns (rows deleted, audit entries deleted, payloads pruned)."""
+    placeholders = ', '.join('?' * len(form_ids))
+    c = conn.cursor()
+    payload_ids = [row[0] for row in c.execute(f'SELECT raw_payload_id FROM exception_forms WHERE id IN ({placeholders})', form_ids)]
+    c.execute(f'DELETE FROM exception_form_rows WHERE form_id IN ({placeholders})', form_ids)
+    rows = c.rowcount
+    c.execute(f"DELETE FROM audit_trail WHERE target_type = 'form' AND target_id IN ({placeholders})", form_ids)
+    audit = c.rowcount
+    c.execute(f'DELETE FROM exception_forms WHERE id IN ({placeholders})', form_ids)
+    return rows, audit, prune_raw_payloads(conn, payload_ids)
+
+
+def cleanup_duplicates(form_type=None, chunk_size=CLEANUP_CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Delete duplicate forms chunk by chunk, keeping the oldest copy of each.
+    dry_run only counts what would be deleted. progress, if given, is called
+    with the running stats after every chunk. Returns the stats dict.
+    """
+    stats = {
+        'scanned': 0, 'fingerprinted': 0, 'duplicates': 0, 'deleted_forms': 0, 'deleted_rows': 0,
+        'deleted_audit_entries': 0, 'pruned_payloads': 0, 'last_id': 0, 'dry_run': dry_run
+    }
+    start_time = time.time()
+    init_exception_form_db()
+    init_audit_db()
+    AUDIT_SINK.flush()  # Buffered upload entries of a duplicate must be on disk to be deleted with it
+    conn = sqlite3.connect('forms.db', timeout=10)
+    claimed = {}  # fingerprint -> form id, for forms a dry run would have fingerprinted
+    try:
+        while True:
+            forms = _read_chunk(conn, stats['last_id'], chunk_size, form_type)
+            if not forms:
+                break
+            stats['scanned'] += len(forms)
+            stats['last_id'] = forms[-1][0]
+
+            duplicate_ids = []
+            for row in forms:
+                form_id, row_form_type, status, fingerprint = row[:4]
+                if fingerprint or status == 'error' or form_id in duplicate_ids:
+                    continue
+                fingerprint = form_fingerprint(dict(zip(FINGERPRINT_FIELDS, row[4:])), row_form_type)
+                if not fingerprint:
+                    continue
+                holder_id = _fingerprint_holder(conn, fingerprint, claimed)
+                if holder_id is not None and holder_id < form_id:
+                    duplicate_ids.append(form_id)
+                    continue
+                if holder_id is not None:
+                    # A newer upload took the fingerprint before this form was backfilled; keep the older one
+                    duplicate_ids.append(holder_id)
+                    if not dry_run:
+                        conn.execute('UPDATE exception_forms SET fingerprint = NULL WHERE id = ?', (holder_id,))
+                if dry_run:
+                    claimed[fingerprint] = form_id
+                else:
+                    conn.execute('UPDATE exception_forms SET fingerprint = ? WHERE id = ?', (fingerprint, form_id))
+                stats['fingerprinted'] += 1
+
+            stats['duplicates'] += len(duplicate_ids)
+            if duplicate_ids and dry_run:
+                rows, audit = _count_links(conn, duplicate_ids)
+                stats['deleted_rows'] += rows
+                stats['deleted_audit_entries'] += audit
+            elif duplicate_ids:
+                rows, audit, pruned = _delete_forms(conn, duplicate_ids)
+                stats['deleted_forms'] += len(duplicate_ids)
+                stats['deleted_rows'] += rows
+                stats['deleted_audit_entries'] += audit
+                stats['pruned_payloads'] += pruned
+                bump_data_version(conn)
+            if not dry_run:
+                conn.commit()
+
+            stats['elapsed_seconds'] = round(time.time() - start_time, 1)
+            print(f"Duplicate cleanup: scanned {stats['scanned']} forms up to id {stats['last_id']}, {stats['duplicates']} duplicates")
+            if progress:
+                progress(dict(stats))
+
+        if stats['deleted_forms']:
+            log_audit('system', 'cleanup_duplicates', 'forms', None, fast_json.dumps(stats), conn=conn)
+            conn.commit()
+    finally:
+        conn.close()
+    stats['elapsed_seconds'] = round(time.time() - start_time, 1)
+    return stats
+
+
+def get_cleanup_status():
+    with _cleanup_lock:
+        return dict(_cleanup_state)
+
+
+def start_cleanup_job(**options):
+    """Run cleanup_duplicates() on a background thread. Returns False if a cleanup is already running."""
+    with _cleanup_lock:
+        if _cleanup_state.get('status') == 'running':
+            return False
+        _cleanup_state.clear()
+        _cleanup_state.update({'status': 'running', 'options': options, 'started_at': datetime.datetime.now().isoformat()})
+
+    def report(stats):
+        with _cleanup_lock:
+            _cleanup_state['stats'] = stats
+
+    def run():
+        try:
+            stats = cleanup_duplicates(progress=report, **options)
+            result = {'status': 'finished', 'stats': stats}
+        except Exception as e:
+            print(f"Duplicate cleanup failed: {e}")
+            result = {'status': 'failed', 'error': str(e)}
+        with _cleanup_lock:
+            _cleanup_state.update(result)
+            _cleanup_state['finished_at'] = datetime.datetime.now().isoformat()
+
+    threading.Thread(target=run, name='cleanup-duplicates', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Delete duplicate forms, keeping the oldest copy of each.')
+    parser.add_argument('--form-type', choices=['hourly', 'supervisor'])
+    parser.add_argument('--chunk-size', type=int, default=CLEANUP_CHUNK_SIZE)
+    parser.add_argument('--dry-run', action='store_true', help='Count duplicates without deleting anything')
+    args = parser.parse_args()
+    result = cleanup_duplicates(form_type=args.form_type, chunk_size=args.chunk_size, dry_run=args.dry_run)
+    print(fast_json.dumps(result, indent=True))
@@ -0,0 +1,206 @@
+# === export_jobs.py ===
+"""
+Background export jobs for /api/forms/export/jobs.
+
+A job records the export filters and format. A worker thread writes the file
+into EXPORT_FOLDER, and clients poll the job and download the finished
+artifact. Jobs are keyed on (format, filters, data version), so repeating an
+export while forms.db is unchanged reuses the finished file instead of
+regenerating it.
+"""
+import datetime
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db import get_data_version
+from exporter import open_export, write_xlsx, write_parquet, iter_csv, export_filename, EXPORT_FORMATS
+
+EXPORT_FOLDER = 'exports'
+EXPORT_WORKERS = 1
+# Queued/running jobs older than this are assumed lost (e.g. server restart) and not reused
+EXPORT_JOB_STALE_SECONDS = 60 * 60
+EXPORT_ARTIFACT_MAX_AGE_DAYS = 7
+
+_executor = None
+_executor_lock = threading.Lock()
+
+JOB_COLUMNS = [
+    'id', 'job_key', 'format', 'form_type', 'extraction_mode', 'data_version', 'status',
+    'file_path', 'file_name', 'error', 'username', 'created_at', 'finished_at'
+]
+
+
+def init_export_jobs_db():
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_key TEXT,
+                format TEXT,
+                form_type TEXT,
+                extraction_mode TEXT,
+                data_version INTEGER,
+                status TEXT DEFAULT 'queued',
+                file_path TEXT,
+                file_name TEXT,
+                error TEXT,
+                username TEXT,
+                created_at TEXT,
+                finished_at TEXT
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_export_jobs_job_key ON export_jobs(job_key, status)')
+        conn.commit()
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix='export-job')
+        return _executor
+
+
+def export_job_key(export_format, form_type, extraction_mode, data_version):
+    key = f"{export_format}|{form_type or ''}|{extraction_mode or ''}|{data_version}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def get_export_job(job_id, include_path=False):
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    if not include_path:
+        job.pop('file_path', None)
+    return job
+
+
+def _find_reusable_job(conn, job_key):
+    """Return a finished job whose file still exists, or a recent queued/running one."""
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs
+        WHERE job_key = ? AND status IN ('finished', 'running', 'queued')
+        ORDER BY id DESC
+    ''', (job_key,))
+    stale_before = (datetime.datetime.now() - datetime.timedelta(seconds=EXPORT_JOB_STALE_SECONDS)).isoformat()
+    for row in c.fetchall():
+        job = dict(zip(JOB_COLUMNS, row))
+        if job['status'] == 'finished':
+            if job['file_path'] and os.path.exists(job['file_path']):
+                return job
+        elif job['created_at'] and job['created_at'] >= stale_before:
+            return job
+    return None
+
+
+def submit_export_job(export_format='xlsx', form_type=None, extraction_mode=None, username=None):
+    """
+    Create an export job, or reuse an identical one for the current data version.
+    Returns (job, reused).
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{export_format}'")
+
+    prune_export_artifacts()
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        data_version = get_data_version(conn)
+        job_key = export_job_key(export_format, form_type, extraction_mode, data_version)
+        existing = _find_reusable_job(conn, job_key)
+        if existing:
+            existing.pop('file_path', None)
+            return existing, True
+
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO export_jobs (job_key, format, form_type, extraction_mode, data_version, status, file_name, username, created_at)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?)
+        ''', (job_key, export_format, form_type, extraction_mode, data_version,
+              export_filename(form_type, extraction_mode, export_format), username or 'unknown',
+              datetime.datetime.now().isoformat()))
+        job_id = c.lastrowid
+        conn.commit()
+
+    _get_executor().submit(run_export_job, job_id)
+    return get_export_job(job_id), False
+
+
+def _set_job_status(job_id, status, **fields):
+    assignments = ['status = ?'] + [f'{name} = ?' for name in fields]
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        conn.execute(f"UPDATE export_jobs SET {', '.join(assignments)} WHERE id = ?",
+                     [status] + list(fields.values()) + [job_id])
+        conn.commit()
+
+
+def run_export_job(job_id):
+    """Generate the artifact for a queued job. Runs on the export worker thread."""
+    job = get_export_job(job_id, include_path=True)
+    if not job:
+        return
+    _set_job_status(job_id, 'running')
+    start_time = time.time()
+
+    os.makedirs(EXPORT_FOLDER, exist_ok=True)
+    final_path = os.path.join(EXPORT_FOLDER, f"{job_id}_{job['file_name']}")
+    partial_path = final_path + '.part'
+    try:
+        conn = sqlite3.connect('forms.db', timeout=10)
+        try:
+            # Read the data version and the export from one snapshot so the artifact matches its key
+            conn.execute('BEGIN')
+            data_version = get_data_version(conn)
+            typed = job['format'] == 'parquet'
+            export_columns, headers, rows = open_export(conn, job['form_type'], job['extraction_mode'], typed=typed)
+            if job['format'] == 'csv':
+                with open(partial_path, 'w', newline='', encoding='utf-8') as export_file:
+                    for chunk in iter_csv(headers, rows):
+                        export_file.write(chunk)
+            else:
+                with open(partial_path, 'wb') as export_file:
+                    if typed:
+                        write_parquet(export_file, export_columns, headers, rows)
+                    else:
+                        write_xlsx(export_file, export_columns, headers, rows)
+            conn.rollback()
+        finally:
+            conn.close()
+
+        os.replace(partial_path, final_path)
+        _set_job_status(
+            job_id, 'finished',
+            file_path=final_path,
+            data_version=data_version,
+            job_key=export_job_key(job['format'], job['form_type'], job['extraction_mode'], data_version),
+            finished_at=datetime.datetime.now().isoformat()
+        )
+        print(f"Export job {job_id} finished in {time.time() - start_time:.1f}s: {final_path}")
+    except Exception as e:
+        print(f"Export job {job_id} failed: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        _set_job_status(job_id, 'failed', error=str(e), finished_at=datetime.datetime.now().isoformat())
+
+
+def prune_export_artifacts(max_age_days=EXPORT_ARTIFACT_MAX_AGE_DAYS):
+    """Delete artifacts of jobs that finished more than max_age_days ago."""
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=max_age_days)).isoformat()
+    with sqlite3.connect('forms.db', timeout=10) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, file_path FROM export_jobs WHERE status = 'finished' AND finished_at < ?", (cutoff,))
+        expired = c.fetchall()
+        for job_id, file_path in expired:
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+        if expired:
+            c.executemany("UPDATE export_jobs SET status = 'expired', file_path = NULL WHERE id = ?",
+                          [(job_id,) for job_id, _ in expired])
+            conn.commit()
@@ -0,0 +1,421 @@
+# === exporter.py ===
+"""
+Export helpers for /api/forms/export.
+
+Forms and their overtime rows are flattened into spreadsheet rows by
+open_export(), which yields them lazily so writers never hold the whole
+result set in memory. Forms and rows are read with two ordered queries and
+merge-joined on form id, so an export costs the same number of queries no
+matter how many forms it contains.
+
+The same rows back every export format: write_xlsx() streams them into a
+write-only openpyxl workbook, iter_csv() into CSV text and write_parquet()
+into Parquet record batches. Parquet exports additionally carry typed
+columns for overtime minutes, the overtime date and the reason checkboxes.
+"""
+import csv
+import io
+import os
+from itertools import chain, islice
+
+import fast_json
+from form_values import parse_overtime_minutes, parse_hh_mm_minutes, parse_form_date, parse_flag
+from raw_payloads import hydrate_raw_columns
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+CSV_FLUSH_ROWS = 500
+PARQUET_BATCH_ROWS = 5000
+WIDTH_SAMPLE_ROWS = 200
+MAX_COLUMN_WIDTH = 50
+
+# Enhanced headers focusing on overtime data
+EXPORT_HEADER_MAP = {
+    'id': 'Form ID',
+    'pass_number': 'Pass Number',
+    'title': 'Title',
+    'employee_name': 'Employee Name',
+    'rdos': 'RDOS',
+    'actual_ot_date': 'Actual OT Date',
+    'div': 'DIV',
+    'comments': 'Comments',
+    'supervisor_name': 'Supervisor Name',
+    'supervisor_pass_no': 'Supervisor Pass No.',
+    'oto': 'OTO',
+    'oto_amount_saved': 'OTO Amount Saved',
+    'entered_in_uts': 'Entered in UTS',
+    'regular_assignment': 'Regular Assignment',
+    'report': 'Report',
+    'relief': 'Relief',
+    'todays_date': "Today's Date",
+    'form_type': 'Form Type',
+    'extraction_mode': 'Extraction Mode',
+    'raw_extracted_data': 'Raw Gemini Data (JSON)',
+    'raw_gemini_json': 'Raw Gemini JSON',
+    'upload_date': 'Upload Date'
+}
+
+# First: Essential overtime fields
+OVERTIME_FIELDS = [
+    'id', 'pass_number', 'employee_name', 'actual_ot_date', 'form_type',
+    'overtime_hours', 'report_loc', 'overtime_location', 'report_time', 'relief_time',
+    'date_of_overtime', 'job_number', 'rc_number', 'acct_number', 'amount'
+]
+
+# Then: Other important fields
+OTHER_FIELDS = [
+    'title', 'rdos', 'div', 'comments', 'supervisor_name', 'supervisor_pass_no',
+    'oto', 'oto_amount_saved', 'entered_in_uts', 'regular_assignment', 'report', 'relief',
+    'todays_date', 'extraction_mode', 'upload_date'
+]
+
+# Finally: Raw data fields for debugging
+RAW_FIELDS = ['raw_extracted_data', 'raw_gemini_json']
+
+# Detailed overtime row data appended after the form columns
+OVERTIME_ROW_HEADERS = [
+    'OT Row ID', 'Exception Code', 'Code Description', 'Line/Location', 'Run No.',
+    'Exception Time From (HH:MM)', 'Exception Time To (HH:MM)',
+    'Overtime Hours (HH:MM)', 'Bonus Hours (HH:MM)', 'Night Differential (HH:MM)',
+    'TA Job No.'
+]
+
+# Extra typed columns appended to Parquet exports: (header, arrow type name)
+TYPED_EXPORT_COLUMNS = [
+    ('Overtime Minutes', 'int64'),
+    ('OT Row Minutes', 'int64'),
+    ('Overtime Date', 'date32'),
+    ('Reason RDO', 'bool_'),
+    ('Reason Absentee Coverage', 'bool_'),
+    ('Reason No Lunch', 'bool_'),
+    ('Reason Early Report', 'bool_'),
+    ('Reason Late Clear', 'bool_'),
+    ('Reason Save As OTO', 'bool_'),
+    ('Reason Capital Support GO', 'bool_'),
+    ('Reason Other', 'bool_')
+]
+
+REASON_FIELDS = [
+    'reason_rdo', 'reason_absentee_coverage', 'reason_no_lunch', 'reason_early_report',
+    'reason_late_clear', 'reason_save_as_oto', 'reason_capital_support_go', 'reason_other'
+]
+
+# Integer id columns in the flattened layout (typed in Parquet exports)
+INTEGER_HEADERS = ['Form ID', 'OT Row ID']
+
+EXPORT_FORMATS = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+# Width hints for columns whose sampled values are not representative
+COLUMN_WIDTH_HINTS = {
+    'comments': 40,
+    'raw_extracted_data': MAX_COLUMN_WIDTH,
+    'raw_gemini_json': MAX_COLUMN_WIDTH,
+    'upload_date': 28
+}
+
+
+def build_export_filters(form_type=None, extraction_mode=None, prefix=''):
+    """Build the WHERE clause shared by the form and row export queries."""
+    where = "1=1"
+    params = []
+
+    if form_type:
+        where += f" AND {prefix}form_type = ?"
+        params.append(form_type)
+
+    if extraction_mode:
+        # Handle combined extraction mode - when user wants 'mapped' or 'pure', also include 'combined' forms
+        if extraction_mode in ('mapped', 'pure'):
+            where += f" AND ({prefix}extraction_mode = ? OR {prefix}extraction_mode = 'combined')"
+        else:
+            where += f" AND {prefix}extraction_mode = ?"
+        params.append(extraction_mode)
+
+    return where, params
+
+
+def build_export_query(form_type=None, extraction_mode=None):
+    """Build the filtered exception_forms query used by every export format."""
+    where, params = build_export_filters(form_type, extraction_mode)
+    return f"SELECT * FROM exception_forms WHERE {where} ORDER BY id", params
+
+
+def build_export_rows_query(form_type=None, extraction_mode=None):
+    """Build the query for the overtime rows of every exported form, ordered for the merge join."""
+    where, params = build_export_filters(form_type, extraction_mode, prefix='f.')
+    query = f'''
+        SELECT r.* FROM exception_form_rows r
+        JOIN exception_forms f ON f.id = r.form_id
+        WHERE {where}
+        ORDER BY r.form_id, r.id
+    '''
+    return query, params
+
+
+def export_filename(form_type=None, extraction_mode=None, extension='xlsx'):
+    """Generate filename based on filters, e.g. exception_forms_hourly_mapped.xlsx"""
+    filename_parts = ['exception_forms']
+    if form_type:
+        filename_parts.append(form_type)
+    if extraction_mode:
+        filename_parts.append(extraction_mode)
+    return '_'.join(filename_parts) + '.' + extension
+
+
+def select_export_columns(columns):
+    """Pick and order the exported form columns. Returns (column_names, headers)."""
+    export_columns = []
+    for field in OVERTIME_FIELDS + OTHER_FIELDS + RAW_FIELDS:
+        if field in columns and field not in export_columns:
+            export_columns.append(field)
+    headers = [EXPORT_HEADER_MAP.get(field, field.replace('_', ' ').title()) for field in export_columns]
+    return export_columns, headers
+
+
+def format_form_value(col_name, item):
+    if item is None:
+        return ''
+    if col_name in RAW_FIELDS and item:
+        # Format JSON data for Excel readability
+        try:
+            return fast_json.dumps(fast_json.loads(item), indent=True)
+        except Exception:
+            return str(item)
+    return str(item)
+
+
+def _hh_mm(hh, mm):
+    return f"{hh}:{mm}" if hh and mm else ''
+
+
+def format_overtime_row(overtime_data):
+    """Flatten one exception_form_rows record into the OVERTIME_ROW_HEADERS layout."""
+    return [
+        overtime_data.get('id', ''),
+        overtime_data.get('code', ''),
+        # Code Description (REASON for overtime)
+        overtime_data.get('code_description', ''),
+        overtime_data.get('line_location', ''),
+        overtime_data.get('run_no', ''),
+        # Exception Time From / To - START and END TIME
+        _hh_mm(overtime_data.get('exception_time_from_hh', ''), overtime_data.get('exception_time_from_mm', '')),
+        _hh_mm(overtime_data.get('exception_time_to_hh', ''), overtime_data.get('exception_time_to_mm', '')),
+        # Overtime Hours (HH:MM) - DURATION
+        _hh_mm(overtime_data.get('overtime_hh', ''), overtime_data.get('overtime_mm', '')),
+        _hh_mm(overtime_data.get('bonus_hh', ''), overtime_data.get('bonus_mm', '')),
+        _hh_mm(overtime_data.get('nite_diff_hh', ''), overtime_data.get('nite_diff_mm', '')),
+        overtime_data.get('ta_job_no', '')
+    ]
+
+
+def open_export(conn, form_type=None, extraction_mode=None, typed=False):
+    """
+    Run the export query and return (export_columns, headers, rows).
+    rows is a generator of flat lists; it reads from conn lazily, so it must be
+    consumed while the connection is still open. With typed=True every row
+    ends with the TYPED_EXPORT_COLUMNS values.
+    """
+    query, params = build_export_query(form_type, extraction_mode)
+    form_cursor = conn.cursor()
+    form_cursor.execute(query, params)
+    columns = [desc[0] for desc in form_cursor.description]
+    export_columns, headers = select_export_columns(columns)
+
+    rows_query, rows_params = build_export_rows_query(form_type, extraction_mode)
+    row_cursor = conn.cursor()
+    row_cursor.execute(rows_query, rows_params)
+    overtime_columns = [desc[0] for desc in row_cursor.description]
+
+    rows = _iter_export_rows(form_cursor, columns, export_columns, row_cursor, overtime_columns, typed)
+    headers = headers + OVERTIME_ROW_HEADERS
+    if typed:
+        headers = headers + [header for header, _ in TYPED_EXPORT_COLUMNS]
+    return export_columns, headers, rows
+
+
+def iter_form_rows(form_cursor, columns, row_cursor, overtime_columns):
+    """
+    Merge-join two id-ordered cursors. Yields (form_data, overtime_rows) for
+    every form, where overtime_rows are the exception_form_rows of that form.
+    Raw JSON columns of forms that reference a stored response are rebuilt.
+    """
+    form_id_index = overtime_columns.index('form_id')
+    pending = row_cursor.fetchone()
+    payload_cache = {}
+    for form_row in form_cursor:
+        form_data = hydrate_raw_columns(form_cursor.connection, dict(zip(columns, form_row)), payload_cache)
+        form_id = form_data.get('id')
+        # Skip rows whose form sorts before this one (e.g. orphans); none are expected
+        while pending is not None and pending[form_id_index] < form_id:
+            pending = row_cursor.fetchone()
+        overtime_rows = []
+        while pending is not None and pending[form_id_index] == form_id:
+            overtime_rows.append(dict(zip(overtime_columns, pending)))
+            pending = row_cursor.fetchone()
+        yield form_data, overtime_rows
+
+
+def typed_form_values(form_data):
+    """Form-level typed values: overtime minutes, overtime date and reason flags."""
+    overtime_date = parse_form_date(form_data.get('date_of_overtime')) or parse_form_date(form_data.get('actual_ot_date'))
+    reasons = [parse_flag(form_data.get(field)) for field in REASON_FIELDS]
+    return parse_overtime_minutes(form_data.get('overtime_hours')), overtime_date, reasons
+
+
+def _iter_export_rows(form_cursor, columns, export_columns, row_cursor, overtime_columns, typed=False):
+    blank_form_cells = [''] * len(export_columns)
+    blank_overtime_cells = [''] * len(OVERTIME_ROW_HEADERS)
+    for form_data, overtime_rows in iter_form_rows(form_cursor, columns, row_cursor, overtime_columns):
+        form_cells = [format_form_value(col_name, form_data.get(col_name)) for col_name in export_columns]
+        if typed:
+            form_minutes, overtime_date, reasons = typed_form_values(form_data)
+
+        if not overtime_rows:
+            row = form_cells + blank_overtime_cells
+            if typed:
+                row += [form_minutes, None, overtime_date] + reasons
+            yield row
+            continue
+        # The first overtime row shares the line with its form; the rest follow underneath
+        for index, overtime_data in enumerate(overtime_rows):
+            row = (form_cells if index == 0 else blank_form_cells) + format_overtime_row(overtime_data)
+            if typed:
+                # Form minutes only on the form's own line so that column sums stay correct
+                row_minutes = parse_hh_mm_minutes(overtime_data.get('overtime_hh'), overtime_data.get('overtime_mm'))
+                row += [form_minutes if index == 0 else None, row_minutes, overtime_date] + reasons
+            yield row
+
+
+def _column_widths(export_columns, headers, sample_rows):
+    """Column widths from header text, width hints and a sample of leading rows."""
+    keys = export_columns + [None] * (len(headers) - len(export_columns))
+    widths = []
+    for index, (key, header) in enumerate(zip(keys, headers)):
+        if key in COLUMN_WIDTH_HINTS:
+            widths.append(COLUMN_WIDTH_HINTS[key])
+            continue
+        max_length = len(header)
+        for row in sample_rows:
+            value = row[index] if index < len(row) else ''
+            max_length = max(max_length, len(str(value)))
+        widths.append(min(max_length + 2, MAX_COLUMN_WIDTH))  # Cap at 50 characters
+    return widths
+
+
+def write_xlsx(fileobj, export_columns, headers, rows):
+    """Stream export rows into a write-only workbook saved to fileobj."""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, PatternFill, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Exception Forms")
+
+    # Column widths must be set before the first row is written
+    sample_rows = list(islice(rows, WIDTH_SAMPLE_ROWS))
+    for col_num, width in enumerate(_column_widths(export_columns, headers, sample_rows), 1):
+        ws.column_dimensions[get_column_letter(col_num)].width = width
+
+    # Style definitions
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
+
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for row in chain(sample_rows, rows):
+        ws.append(row)
+
+    wb.save(fileobj)
+
+
+def iter_csv(headers, rows, flush_rows=CSV_FLUSH_ROWS):
+    """Yield the export as CSV text, a few hundred rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    pending = 1
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= flush_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+
+def _to_int(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def write_parquet(fileobj, export_columns, headers, rows, batch_rows=PARQUET_BATCH_ROWS):
+    """
+    Write typed export rows (open_export(..., typed=True)) to a Parquet file in
+    record batches. Requires pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    typed_types = {header: getattr(pa, type_name)() for header, type_name in TYPED_EXPORT_COLUMNS}
+    fields = []
+    for header in headers:
+        if header in typed_types:
+            fields.append(pa.field(header, typed_types[header]))
+        elif header in INTEGER_HEADERS:
+            fields.append(pa.field(header, pa.int64()))
+        else:
+            fields.append(pa.field(header, pa.string()))
+    schema = pa.schema(fields)
+    integer_indexes = [index for index, header in enumerate(headers) if header in INTEGER_HEADERS]
+    string_indexes = [index for index, field in enumerate(fields) if field.type == pa.string()]
+
+    def to_batch(batch):
+        columns = [list(column) for column in zip(*batch)]
+        for index in integer_indexes:
+            columns[index] = [_to_int(value) for value in columns[index]]
+        for index in string_indexes:
+            columns[index] = [None if value is None else str(value) for value in columns[index]]
+        return pa.record_batch(columns, schema=schema)
+
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        while True:
+            batch = list(islice(rows, batch_rows))
+            if not batch:
+                break
+            writer.write_batch(to_batch(batch))
+
+
+def stream_file(path, chunk_size=EXPORT_CHUNK_SIZE, remove=False):
+    """Yield a file in chunks for a streamed Response, optionally deleting it afterwards."""
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,92 @@
+# === fast_json.py ===
+"""
+JSON facade used on the hot paths (Gemini parsing, dashboard stats, raw JSON
+columns, exports and Flask responses).
+
+Uses orjson when it is installed and the standard json module otherwise.
+Both backends produce equivalent JSON; orjson writes non-ASCII characters as
+UTF-8 instead of \\u escapes. Anything orjson cannot handle (NaN literals,
+integers beyond 64 bits, unusual types) falls back to the standard module,
+so callers see the same results and the same json.JSONDecodeError either way.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    DefaultJSONProvider = None
+
+JSONDecodeError = json.JSONDecodeError
+
+_ORJSON_BASE_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson else 0
+
+
+def loads(data):
+    """Parse JSON from str or UTF-8 bytes."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # Let the standard parser accept what it can (e.g. NaN) and raise its usual error
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode('utf-8')
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj, indent, sort_keys, default):
+    if indent:
+        return json.dumps(obj, indent=2, sort_keys=sort_keys, default=default)
+    return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys, default=default)
+
+
+def dumps_bytes(obj, indent=False, sort_keys=False, default=None) -> bytes:
+    """Serialize to UTF-8 bytes. Compact unless indent is set (always two spaces)."""
+    if orjson is not None:
+        option = _ORJSON_BASE_OPTIONS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if default is not None:
+            # Like json.dumps, let the caller's default decide how dates and dataclasses look
+            option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            pass  # orjson.JSONEncodeError; retry with the standard encoder
+    return _stdlib_dumps(obj, indent, sort_keys, default).encode('utf-8')
+
+
+def dumps(obj, indent=False, sort_keys=False, default=None) -> str:
+    """Serialize to a str. Compact (no whitespace) unless indent is set (always two spaces)."""
+    if orjson is not None:
+        return dumps_bytes(obj, indent=indent, sort_keys=sort_keys, default=default).decode('utf-8')
+    return _stdlib_dumps(obj, indent, sort_keys, default)
+
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        """Flask JSON provider that serializes responses with orjson when available."""
+
+        def dumps(self, obj, **kwargs):
+            if orjson is None or set(kwargs) - {'indent', 'separators'}:
+                return super().dumps(obj, **kwargs)
+            return dumps(obj, indent=bool(kwargs.get('indent')), sort_keys=self.sort_keys, default=self.default)
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return loads(s)
+
+        def response(self, *args, **kwargs):
+            if orjson is None:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            indent = (self.compact is None and self._app.debug) or self.compact is False
+            body = dumps_bytes(obj, indent=indent, sort_keys=self.sort_keys, default=self.default)
+            return self._app.response_class(body + b'\n', mimetype=self.mimetype)
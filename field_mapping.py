@@ -0,0 +1,632 @@
+# === field_mapping.py ===
+"""
+Mapping of Gemini output onto the exception_forms schema.
+
+The alias tables are compiled once at import into FieldAliasRegistry indexes,
+so each key is resolved with a couple of dict lookups instead of scanning
+every alias list:
+
+- PRIMARY_FIELD_ALIASES: the enhanced alias table. A key maps to the first
+  target (in table order) that lists it, raw or normalized.
+- EXACT_KEY_ALIASES: nested employee data and camelCase keys, used when the
+  enhanced table has no match.
+- LEGACY_FIELD_RULES: the older key_map, checkbox and special-case rules,
+  applied after an enhanced match (e.g. hourly "Report" fills both report_loc
+  and report). Rules can be overridden per form type.
+
+Keys none of these recognise are passed, once per entry, to KEY_CLASSIFIER
+(see key_classifier.py), which is trained on the same alias tables.
+"""
+from functools import lru_cache
+
+from key_classifier import KeyClassifier
+
+MAPPING_DEBUG = False  # Set to True to print every key mapping decision
+REPORT_UNMAPPED_KEYS = True  # Print Gemini keys no rule maps (turned off for bulk re-maps)
+CLASSIFY_UNMAPPED_KEYS = True  # Map keys no alias rule knows with the model.py classifier
+
+# Full slot list for supervisor overtime form and exception claim (hourly) form
+ALL_FIELDS = [
+    # Supervisor/Overtime fields
+    "reg_assignment", "reg", "pass_number", "title", "rc_number", "employee_name", "report_loc", "date", "rdos", "date_of_overtime",
+    "job_number", "overtime_location", "report_time", "relief_time", "overtime_hours",
+    "reason_rdo", "reason_absentee_coverage", "reason_no_lunch", "reason_early_report", "reason_late_clear", "reason_save_as_oto", "reason_capital_support_go", "reason_other",
+    "acct_number", "amount",
+    "superintendent_authorization_signature", "superintendent_authorization_pass", "superintendent_authorization_date", "entered_into_uts",
+    # Exception claim (hourly) fields
+    "regular_assignment", "report", "relief", "todays_date", "title", "employee_name", "rdos", "actual_ot_date", "div", "pass_number",
+    "exception_code", "line_location", "run_no", "exception_time_from_hh", "exception_time_from_mm", "exception_time_to_hh", "exception_time_to_mm",
+    "overtime_hh", "overtime_mm", "ta_job_no", "comments", "oto", "oto_amount_saved_hh", "oto_amount_saved_mm", "entered_in_uts_yes", "entered_in_uts_no", "supervisor_name", "supervisor_pass_no"
+]
+
+# Enhanced mapping for L Line forms - handle all Gemini field variations
+ENHANCED_FIELD_ALIASES = {
+    # Employee identification - multiple variations
+    'employee_name': ['employee_name', 'name', 'employee', 'employee name', 'EMPLOYEE NAME'],
+    'pass_number': ['pass_number', 'pass', 'PASS', 'assignment', 'reg', 'pass no', 'passnumber', 'pass number'],
+    'title': ['title', 'TITLE', 'position', 'job_title', 'role', 'job title', 'employee_title'],
+
+    # Job and location fields
+    'job_number': ['job_number', 'job', 'JOB #', 'job no', 'job_no', 'job#', 'job number', 'ta_job_no', 'ta job no'],
+    'rc_number': ['rc_number', 'rc', 'RC#', 'rc#', 'rc no', 'rc_no', 'rc number'],
+    'report_loc': ['report_loc', 'report location', 'REPORT LOC.', 'location', 'reportloc', 'report', 'loc'],
+    'overtime_location': ['overtime_location', 'overtime location', 'OVERTIME LOCATION', 'ot_location', 'otloc', 'ot location'],
+
+    # Time fields
+    'report_time': ['report_time', 'report time', 'REPORT TIME', 'report-time', 'report.time', 'reporttime'],
+    'relief_time': ['relief_time', 'relief time', 'RELIEF TIME', 'relief-time', 'relief.time', 'relieftime'],
+    'overtime_hours': ['overtime_hours', 'overtime hours', 'OVERTIME HOURS', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime'],
+
+    # Date fields
+    'date_of_overtime': ['date_of_overtime', 'date of overtime', 'date', 'DATE', 's_m', 'W/T', 'w_t'],
+    'rdos': ['rdos', 'rdo', 'S/M', 'rdo\'s', 'rduos', 'sm'],
+
+    # Account fields
+    'acct_number': ['acct_number', 'acct', 'ACCT #', 'acct#', 'acct no', 'acct_no', 'acct number', 'account_number', 'account number'],
+    'amount': ['amount'],
+
+    # Reason fields
+    'reason_rdo': ['reason_rdo', 'rdo', 'RDO'],
+    'reason_absentee_coverage': ['reason_absentee_coverage', 'absentee_coverage', 'absenteeCoverage', 'absentee coverage', 'Absentee Coverage'],
+    'reason_no_lunch': ['reason_no_lunch', 'no_lunch', 'noLunch', 'no lunch', 'NO LUNCH'],
+    'reason_early_report': ['reason_early_report', 'early_report', 'earlyReport', 'early report'],
+    'reason_late_clear': ['reason_late_clear', 'late_clear', 'lateClear', 'late clear'],
+    'reason_save_as_oto': ['reason_save_as_oto', 'save_as_oto', 'saveAsOto', 'save as oto'],
+    'reason_capital_support_go': ['reason_capital_support_go', 'capital_support_go', 'capitalSupportGo', 'capital support go'],
+    'reason_other': ['reason_other', 'other', 'OTHER', 'other_reason']
+}
+
+# Nested employee data and camelCase keys, used when no enhanced alias matches
+EXACT_KEY_ALIASES = {
+    "employee_pass_number": "pass_number",
+    "employee_pass": "pass_number",
+    "employee_name": "employee_name",
+    "employee_title": "title",
+    "employee_rdoe": "rdos",
+    "employee_rdo": "rdos",
+    "employee_rc_number": "rc_number",
+    "employee_rc": "rc_number",
+    "name": "employee_name",
+    "rduos": "rdos",
+    "rdo": "rdos",
+    "employeeName": "employee_name",
+    "passNumber": "pass_number",
+    "rDOs": "rdos",
+    "rcNumber": "rc_number",
+    "jobNumber": "job_number",
+    "overtimeLocation": "overtime_location",
+    "reportTime": "report_time",
+    "reliefTime": "relief_time",
+    "overtimeHours": "overtime_hours",
+    "accountNumber": "acct_number",
+    "reportLocation": "report_loc",
+}
+
+# Legacy key_map for backward compatibility. Looked up by normalized key, so only
+# normalized spellings are listed here.
+KEY_MAP = {
+    # Supervisor/Overtime fields (expanded variants for all possible Gemini outputs)
+    "reg": "reg",
+    "reg_assignment": "regular_assignment",
+    "assignment": "pass_number",
+    "pass": "pass_number",
+    "rc": "rc_number",
+    "employee_name": "employee_name",
+    "job": "job_number",
+    "overtime_location": "overtime_location",
+    "report_loc": "report_loc",
+    "report_time": "report_time",
+    "relief_time": "relief_time",
+    "overtime_hours": "overtime_hours",
+    "date": "todays_date",
+    "date_of_overtime": "date_of_overtime",
+    "rdos": "rdos",
+    "sm": "rdos",  # Handle S/M field
+    "reason_for_overtime": "reason_for_overtime",
+    "comments": "comments",
+    "acct": "acct_number",
+    "amount": "amount",
+    "supervisors_signature": "superintendent_authorization_signature",
+    "superintendent_authorization_signature": "superintendent_authorization_signature",
+    "superintendent_authorization_pass": "superintendent_authorization_pass",
+    "superintendent_authorization_date": "superintendent_authorization_date",
+    "entered_into_uts": "entered_into_uts",
+    # Exception claim (hourly) fields
+    "regular_assignment": "regular_assignment",
+    "report": "report",
+    "relief": "relief",
+    "todays_date": "todays_date",
+    "pass_number": "pass_number",
+    "title": "title",
+    "actual_ot_date": "actual_ot_date",
+    "div": "div",
+    "code": "exception_code",
+    "line_location": "line_location",
+    "run_no": "run_no",
+    "exception_time_from_hh": "exception_time_from_hh",
+    "exception_time_from_mm": "exception_time_from_mm",
+    "exception_time_to_hh": "exception_time_to_hh",
+    "exception_time_to_mm": "exception_time_to_mm",
+    "overtime_hh": "overtime_hh",
+    "overtime_mm": "overtime_mm",
+    "ta_job_no": "ta_job_no",
+    "oto": "oto",
+    "oto_amount_saved_hh": "oto_amount_saved_hh",
+    "oto_amount_saved_mm": "oto_amount_saved_mm",
+    "entered_in_uts_yes": "entered_in_uts_yes",
+    "entered_in_uts_no": "entered_in_uts_no",
+    "supv_name": "supervisor_name",
+    "supervisor_name": "supervisor_name",
+    "pass_no": "supervisor_pass_no",
+    "supervisor_pass_no": "supervisor_pass_no",
+    "job_": "job_number",
+    "rc_": "rc_number",
+    "acct_": "acct_number",
+    "superintendent_s_authorization___pass": "superintendent_authorization_pass",
+    "superintendent_s_authorization___date": "superintendent_authorization_date",
+    "superintendent_s_authorization___signature": "superintendent_authorization_signature",
+    # Robust time/location field variants
+    "reporttime": "report_time",
+    "relieftime": "relief_time",
+    "reportloc": "report_loc",
+    "overtimelocation": "overtime_location",
+}
+
+# Checkbox mapping
+CHECKBOX_MAP = {
+    "rdo": "reason_rdo",
+    "absentee_coverage": "reason_absentee_coverage",
+    "no_lunch": "reason_no_lunch",
+    "early_report": "reason_early_report",
+    "late_clear": "reason_late_clear",
+    "save_as_oto": "reason_save_as_oto",
+    "capital_support_go": "reason_capital_support_go",
+    "other": "reason_other"
+}
+
+# reasonForOvertime object keys -> reason checkbox
+REASON_OBJECT_KEYS = {
+    'rdo': 'reason_rdo',
+    'absenteeCoverage': 'reason_absentee_coverage',
+    'noLunch': 'reason_no_lunch',
+    'earlyReport': 'reason_early_report',
+    'lateClear': 'reason_late_clear',
+    'saveAsOto': 'reason_save_as_oto',
+    'capitalSupportGo': 'reason_capital_support_go',
+    'other': 'reason_other'
+}
+
+# --- PATCH: Ensure dashboard-relevant mapped fields are always set using flexible lookup from original Gemini data ---
+DASHBOARD_FIELD_FALLBACKS = {
+    'overtime_hours': [
+        'overtime_hours', 'overtime', 'hours', 'ot_hours', 'ot', 'total_overtime', 'overtime total', 'ot total', 'ot time', 'total ot', 'total_ot', 'ot time (hh:mm)', 'overtime (hh:mm)'
+    ],
+    'job_number': [
+        'job_number', 'job no', 'job_no', 'job', 'job#', 'job number', 'ta_job_no', 'ta job no', 'jobnum', 'jobnumber', 'job id', 'jobid'
+    ],
+    'title': [
+        'title', 'position', 'job_title', 'role', 'job title', 'employee_title', 'employee title'
+    ],
+    'report_loc': [
+        'report_loc', 'report location', 'location', 'reportloc', 'report', 'loc', 'report station', 'station', 'reporting location'
+    ],
+    'overtime_location': [
+        'overtime_location', 'overtime location', 'overtimelocation', 'ot_location', 'otloc', 'location', 'ot location', 'ot station', 'overtime station'
+    ]
+}
+
+PASS_NUMBER_KEYS = ['pass_number', 'pass', 'PASS', 'pass_no', 'pass no', 'passnumber', 'pass number']
+
+# For exception claim (hourly) forms, build a row if relevant fields are present
+ROW_FIELDS = [
+    "exception_code", "line_location", "run_no",
+    "exception_time_from_hh", "exception_time_from_mm",
+    "exception_time_to_hh", "exception_time_to_mm",
+    "overtime_hh", "overtime_mm",
+    "bonus_hh", "bonus_mm",
+    "nite_diff_hh", "nite_diff_mm",
+    "ta_job_no"
+]
+
+DEBUG_FIELDS = ['pass_number', 'employee_name', 'title', 'job_number', 'rc_number', 'overtime_hours', 'report_loc', 'overtime_location']
+
+# exception_forms columns filled from the mapped extraction
+COMBINED_MAPPED_FIELDS = [
+    'pass_number', 'title', 'employee_name', 'rdos', 'actual_ot_date', 'div', 'comments',
+    'supervisor_name', 'supervisor_pass_no', 'oto', 'oto_amount_saved', 'entered_in_uts',
+    'regular_assignment', 'report', 'relief', 'todays_date', 'reg',
+    'superintendent_authorization_signature', 'superintendent_authorization_pass',
+    'superintendent_authorization_date', 'entered_into_uts', 'overtime_hours', 'report_loc',
+    'overtime_location', 'report_time', 'relief_time', 'date_of_overtime', 'job_number',
+    'rc_number', 'acct_number', 'amount',
+    'reason_rdo', 'reason_absentee_coverage', 'reason_no_lunch', 'reason_early_report',
+    'reason_late_clear', 'reason_save_as_oto', 'reason_capital_support_go', 'reason_other'
+]
+
+
+@lru_cache(maxsize=8192)
+def normalize_key(k):
+    """Normalize a Gemini key for mapping (lowercase, separators to underscores)."""
+    # Handle special cases first
+    if k == "RC#":
+        return "rc"
+    if k == "REPORT LOC.":
+        return "report_loc"
+    if k == "S/M":
+        return "sm"
+
+    # General normalization
+    normalized = k.lower().replace(" ", "_").replace(".", "").replace("#", "").replace("/", "_").replace("'", "").replace("-", "_")
+    return normalized
+
+
+class AliasRule:
+    """What to do with a value whose key matched: an action applied to a target field."""
+    __slots__ = ('priority', 'target', 'action')
+
+    def __init__(self, priority, target, action=None):
+        self.priority = priority
+        self.target = target
+        self.action = action or _assign
+
+    def apply(self, form_data, key, value):
+        self.action(form_data, self.target, key, value)
+
+
+class FieldAliasRegistry:
+    """
+    O(1) alias index. Rules are registered against raw keys, normalized keys
+    or per-form-type normalized overrides; when several match, the rule with
+    the lowest priority wins, matching the first-match order of the source tables.
+    """
+
+    def __init__(self):
+        self._raw = {}
+        self._normalized = {}
+        self._overrides = {}
+
+    def add_raw(self, alias, rule):
+        """Match the key exactly as Gemini returned it."""
+        self._raw.setdefault(alias, rule)
+
+    def add_normalized(self, norm_alias, rule):
+        """Match the normalize_key() form of the key."""
+        self._normalized.setdefault(norm_alias, rule)
+
+    def add_override(self, form_type, norm_alias, rule):
+        """Match the normalized key for one form type only, ahead of add_normalized rules."""
+        self._overrides.setdefault(form_type, {}).setdefault(norm_alias, rule)
+
+    def lookup(self, key, norm_key=None, form_type=None):
+        if norm_key is None:
+            norm_key = normalize_key(key)
+        raw_rule = self._raw.get(key)
+        norm_rule = None
+        if form_type in self._overrides:
+            norm_rule = self._overrides[form_type].get(norm_key)
+        if norm_rule is None:
+            norm_rule = self._normalized.get(norm_key)
+        if raw_rule is None:
+            return norm_rule
+        if norm_rule is None or raw_rule.priority <= norm_rule.priority:
+            return raw_rule
+        return norm_rule
+
+    def resolve(self, key, form_type=None):
+        """Return the target field for a key, or None."""
+        rule = self.lookup(key, form_type=form_type)
+        return rule.target if rule else None
+
+
+def _assign(form_data, target, key, value):
+    form_data[target] = value
+
+
+def _assign_stripped(form_data, target, key, value):
+    if value and str(value).strip() and str(value).strip() != "None":
+        form_data[target] = str(value).strip()
+
+
+def _assign_bool(form_data, target, key, value):
+    form_data[target] = bool(value)
+
+
+def _ignore(form_data, target, key, value):
+    pass
+
+
+def _assign_reason_list(form_data, target, key, value):
+    # Handle reason_for_overtime as string or list
+    if isinstance(value, str):
+        value = [value]
+    for reason in value or []:
+        reason_norm = normalize_key(reason)
+        if reason_norm in CHECKBOX_MAP:
+            form_data[CHECKBOX_MAP[reason_norm]] = True
+
+
+def reason_field_for_text(reason):
+    """Map free-text overtime reason to the matching reason_* checkbox field."""
+    reason_lower = str(reason).lower()
+    if "rdo" in reason_lower:
+        return "reason_rdo"
+    elif "absentee" in reason_lower or "coverage" in reason_lower:
+        return "reason_absentee_coverage"
+    elif "lunch" in reason_lower:
+        return "reason_no_lunch"
+    elif "early" in reason_lower and "report" in reason_lower:
+        return "reason_early_report"
+    elif "late" in reason_lower and "clear" in reason_lower:
+        return "reason_late_clear"
+    elif "oto" in reason_lower:
+        return "reason_save_as_oto"
+    elif "capital" in reason_lower or "support" in reason_lower:
+        return "reason_capital_support_go"
+    return "reason_other"
+
+
+def _assign_reason_text(form_data, target, key, value):
+    # Handle reason field mapping for supervisor forms
+    form_data[reason_field_for_text(value)] = True
+
+
+def _assign_reason_object(form_data, target, key, value):
+    # Handle new reasonForOvertime object format
+    if isinstance(value, dict):
+        for object_key, field in REASON_OBJECT_KEYS.items():
+            if value.get(object_key):
+                form_data[field] = True
+
+
+def _assign_superintendent_authorization(form_data, target, key, value):
+    # Handle combined superintendent authorization field (e.g., "713026 07/06/25")
+    if isinstance(value, str) and ' ' in value:
+        parts = value.split(' ', 1)  # Split on first space
+        form_data["superintendent_authorization_pass"] = parts[0]
+        form_data["superintendent_authorization_date"] = parts[1]
+    else:
+        form_data["superintendent_authorization_pass"] = value
+
+
+def _build_primary_aliases():
+    registry = FieldAliasRegistry()
+    for priority, (target, variants) in enumerate(ENHANCED_FIELD_ALIASES.items()):
+        rule = AliasRule(priority, target)
+        for variant in variants:
+            registry.add_raw(variant, rule)
+            registry.add_normalized(normalize_key(variant), rule)
+    return registry
+
+
+def _build_legacy_rules():
+    registry = FieldAliasRegistry()
+    # Handle various date field formats
+    for alias in ["DATE", "date", "s_m", "W/T", "w_t"]:
+        registry.add_raw(alias, AliasRule(1, "date_of_overtime", _assign_stripped))
+    # Handle assignment/job number variations
+    for alias in ["ASSIGNMENT", "assignment"]:
+        registry.add_raw(alias, AliasRule(2, "pass_number", _assign_stripped))
+    for alias in ["RBG", "rbg"]:
+        registry.add_raw(alias, AliasRule(3, "job_number", _assign_stripped))
+    registry.add_normalized("reason_for_overtime", AliasRule(4, None, _assign_reason_list))
+    registry.add_normalized("reason", AliasRule(5, None, _assign_reason_text))
+    registry.add_raw("reasonForOvertime", AliasRule(6, None, _assign_reason_object))
+    # Custom logic for ambiguous keys
+    registry.add_normalized("pass", AliasRule(7, "pass_number"))
+    # A bare "date" is today's date on supervisor forms; do not map it for hourly forms
+    registry.add_normalized("date", AliasRule(8, None, _ignore))
+    registry.add_override('supervisor', "date", AliasRule(8, "todays_date"))
+    registry.add_normalized("job", AliasRule(9, "job_number"))
+    registry.add_normalized("rc", AliasRule(10, "rc_number"))
+    registry.add_normalized("rc_number", AliasRule(10, "rc_number"))
+    for alias in ["RC#", "rc#"]:
+        registry.add_raw(alias, AliasRule(11, "rc_number"))
+    for norm_alias, target in [
+        ("report_loc", "report_loc"), ("reg_assignment", "regular_assignment"),
+        ("overtime_location", "overtime_location"), ("report_time", "report_time"),
+        ("relief_time", "relief_time"), ("overtime_hours", "overtime_hours"),
+        ("rdos", "rdos"), ("sm", "rdos"), ("acct", "acct_number"),
+        ("account_number", "acct_number"), ("report_location", "report_loc")
+    ]:
+        registry.add_normalized(norm_alias, AliasRule(12, target))
+    registry.add_normalized("superintendents_authorization", AliasRule(13, None, _assign_superintendent_authorization))
+    for norm_alias, target in KEY_MAP.items():
+        registry.add_normalized(norm_alias, AliasRule(14, target))
+    for norm_alias, target in CHECKBOX_MAP.items():
+        registry.add_normalized(norm_alias, AliasRule(15, target, _assign_bool))
+    return registry
+
+
+PRIMARY_FIELD_ALIASES = _build_primary_aliases()
+LEGACY_FIELD_RULES = _build_legacy_rules()
+
+
+def resolve_field_alias(key, form_type=None):
+    """Return the schema field a Gemini key is stored under, or None if it is unknown."""
+    rule = PRIMARY_FIELD_ALIASES.lookup(key, form_type=form_type)
+    if rule is not None:
+        return rule.target
+    return EXACT_KEY_ALIASES.get(key)
+
+
+# Flexible field lookup for raw JSON
+
+@lru_cache(maxsize=8192)
+def _flexible_normalize(s):
+    return s.lower().replace(' ', '').replace('_', '').replace('-', '')
+
+
+@lru_cache(maxsize=1024)
+def _compile_flexible_keys(possible_keys):
+    return tuple(_flexible_normalize(key) for key in possible_keys)
+
+
+class FlexibleView(dict):
+    """A dict keyed by flexible-normalized keys, built once and reused for many lookups."""
+
+
+def flexible_view(data):
+    if isinstance(data, FlexibleView):
+        return data
+    return FlexibleView((_flexible_normalize(k), v) for k, v in data.items())
+
+
+def get_flexible_field(data, possible_keys):
+    """
+    Search for a value in a dict by a list of possible field names (case-insensitive, with normalization).
+    Handles flat dicts only. For nested dicts, extend as needed. Pass a flexible_view()
+    when looking up several fields in the same dict.
+    """
+    norm_data = flexible_view(data)
+    for norm_key in _compile_flexible_keys(tuple(possible_keys)):
+        if norm_key in norm_data:
+            return norm_data[norm_key]
+    return None
+
+
+def flatten_form_data(d, parent_key=""):
+    """Flatten nested dicts, mapping superintendent authorization sub-keys directly."""
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}_{k}" if parent_key else k
+        if isinstance(v, dict):
+            # Special handling for supervisor nested fields
+            if parent_key.lower().startswith("superintendent's_authorization") or k.lower().startswith("superintendent's_authorization"):
+                # Map nested keys directly to their backend fields
+                for subk, subv in v.items():
+                    subkey_norm = normalize_key(f"superintendent's_authorization_-_{subk}")
+                    items.append((subkey_norm, subv))
+            else:
+                items.extend(flatten_form_data(v, new_key).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+def apply_field_mapping(form_data, key, value, form_type=None):
+    """Map one flattened Gemini key/value into form_data. Returns False if nothing matched."""
+    norm_key = normalize_key(key)
+    primary = PRIMARY_FIELD_ALIASES.lookup(key, norm_key, form_type)
+    if primary is None:
+        # Nested employee data and camelCase keys
+        target = EXACT_KEY_ALIASES.get(key)
+        if target is None:
+            return False
+        form_data[target] = value
+        return True
+
+    primary.apply(form_data, key, value)
+    if MAPPING_DEBUG:
+        print(f"  Enhanced mapping: '{key}' -> '{primary.target}' = '{value}'")
+
+    # The legacy rules refine keys the enhanced mapping recognised (dates, reasons, checkboxes)
+    legacy = LEGACY_FIELD_RULES.lookup(key, norm_key, form_type)
+    if legacy is not None:
+        legacy.apply(form_data, key, value)
+    elif norm_key.startswith("reason_for_overtime_"):
+        # e.g. reason_for_overtime_rdo: True
+        reason = norm_key.replace("reason_for_overtime_", "")
+        if reason in CHECKBOX_MAP:
+            form_data[CHECKBOX_MAP[reason]] = bool(value)
+    return True
+
+
+def alias_training_data():
+    """Training corpus for KEY_CLASSIFIER: every alias spelling labelled with its schema field."""
+    fields = set(ALL_FIELDS) | set(COMBINED_MAPPED_FIELDS)
+    pairs = [(target, target) for target in fields]
+    pairs += [(alias, target) for target, aliases in ENHANCED_FIELD_ALIASES.items() for alias in aliases]
+    pairs += [(alias, target) for alias, target in EXACT_KEY_ALIASES.items()]
+    pairs += [(alias, target) for alias, target in KEY_MAP.items()]
+    # Reason checkboxes need their own handling, so the classifier never picks them
+    return [{"text": alias, "label": target} for alias, target in pairs
+            if target in fields and not target.startswith('reason_')]
+
+
+KEY_CLASSIFIER = KeyClassifier(alias_training_data)
+
+
+def classify_unmapped_keys(form_data, unmapped):
+    """Fill empty fields from keys the alias rules missed; mapped keys are removed from unmapped."""
+    candidates = [k for k, v in unmapped.items() if v not in (None, '') and not isinstance(v, (dict, list))]
+    if not candidates:
+        return
+    for key, (target, confidence) in KEY_CLASSIFIER.classify(candidates).items():
+        if form_data.get(target) in (None, '', False):
+            form_data[target] = unmapped.pop(key)
+            if MAPPING_DEBUG:
+                print(f"  Classified mapping: '{key}' -> '{target}' ({confidence:.2f})")
+
+
+def clean_form_values(form_data):
+    """Clean the form data to handle None values, lists and checkbox booleans."""
+    for key, value in form_data.items():
+        if value is None:
+            form_data[key] = ''
+        elif isinstance(value, list):
+            form_data[key] = ', '.join(str(item) for item in value if item is not None)
+        elif isinstance(value, bool):
+            form_data[key] = 1 if value else 0
+        elif key.startswith('reason_') and isinstance(value, str):
+            # Convert string boolean values to integers for reason fields
+            form_data[key] = 1 if value.lower() in ['true', '1', 'yes', 'on'] else 0
+        else:
+            form_data[key] = str(value) if value is not None else ''
+    return form_data
+
+
+def process_single_form(data, form_type=None):
+    """Map one Gemini form entry onto schema fields. Returns (form_data, rows)."""
+    form_data = {field: False if field.startswith('reason_') else '' for field in ALL_FIELDS}
+    flat_data = flatten_form_data(data)
+    if MAPPING_DEBUG:
+        print("FLATTENED GEMINI DATA:", flat_data)
+
+    unmapped = {}
+    for k, v in flat_data.items():
+        if not apply_field_mapping(form_data, k, v, form_type):
+            unmapped[k] = v
+    if unmapped and CLASSIFY_UNMAPPED_KEYS:
+        classify_unmapped_keys(form_data, unmapped)
+    if REPORT_UNMAPPED_KEYS:
+        for k, v in unmapped.items():
+            print(f"Unmapped Gemini key: {k} -> {v}")
+
+    clean_form_values(form_data)
+
+    raw_view = None
+    for field, variants in DASHBOARD_FIELD_FALLBACKS.items():
+        if not form_data.get(field):
+            if raw_view is None:
+                raw_view = flexible_view(data)
+            value = get_flexible_field(raw_view, variants)
+            if value:
+                form_data[field] = value
+
+    if MAPPING_DEBUG:
+        print("FINAL FORM DATA (mapped):", form_data)
+        for key in DEBUG_FIELDS:
+            if form_data.get(key):
+                print(f"  {key}: {form_data[key]}")
+
+    row = {field: form_data.get(field, '') for field in ROW_FIELDS}
+    # Add a row if ANY of the key fields are present (not just code/location/run_no)
+    if any(str(v).strip() for v in row.values()):
+        rows = [row]
+    else:
+        rows = []
+    return form_data, rows
+
+
+def combined_mapped_columns(mapped_form_data):
+    """The exception_forms column values a mapped extraction contributes to a stored form."""
+    return {field: mapped_form_data.get(field, False if field.startswith('reason_') else '') for field in COMBINED_MAPPED_FIELDS}
+
+
+def pure_extraction_rows(data):
+    """Rows of a pure extraction: the entry's own 'rows' or 'entries' list, if any."""
+    if 'rows' in data and isinstance(data['rows'], list):
+        return data['rows']
+    elif 'entries' in data and isinstance(data['entries'], list):
+        return data['entries']
+    return []
@@ -1,14 +1,20 @@
 import sqlite3
 import json
 from app import process_single_form
+from db import bump_data_version
+from raw_payloads import hydrate_raw_columns
 
 def migrate_mapped_fields(db_path='forms.db'):
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
-    c.execute('SELECT id, raw_gemini_json, form_type FROM exception_forms')
+    c.execute('SELECT id, raw_gemini_json, form_type, raw_payload_id, raw_entry_index FROM exception_forms')
+    columns = [desc[0] for desc in c.description]
     forms = c.fetchall()
     updated = 0
-    for form_id, raw_gemini_json, form_type in forms:
+    payload_cache = {}
+    for form_row in forms:
+        form = hydrate_raw_columns(conn, dict(zip(columns, form_row)), payload_cache)
+        form_id, raw_gemini_json, form_type = form['id'], form['raw_gemini_json'], form['form_type']
         if not raw_gemini_json:
             continue
         try:
@@ -25,6 +31,8 @@ def migrate_mapped_fields(db_path='forms.db'):
         c.execute(f'UPDATE exception_forms SET {set_clause} WHERE id = ?', values)
         updated += 1
         print(f"Updated form {form_id}: {updates}")
+    if updated:
+        bump_data_version(conn)
     conn.commit()
     conn.close()
     print(f"Migration complete. Updated {updated} forms.")
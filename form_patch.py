@@ -0,0 +1,212 @@
+# === form_patch.py ===
+"""
+Diff-based edits of a stored form.
+
+patch_form() compares the submitted header fields and rows with what is
+stored and writes only the difference: one UPDATE naming just the changed
+columns, per-row UPDATEs of the changed row fields, and inserts/deletes of
+whole rows by row id. The exact diff goes into the audit trail as the
+details of an 'edit' entry. PATCH /api/form/<id> passes the client's
+changes straight in; PUT /api/form/<id> sends the whole form with
+replace_rows=True, so rows missing from it are deleted.
+
+bulk_patch_forms() applies many such edits in one transaction with a single
+'bulk_edit' audit entry holding every form's diff (POST /api/forms/bulk-edit).
+"""
+import fast_json
+from column_codec import encode_text
+from db import FORM_ROW_FIELDS, bump_data_version, insert_form_rows, log_audit, refresh_fingerprint
+from form_values import FINGERPRINT_FIELDS, stored_text
+from raw_payloads import load_raw_columns
+from search_index import index_raw_text
+
+# Header columns a user may edit
+FORM_EDIT_FIELDS = [
+    'pass_number', 'title', 'employee_name', 'rdos', 'actual_ot_date', 'div', 'comments',
+    'supervisor_name', 'supervisor_pass_no', 'oto', 'oto_amount_saved', 'entered_in_uts',
+    'regular_assignment', 'report', 'relief', 'todays_date', 'status', 'reg',
+    'superintendent_authorization_signature', 'superintendent_authorization_pass',
+    'superintendent_authorization_date', 'entered_into_uts', 'overtime_hours', 'report_loc',
+    'overtime_location', 'report_time', 'relief_time', 'date_of_overtime', 'job_number',
+    'rc_number', 'acct_number', 'amount',
+    'reason_rdo', 'reason_absentee_coverage', 'reason_no_lunch', 'reason_early_report',
+    'reason_late_clear', 'reason_save_as_oto', 'reason_capital_support_go', 'reason_other'
+]
+# Checkbox columns; every other editable column defaults to ''
+FLAG_EDIT_FIELDS = [field for field in FORM_EDIT_FIELDS if field.startswith('reason_')]
+# Raw JSON a user may correct; the audit diff only names them, the JSON is too large to copy
+RAW_EDIT_FIELDS = ['raw_gemini_json', 'raw_extracted_data']
+
+# Largest number of forms one bulk edit may touch, to keep its transaction short
+MAX_BULK_FORMS = 1000
+BULK_EDIT_AUDIT_ACTION = 'bulk_edit'
+BULK_FILTERS = ['ids', 'form_type', 'status', 'username', 'extraction_mode', 'upload_date_from', 'upload_date_to']
+
+
+def full_form_fields(form):
+    """All editable fields of a full form submission, with the defaults PUT has always used."""
+    fields = {field: form.get(field, False if field in FLAG_EDIT_FIELDS else '') for field in FORM_EDIT_FIELDS}
+    fields.update({field: form[field] for field in RAW_EDIT_FIELDS if field in form})
+    return fields
+
+
+def _patch_header(conn, form_id, fields, diff):
+    header = [field for field in fields if field in FORM_EDIT_FIELDS]
+    columns = ['id'] + header
+    current = conn.execute(f"SELECT {', '.join(columns)} FROM exception_forms WHERE id = ?", (form_id,)).fetchone()
+    if current is None:
+        return False
+    changed = {}
+    for field, old in zip(header, current[1:]):
+        if stored_text(fields[field]) != stored_text(old):
+            changed[field] = fields[field]
+            diff.setdefault('fields', {})[field] = [old, fields[field]]
+    if changed:
+        set_clause = ', '.join(f'{field} = ?' for field in changed)
+        conn.execute(f'UPDATE exception_forms SET {set_clause} WHERE id = ?', list(changed.values()) + [form_id])
+        if any(field in changed for field in FINGERPRINT_FIELDS):
+            refresh_fingerprint(conn, form_id)
+
+    raw_fields = [field for field in RAW_EDIT_FIELDS if field in fields]
+    if raw_fields:
+        # The form echoes back the raw JSON it was loaded with, possibly from its raw payload
+        current_raw = load_raw_columns(conn, form_id)
+        for field in raw_fields:
+            if fields[field] != current_raw.get(field):
+                conn.execute(f'UPDATE exception_forms SET {field} = ? WHERE id = ?', (encode_text(fields[field]), form_id))
+                diff.setdefault('raw_fields', []).append(field)
+        if diff.get('raw_fields'):
+            index_raw_text(conn, form_id)
+    return True
+
+
+def _patch_rows(conn, form_id, rows, delete_row_ids, replace_rows, diff):
+    c = conn.execute(f"SELECT id, {', '.join(FORM_ROW_FIELDS)} FROM exception_form_rows WHERE form_id = ?", (form_id,))
+    current = {row[0]: dict(zip(FORM_ROW_FIELDS, row[1:])) for row in c.fetchall()}
+    deleted = set()
+    for row_id in delete_row_ids:
+        if row_id not in current:
+            raise ValueError(f"Row {row_id} does not belong to form {form_id}")
+        deleted.add(row_id)
+    submitted = set()
+    updated = {}
+    inserted = []
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"Row must be an object, got {type(row).__name__}")
+        row_id = row.get('id')
+        if row_id is None:
+            cursor = conn.cursor()
+            insert_form_rows(cursor, form_id, [row])
+            inserted.append(cursor.lastrowid)
+            continue
+        if row_id not in current:
+            raise ValueError(f"Row {row_id} does not belong to form {form_id}")
+        submitted.add(row_id)
+        changed = {field: row[field] for field in FORM_ROW_FIELDS
+                   if field in row and stored_text(row[field]) != stored_text(current[row_id][field])}
+        if changed and row_id not in deleted:
+            set_clause = ', '.join(f'{field} = ?' for field in changed)
+            conn.execute(f'UPDATE exception_form_rows SET {set_clause} WHERE id = ?', list(changed.values()) + [row_id])
+            updated[row_id] = {field: [current[row_id][field], value] for field, value in changed.items()}
+    if replace_rows:
+        deleted.update(row_id for row_id in current if row_id not in submitted)
+    if deleted:
+        conn.executemany('DELETE FROM exception_form_rows WHERE id = ?', [(row_id,) for row_id in deleted])
+
+    row_diff = {}
+    if updated:
+        row_diff['updated'] = updated
+    if inserted:
+        row_diff['inserted'] = inserted
+    if deleted:
+        # Keep what the deleted rows held, without their empty fields
+        row_diff['deleted'] = {row_id: {field: value for field, value in current[row_id].items() if value not in (None, '')}
+                               for row_id in sorted(deleted)}
+    if row_diff:
+        diff['rows'] = row_diff
+
+
+def patch_form(conn, form_id, fields=None, rows=None, delete_row_ids=None, replace_rows=False, username='unknown', audit=True):
+    """
+    Apply an edit to one form inside the caller's transaction (the caller commits).
+    fields maps editable columns to new values. rows are row dicts: with an 'id'
+    only the given fields that differ are updated, without one the row is
+    inserted. delete_row_ids are deleted; replace_rows=True also deletes every
+    row not submitted. audit=False leaves the audit entry to the caller.
+    Returns the diff ({} when nothing changed), or None if the form does not
+    exist. Raises ValueError for fields that cannot be edited and rows of
+    another form.
+    """
+    fields = fields or {}
+    unknown = [field for field in fields if field not in FORM_EDIT_FIELDS and field not in RAW_EDIT_FIELDS]
+    if unknown:
+        raise ValueError(f"Fields cannot be edited: {', '.join(sorted(unknown))}")
+    diff = {}
+    if not _patch_header(conn, form_id, fields, diff):
+        return None
+    if rows or delete_row_ids or replace_rows:
+        _patch_rows(conn, form_id, rows or [], delete_row_ids or [], replace_rows, diff)
+    if diff:
+        if audit:
+            log_audit(username, 'edit', 'form', form_id, fast_json.dumps(diff, default=str), conn=conn)
+        bump_data_version(conn)
+    return diff
+
+
+def select_form_ids(conn, filters):
+    """
+    Ids of the forms matching filters: {ids, form_type, status, username,
+    extraction_mode, upload_date_from, upload_date_to}. At least one filter is
+    required, so a bulk edit can never silently cover the whole table.
+    """
+    conditions = []
+    params = []
+    for name in filters:
+        if name not in BULK_FILTERS:
+            raise ValueError(f"Unknown filter: {name}")
+    if filters.get('ids'):
+        ids = [int(form_id) for form_id in filters['ids']]
+        conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+        params.extend(ids)
+    for name in ('form_type', 'status', 'username', 'extraction_mode'):
+        if filters.get(name):
+            conditions.append(f'{name} = ?')
+            params.append(filters[name])
+    if filters.get('upload_date_from'):
+        conditions.append('upload_date >= ?')
+        params.append(filters['upload_date_from'])
+    if filters.get('upload_date_to'):
+        conditions.append('upload_date < ?')
+        params.append(filters['upload_date_to'])
+    if not conditions:
+        raise ValueError('A bulk edit needs at least one filter')
+    return [row[0] for row in conn.execute(f"SELECT id FROM exception_forms WHERE {' AND '.join(conditions)} ORDER BY id", params)]
+
+
+def bulk_patch_forms(conn, patches, username='unknown'):
+    """
+    Apply a list of edits, each {id, form, rows, delete_rows}, inside the caller's
+    transaction with one aggregated 'bulk_edit' audit entry. Returns {form_id: diff}
+    of the forms that changed. Raises ValueError (naming the form) if any edit is
+    invalid or its form does not exist; the caller rolls back.
+    """
+    if len(patches) > MAX_BULK_FORMS:
+        raise ValueError(f"A bulk edit may change at most {MAX_BULK_FORMS} forms, got {len(patches)}")
+    changes = {}
+    for patch in patches:
+        if not isinstance(patch, dict) or patch.get('id') is None:
+            raise ValueError('Every edit needs the id of its form')
+        form_id = int(patch['id'])
+        try:
+            diff = patch_form(conn, form_id, fields=patch.get('form') or {}, rows=patch.get('rows') or [],
+                              delete_row_ids=patch.get('delete_rows') or [], username=username, audit=False)
+        except ValueError as e:
+            raise ValueError(f"Form {form_id}: {e}")
+        if diff is None:
+            raise ValueError(f"Form {form_id} not found")
+        if diff:
+            changes[form_id] = diff
+    if changes:
+        log_audit(username, BULK_EDIT_AUDIT_ACTION, 'forms', None, fast_json.dumps({'forms': changes}, default=str), conn=conn)
+    return changes
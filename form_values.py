@@ -0,0 +1,122 @@
+# === form_values.py ===
+"""
+Parsers for the free-text values Gemini returns for overtime forms
+(overtime durations, dates and checkbox flags), and the natural-key
+fingerprint used to detect duplicate forms.
+"""
+import datetime
+import hashlib
+import re
+
+DATE_FORMATS = ['%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d', '%m-%d-%Y', '%m-%d-%y', '%m.%d.%Y', '%m.%d.%y']
+
+TRUE_STRINGS = ['true', '1', 'yes', 'on', 'x']
+
+# Natural key of an overtime slip: the same person, date, hours and job is the same slip
+FINGERPRINT_FIELDS = ['pass_number', 'date_of_overtime', 'overtime_hours', 'job_number']
+# Placeholders the upload code writes for missing values
+EMPTY_STRINGS = ['', 'N/A', 'NA', 'NONE', 'NULL']
+
+_NON_ALNUM = re.compile(r'[^0-9A-Za-z]+')
+
+
+def parse_overtime_minutes(value):
+    """
+    Convert an overtime duration such as '2:30', '1:00 + 0:45' or '3' (hours)
+    to minutes. Returns None for empty or unparseable values.
+    """
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text or text == 'N/A':
+        return None
+    total_minutes = 0
+    try:
+        for part in text.split('+'):
+            part = part.strip()
+            if ':' in part:
+                hours, minutes = part.split(':')
+                total_minutes += int(hours) * 60 + int(minutes)
+            else:
+                total_minutes += int(part) * 60
+    except ValueError:
+        return None
+    return total_minutes
+
+
+def parse_hh_mm_minutes(hh, mm):
+    """Combine separate HH and MM fields into minutes. Returns None if both are empty."""
+    if not str(hh or '').strip() and not str(mm or '').strip():
+        return None
+    try:
+        return int(hh or 0) * 60 + int(mm or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_form_date(value):
+    """Parse the handwritten date formats seen on forms into a date, or None."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    # ISO timestamps such as upload_date
+    if 'T' in text and len(text) >= 10:
+        text = text[:10]
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_flag(value):
+    """Interpret a checkbox value stored as 0/1, a boolean or text."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if value is None:
+        return False
+    return str(value).strip().lower() in TRUE_STRINGS
+
+
+def stored_text(value):
+    """Normalize a column value the way SQLite hands it back, for change detection."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def normalize_identifier(value):
+    """Uppercase alphanumerics only, so 'j-123 ' and 'J123' compare equal. Placeholders become ''."""
+    if value is None:
+        return ''
+    text = _NON_ALNUM.sub('', str(value)).upper()
+    return '' if text in EMPTY_STRINGS else text
+
+
+def form_fingerprint(form_data, form_type=None):
+    """
+    Fingerprint of a form's natural key (FINGERPRINT_FIELDS plus form type).
+    Dates and overtime durations are parsed first, so '7/4/24' and '07/04/2024' or
+    '2:00' and '2' match. Returns None when pass number, date or hours is missing;
+    such forms are never treated as duplicates.
+    """
+    pass_number = normalize_identifier(form_data.get('pass_number'))
+    date_value = form_data.get('date_of_overtime')
+    parsed_date = parse_form_date(date_value)
+    date_key = parsed_date.isoformat() if parsed_date else normalize_identifier(date_value)
+    hours_value = form_data.get('overtime_hours')
+    minutes = parse_overtime_minutes(hours_value)
+    hours_key = f"{minutes}m" if minutes is not None else normalize_identifier(hours_value)
+    if not pass_number or not date_key or not hours_key:
+        return None
+    job_key = normalize_identifier(form_data.get('job_number'))
+    form_type = form_type or form_data.get('form_type') or ''
+    key = '|'.join([form_type, pass_number, date_key, hours_key, job_key])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useCallback, useEffect, useState } from 'react';
 
 interface AuditLog {
   id: string;
@@ -9,18 +9,45 @@ interface AuditLog {
   details?: string;
 }
 
+interface AuditFilters {
+  user: string;
+  action: string;
+  target: string;
+  since: string;
+  until: string;
+}
+
+const PAGE_SIZE = 100;
+const EMPTY_FILTERS: AuditFilters = { user: '', action: '', target: '', since: '', until: '' };
+
 const AuditTrail: React.FC = () => {
   const [logs, setLogs] = useState<AuditLog[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [filters, setFilters] = useState<AuditFilters>(EMPTY_FILTERS);
+  const [appliedFilters, setAppliedFilters] = useState<AuditFilters>(EMPTY_FILTERS);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
+  const fetchPage = useCallback(async (activeFilters: AuditFilters, cursor: string | null) => {
+    const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+    (Object.keys(activeFilters) as (keyof AuditFilters)[]).forEach(key => {
+      if (activeFilters[key]) params.set(key, activeFilters[key]);
+    });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`http://localhost:8000/api/audit-trail?${params.toString()}`);
+    if (!response.ok) throw new Error('Failed to fetch audit logs');
+    return response.json();
+  }, []);
+
   useEffect(() => {
     const fetchAuditLogs = async () => {
+      setLoading(true);
+      setError(null);
       try {
-        const response = await fetch('http://localhost:8000/api/audit-trail');
-        if (!response.ok) throw new Error('Failed to fetch audit logs');
-        const data = await response.json();
+        const data = await fetchPage(appliedFilters, null);
         setLogs(data.logs || []);
+        setNextCursor(data.next_cursor || null);
       } catch (err: any) {
         setError(err.message || 'Unknown error');
       } finally {
@@ -28,42 +55,94 @@ const AuditTrail: React.FC = () => {
       }
     };
     fetchAuditLogs();
-  }, []);
+  }, [appliedFilters, fetchPage]);
+
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetchPage(appliedFilters, nextCursor);
+      setLogs(prev => [...prev, ...(data.logs || [])]);
+      setNextCursor(data.next_cursor || null);
+    } catch (err: any) {
+      setError(err.message || 'Unknown error');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  const handleFilterChange = (e: React.ChangeEvent<HTMLInputElement>) => {
+    setFilters(prev => ({ ...prev, [e.target.name]: e.target.value }));
+  };
+
+  const applyFilters = (e: React.FormEvent) => {
+    e.preventDefault();
+    setAppliedFilters(filters);
+  };
+
+  const clearFilters = () => {
+    setFilters(EMPTY_FILTERS);
+    setAppliedFilters(EMPTY_FILTERS);
+  };
 
   return (
     <div className="max-w-4xl mx-auto mt-10 bg-white p-8 rounded shadow">
       <h2 className="text-2xl font-bold mb-6">Audit Trail</h2>
+      <form onSubmit={applyFilters} className="flex flex-wrap gap-2 mb-6 items-end">
+        <input name="user" value={filters.user} onChange={handleFilterChange} placeholder="User" className="border rounded px-2 py-1" />
+        <input name="action" value={filters.action} onChange={handleFilterChange} placeholder="Action" className="border rounded px-2 py-1" />
+        <input name="target" value={filters.target} onChange={handleFilterChange} placeholder="Target (e.g. form:12)" className="border rounded px-2 py-1" />
+        <label className="text-sm text-gray-600">
+          From
+          <input type="date" name="since" value={filters.since} onChange={handleFilterChange} className="border rounded px-2 py-1 ml-1" />
+        </label>
+        <label className="text-sm text-gray-600">
+          Before
+          <input type="date" name="until" value={filters.until} onChange={handleFilterChange} className="border rounded px-2 py-1 ml-1" />
+        </label>
+        <button type="submit" className="bg-blue-600 text-white px-3 py-1 rounded">Filter</button>
+        <button type="button" onClick={clearFilters} className="border px-3 py-1 rounded">Clear</button>
+      </form>
       {loading && <div>Loading audit logs...</div>}
       {error && <div className="text-red-600">{error}</div>}
       {!loading && !error && logs.length === 0 && (
         <div className="text-gray-500">No audit logs found.</div>
       )}
       {!loading && !error && logs.length > 0 && (
-        <table className="w-full table-auto border-collapse">
-          <thead>
-            <tr className="bg-gray-100">
-              <th className="px-4 py-2 text-left">User</th>
-              <th className="px-4 py-2 text-left">Action</th>
-              <th className="px-4 py-2 text-left">Target</th>
-              <th className="px-4 py-2 text-left">Timestamp</th>
-              <th className="px-4 py-2 text-left">Details</th>
-            </tr>
-          </thead>
-          <tbody>
-            {logs.map(log => (
-              <tr key={log.id} className="border-b hover:bg-gray-50">
-                <td className="px-4 py-2">{log.user}</td>
-                <td className="px-4 py-2">{log.action}</td>
-                <td className="px-4 py-2">{log.target}</td>
-                <td className="px-4 py-2">{new Date(log.timestamp).toLocaleString()}</td>
-                <td className="px-4 py-2">{log.details || '-'}</td>
+        <>
+          <table className="w-full table-auto border-collapse">
+            <thead>
+              <tr className="bg-gray-100">
+                <th className="px-4 py-2 text-left">User</th>
+                <th className="px-4 py-2 text-left">Action</th>
+                <th className="px-4 py-2 text-left">Target</th>
+                <th className="px-4 py-2 text-left">Timestamp</th>
+                <th className="px-4 py-2 text-left">Details</th>
               </tr>
-            ))}
-          </tbody>
-        </table>
+            </thead>
+            <tbody>
+              {logs.map(log => (
+                <tr key={log.id} className="border-b hover:bg-gray-50">
+                  <td className="px-4 py-2">{log.user}</td>
+                  <td className="px-4 py-2">{log.action}</td>
+                  <td className="px-4 py-2">{log.target}</td>
+                  <td className="px-4 py-2">{new Date(log.timestamp).toLocaleString()}</td>
+                  <td className="px-4 py-2">{log.details || '-'}</td>
+                </tr>
+              ))}
+            </tbody>
+          </table>
+          {nextCursor && (
+            <div className="mt-4 text-center">
+              <button onClick={loadMore} disabled={loadingMore} className="border px-4 py-2 rounded hover:bg-gray-50 disabled:opacity-50">
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </button>
+            </div>
+          )}
+        </>
       )}
     </div>
   );
 };
 
-export default AuditTrail; 
\ No newline at end of file
+export default AuditTrail;
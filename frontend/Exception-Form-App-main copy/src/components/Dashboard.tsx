@@ -169,12 +169,15 @@ const Dashboard: React.FC<DashboardProps> = ({ filterType, heading }) => {
 
 
 
+  // Only the pure extraction view shows the raw JSON; the mapped view skips downloading it
+  const formDetailsQuery = () => `extraction_mode=${extractionMode}${extractionMode === 'pure' ? '' : '&include_raw=0'}`;
+
   const handleViewDetails = async (formId: number) => {
     setDetailsLoading(true);
     setDetailsError('');
     setSelectedFormDetails(null);
     try {
-      const response = await fetch(`http://localhost:8000/api/form/${formId}?extraction_mode=${extractionMode}`);
+      const response = await fetch(`http://localhost:8000/api/form/${formId}?${formDetailsQuery()}`);
       const data = await response.json();
       if (response.ok) {
         setSelectedFormDetails(data);
@@ -233,15 +236,31 @@ const Dashboard: React.FC<DashboardProps> = ({ filterType, heading }) => {
     setSaveLoading(true);
     setSaveError('');
     try {
+      // Send only what changed; the backend writes and audits just that diff
+      const original = selectedFormDetails.form;
+      const changedFields: Record<string, any> = {};
+      Object.keys(editForm).forEach(key => {
+        if (editForm[key] !== original[key]) changedFields[key] = editForm[key];
+      });
+      const changedRows = editRows
+        .map((row: any, idx: number) => {
+          const originalRow = selectedFormDetails.rows[idx] || {};
+          const changes: Record<string, any> = {};
+          Object.keys(row).forEach(key => {
+            if (row[key] !== originalRow[key]) changes[key] = row[key];
+          });
+          return Object.keys(changes).length > 0 ? { ...changes, id: row.id } : null;
+        })
+        .filter((row: any) => row !== null);
       const response = await fetch(`http://localhost:8000/api/form/${editForm.id}`, {
-        method: 'PUT',
+        method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ form: editForm, rows: editRows }),
+        body: JSON.stringify({ form: changedFields, rows: changedRows }),
       });
       const data = await response.json();
       if (response.ok) {
         // Re-fetch the latest form details from the backend
-        const detailsRes = await fetch(`http://localhost:8000/api/form/${editForm.id}?extraction_mode=${extractionMode}`);
+        const detailsRes = await fetch(`http://localhost:8000/api/form/${editForm.id}?${formDetailsQuery()}`);
         const detailsData = await detailsRes.json();
         setSelectedFormDetails(detailsData);
         setShowEditModal(false);
@@ -296,16 +315,10 @@ const Dashboard: React.FC<DashboardProps> = ({ filterType, heading }) => {
       
       // For pure extraction mode, save to raw_extracted_data; for mapped mode, save to raw_gemini_json
       const rawDataField = extractionMode === 'pure' ? 'raw_extracted_data' : 'raw_gemini_json';
-      const updateData = { ...selectedFormDetails.form };
-      updateData[rawDataField] = rawJsonEdit;
-      
       const response = await fetch(`http://localhost:8000/api/form/${selectedFormDetails?.form?.id}?extraction_mode=${extractionMode}`, {
-        method: 'PUT',
+        method: 'PATCH',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ 
-          form: updateData,
-          rows: selectedFormDetails.rows 
-        }),
+        body: JSON.stringify({ form: { [rawDataField]: rawJsonEdit } }),
       });
       
       const data = await response.json();
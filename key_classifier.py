@@ -0,0 +1,78 @@
+# === key_classifier.py ===
+"""
+Fallback mapping of unknown Gemini keys with the model.py classifier.
+
+Keys that no alias rule in field_mapping recognises used to be dropped.
+KeyClassifier trains the model.py pipeline on the alias tables themselves
+(every alias spelling labelled with its schema field) and maps unknown keys
+whose predicted field clears a confidence threshold. Decisions are cached
+per key string, so each distinct key is classified once per process, and
+all uncached keys of an entry go through a single predict call.
+
+scikit-learn is optional here: without it the fallback is disabled and
+unknown keys are reported as before.
+"""
+import re
+import threading
+
+from model import load_or_train_model, predict_fields_with_confidence
+
+KEY_CLASSIFIER_PREFIX = 'key_classifier'
+KEY_CONFIDENCE_THRESHOLD = 0.4  # Probabilities are spread over ~60 fields; 0.4 keeps only clear matches
+KEY_CACHE_SIZE = 4096
+
+_CAMEL_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+_NON_ALNUM = re.compile(r'[^A-Za-z0-9]+')
+
+
+def key_to_text(key):
+    """Turn a Gemini key into space-separated words: 'otLocation_no.' -> 'ot location no'."""
+    return _NON_ALNUM.sub(' ', _CAMEL_BOUNDARY.sub(' ', str(key))).strip().lower()
+
+
+class KeyClassifier:
+    """
+    Classifies unknown keys into schema fields. training_data_factory returns
+    model.py-style [{"text", "label"}] items and is only called when the
+    classifier is first needed.
+    """
+
+    def __init__(self, training_data_factory, threshold=KEY_CONFIDENCE_THRESHOLD):
+        self.training_data_factory = training_data_factory
+        self.threshold = threshold
+        self._model = None
+        self._disabled = False
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None and not self._disabled:
+                try:
+                    training_data = [{'text': key_to_text(item['text']), 'label': item['label']}
+                                     for item in self.training_data_factory()]
+                    self._model = load_or_train_model(training_data, prefix=KEY_CLASSIFIER_PREFIX)
+                except ImportError as e:
+                    print(f"Key classifier disabled, scikit-learn is not available: {e}")
+                    self._disabled = True
+            return self._model
+
+    def classify(self, keys):
+        """Return {key: (field, confidence)} for the keys that clear the threshold."""
+        unknown = [key for key in dict.fromkeys(keys) if key not in self._cache]
+        if unknown:
+            model = self._get_model()
+            if model is None:
+                return {}
+            texts = [key_to_text(key) for key in unknown]
+            predictions = predict_fields_with_confidence(model, texts)
+            if len(self._cache) + len(unknown) > KEY_CACHE_SIZE:
+                self._cache.clear()
+            for key, text, (field, confidence) in zip(unknown, texts, predictions):
+                self._cache[key] = (field, confidence) if text and confidence >= self.threshold else None
+        decisions = {}
+        for key in keys:
+            decision = self._cache.get(key)
+            if decision is not None:
+                decisions[key] = decision
+        return decisions
@@ -0,0 +1,55 @@
+import sqlite3
+import fast_json
+from db import init_exception_form_db
+from raw_payloads import RAW_COLUMNS, compact_json, store_raw_payload
+from column_codec import decode_columns
+
+BATCH_SIZE = 200
+
+def _parse(text):
+    try:
+        return fast_json.loads(text)
+    except (TypeError, ValueError):
+        return None
+
+def migrate_raw_payloads(db_path='forms.db', batch_size=BATCH_SIZE):
+    """
+    Move the raw JSON of forms stored before raw_payloads existed into the
+    payload table. A form's raw_extracted_data (or the first non-empty raw
+    column) becomes its payload, and every raw column holding the same JSON
+    is set to NULL so it is rebuilt from the payload on read. Columns with
+    different content (e.g. a user-edited raw_gemini_json) are kept.
+    """
+    init_exception_form_db(db_path)
+    conn = sqlite3.connect(db_path, timeout=10)
+    c = conn.cursor()
+    last_id = 0
+    migrated = 0
+    cleared = 0
+    while True:
+        c.execute(f"SELECT id, {', '.join(RAW_COLUMNS)} FROM exception_forms WHERE id > ? AND raw_payload_id IS NULL ORDER BY id LIMIT ?",
+                  (last_id, batch_size))
+        batch = c.fetchall()
+        if not batch:
+            break
+        for row in batch:
+            form_id = row[0]
+            last_id = form_id
+            raw_values = decode_columns(dict(zip(RAW_COLUMNS, row[1:])), RAW_COLUMNS)
+            source = raw_values['raw_extracted_data'] or next((value for value in raw_values.values() if value), None)
+            payload = _parse(source)
+            if payload is None:
+                continue
+            payload_id = store_raw_payload(conn, compact_json(payload))
+            redundant = [column for column, value in raw_values.items() if value and _parse(value) == payload]
+            assignments = ', '.join(['raw_payload_id = ?', 'raw_entry_index = NULL'] + [f'{column} = NULL' for column in redundant])
+            conn.execute(f'UPDATE exception_forms SET {assignments} WHERE id = ?', (payload_id, form_id))
+            migrated += 1
+            cleared += len(redundant)
+        conn.commit()
+        print(f"Migrated forms up to id {last_id} ({migrated} so far)")
+    conn.close()
+    print(f"Migration complete. {migrated} forms now reference a raw payload; {cleared} raw columns cleared.")
+
+if __name__ == '__main__':
+    migrate_raw_payloads()
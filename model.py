@@ -1,7 +1,20 @@
 # === model.py ===
-from sklearn.pipeline import make_pipeline
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.naive_bayes import MultinomialNB
+import glob
+import hashlib
+import json
+import os
+import threading
+
+# scikit-learn/joblib are imported on first use so importing this module stays cheap
+_model = None
+_model_lock = threading.Lock()
+
+# Trained pipelines are cached here as field_classifier-<key>.joblib, where the key
+# hashes the training data, MODEL_VERSION and the scikit-learn version
+MODEL_DIR = 'models'
+MODEL_ARTIFACT_PREFIX = 'field_classifier'
+# Bump when the pipeline itself (vectorizer/classifier settings) changes
+MODEL_VERSION = 1
 
 # Expanded training data for Exception Claim Form fields
 TRAINING_DATA = [
@@ -55,13 +68,85 @@ TRAINING_DATA = [
     # Add more as needed for your forms
 ]
 
-def train_model():
-    texts = [item["text"] for item in TRAINING_DATA]
-    labels = [item["label"] for item in TRAINING_DATA]
+def train_model(training_data=None):
+    from sklearn.pipeline import make_pipeline
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    training_data = TRAINING_DATA if training_data is None else training_data
+    texts = [item["text"] for item in training_data]
+    labels = [item["label"] for item in training_data]
     model = make_pipeline(CountVectorizer(), MultinomialNB())
     model.fit(texts, labels)
     return model
 
+def training_data_key(training_data=None):
+    """Short hash identifying a trained pipeline: training data, MODEL_VERSION and scikit-learn version."""
+    import sklearn
+    training_data = TRAINING_DATA if training_data is None else training_data
+    digest = hashlib.sha256()
+    digest.update(json.dumps(training_data, sort_keys=True).encode('utf-8'))
+    digest.update(f"{MODEL_VERSION}:{sklearn.__version__}".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def model_artifact_path(training_data=None, model_dir=None, prefix=MODEL_ARTIFACT_PREFIX):
+    return os.path.join(model_dir or MODEL_DIR, f"{prefix}-{training_data_key(training_data)}.joblib")
+
+def load_or_train_model(training_data=None, model_dir=None, prefix=MODEL_ARTIFACT_PREFIX):
+    """
+    Load the pipeline for this training data from its artifact (memory-mapped),
+    or train it and write the artifact. Older artifacts with the same prefix are removed.
+    """
+    import joblib
+    path = model_artifact_path(training_data, model_dir, prefix)
+    if os.path.exists(path):
+        try:
+            return joblib.load(path, mmap_mode='r')
+        except Exception as e:
+            print(f"Could not load field classifier from {path}, retraining: {e}")
+    model = train_model(training_data)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, path)  # Atomic, so concurrent workers never read a partial file
+        for stale_path in glob.glob(os.path.join(os.path.dirname(path), f"{prefix}-*.joblib")):
+            if stale_path != path:
+                os.remove(stale_path)
+    except OSError as e:
+        print(f"Could not save field classifier to {path}: {e}")
+    return model
+
+def get_model():
+    """Return the field classifier, loading or training it on first use."""
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = load_or_train_model()
+        return _model
+
 def predict_field(model, text_line):
     """Predict the field label for a given text line."""
-    return model.predict([text_line])[0]
\ No newline at end of file
+    return model.predict([text_line])[0]
+
+def predict_fields(model, text_lines):
+    """Predict field labels for many text lines with one vectorized predict call."""
+    text_lines = list(text_lines)
+    if not text_lines:
+        return []
+    return [str(label) for label in model.predict(text_lines)]
+
+def predict_fields_with_confidence(model, text_lines):
+    """
+    Like predict_fields(), but returns (label, probability) pairs. Lines with no
+    word the model has seen get probability 0.0, since their prediction is only the class prior.
+    """
+    text_lines = list(text_lines)
+    if not text_lines:
+        return []
+    known_words = model.steps[0][1].transform(text_lines).getnnz(axis=1)
+    probabilities = model.predict_proba(text_lines)
+    best = probabilities.argmax(axis=1)
+    return [
+        (str(model.classes_[index]), float(probabilities[row, index]) if known_words[row] else 0.0)
+        for row, index in enumerate(best)
+    ]
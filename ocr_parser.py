@@ -0,0 +1,143 @@
+# === ocr_parser.py ===
+"""
+Local, single-pass parser for OCR'd exception claim forms.
+
+iter_exception_form() reads OCR lines one at a time (a list, a file, or
+iter_tsv_lines() over Tesseract TSV output) and yields header fields and
+table rows as soon as they are recognised, so a caller can start working
+before the whole page is read. parse_exception_form() collects the events
+into (form_data, rows) for the upload code.
+"""
+import re
+
+from exception_codes import exception_codes
+
+# Header labels in priority order: the first label found on a line wins
+HEADER_LABELS = [
+    ('Pass Number', 'pass_number'),
+    ('Title', 'title'),
+    ('Employee Name', 'employee_name'),
+]
+_HEADER_HINT = re.compile('|'.join(re.escape(label) for label, _ in HEADER_LABELS))
+
+# A table starts at the first line whose first token begins with a 2-4 digit code
+_TABLE_CODE = re.compile(r'\d{2,4}')
+MIN_ROW_TOKENS = 10
+
+ROW_COLUMNS = [
+    'line_location', 'run_no',
+    'exception_time_from_hh', 'exception_time_from_mm',
+    'exception_time_to_hh', 'exception_time_to_mm',
+    'overtime_hh', 'overtime_mm',
+    'bonus_hh', 'bonus_mm',
+    'nite_diff_hh', 'nite_diff_mm',
+    'ta_job_no'
+]
+
+HEADER_FIELDS = [
+    'pass_number', 'title', 'employee_name', 'rdos', 'actual_ot_date', 'div', 'comments',
+    'supervisor_name', 'supervisor_pass_no', 'oto', 'oto_amount_saved', 'entered_in_uts'
+]
+
+# Tesseract TSV columns that identify one text line
+TSV_LINE_KEY = ('page_num', 'block_num', 'par_num', 'line_num')
+
+
+def _header_value(label, line):
+    if label == 'Employee Name':
+        return line.split(":")[-1].strip()
+    parts = line.split()
+    return parts[-1] if parts else ''
+
+
+def parse_table_row(parts):
+    """Build a row dict from the tokens of a table line (code first, then ROW_COLUMNS in order)."""
+    code = parts[0]
+    row = {'code': code, 'code_description': exception_codes.get(code, "")}
+    for index, column in enumerate(ROW_COLUMNS, start=1):
+        row[column] = parts[index] if index < len(parts) else ''
+    return row
+
+
+def iter_exception_form(lines):
+    """
+    Yield ('header', field, value) and ('row', row) events from OCR lines in one pass.
+    Blank lines are skipped; a header field seen twice is yielded twice (the last one wins).
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    table_start = False
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if _HEADER_HINT.search(line):
+            for label, field in HEADER_LABELS:
+                if label in line:
+                    yield 'header', field, _header_value(label, line)
+                    break
+        if not table_start and _TABLE_CODE.match(parts[0]):
+            table_start = True
+        if table_start and len(parts) >= MIN_ROW_TOKENS:
+            yield 'row', parse_table_row(parts)
+
+
+def parse_exception_form(ocr_lines):
+    """Parse OCR lines of an exception claim form. Returns (form_data, rows)."""
+    form_data = dict.fromkeys(HEADER_FIELDS, '')
+    rows = []
+    for event in iter_exception_form(ocr_lines):
+        if event[0] == 'header':
+            form_data[event[1]] = event[2]
+        else:
+            rows.append(event[1])
+    return form_data, rows
+
+
+def iter_tsv_lines(tsv, min_confidence=None):
+    """
+    Yield the text lines of Tesseract TSV output (image_to_data), joining the words of
+    each line. tsv may be the whole TSV string or any iterable of TSV lines, e.g. an
+    open file or a subprocess stdout, and is read incrementally.
+    Words below min_confidence (0-100) are dropped when it is given.
+    """
+    if isinstance(tsv, str):
+        tsv = tsv.splitlines()
+    lines = iter(tsv)
+    header = next(lines, None)
+    if header is None:
+        return
+    columns = header.rstrip('\r\n').split('\t')
+    key_indexes = [columns.index(name) for name in TSV_LINE_KEY]
+    conf_index = columns.index('conf')
+    text_index = columns.index('text')
+
+    current_key = None
+    words = []
+    for raw_line in lines:
+        fields = raw_line.rstrip('\r\n').split('\t')
+        if len(fields) <= text_index:
+            continue  # Structural rows (page/block/paragraph) may have no text column
+        text = fields[text_index].strip()
+        try:
+            confidence = float(fields[conf_index])
+        except ValueError:
+            confidence = -1
+        if not text or confidence < 0:
+            continue
+        if min_confidence is not None and confidence < min_confidence:
+            continue
+        key = tuple(fields[index] for index in key_indexes)
+        if key != current_key:
+            if words:
+                yield ' '.join(words)
+            current_key = key
+            words = []
+        words.append(text)
+    if words:
+        yield ' '.join(words)
+
+
+def parse_tesseract_tsv(tsv, min_confidence=None):
+    """Parse an exception claim form straight from Tesseract TSV output. Returns (form_data, rows)."""
+    return parse_exception_form(iter_tsv_lines(tsv, min_confidence))
@@ -0,0 +1,151 @@
+# === raw_payloads.py ===
+"""
+Content-addressed storage for raw Gemini responses.
+
+A response is stored once in raw_payloads (sha256 -> compressed compact
+JSON, see column_codec) and every form extracted from it references it by raw_payload_id and
+raw_entry_index. The raw_* text columns of such forms stay NULL and are
+rebuilt on read by hydrate_raw_columns(); a column that is not NULL (legacy
+forms, or raw JSON edited by a user) always wins over the payload.
+"""
+import datetime
+import hashlib
+import sqlite3
+import zlib
+
+import fast_json
+from column_codec import compress_bytes, decompress_bytes, decode_columns
+
+DEFAULT_ENTRY_FORM_TYPE = "SUPERVISOR'S OVERTIME AUTHORIZATION"
+
+# Raw text columns that can be rebuilt from a payload
+RAW_COLUMNS = ['raw_gemini_json', 'raw_extracted_data', 'raw_extracted_data_pure', 'raw_extracted_data_mapped']
+
+# Payloads kept per payload_cache; forms of one response have adjacent ids, so a few are enough
+PAYLOAD_CACHE_SIZE = 64
+
+
+def compact_json(data) -> str:
+    """Serialize Gemini data without whitespace. Each entry is serialized once and shared by every column that stores it."""
+    return fast_json.dumps(data)
+
+
+def entry_document_json(document_form_type: str, entry_json: str) -> str:
+    """Build the per-entry {"form_type", "entry"} document around an already serialized entry."""
+    return '{"form_type":' + compact_json(document_form_type) + ',"entry":' + entry_json + '}'
+
+
+def response_employee_data(raw_data, form_type):
+    """Employee details shared by every entry of a supervisor response (old 'employee' or new 'employeeDetails' format)."""
+    if form_type != 'supervisor':
+        return {}
+    if 'employee' in raw_data:
+        return raw_data['employee'] or {}
+    elif 'employeeDetails' in raw_data:
+        return raw_data['employeeDetails'] or {}
+    return {}
+
+
+def merge_entry(entry, employee_data, form_type):
+    """Merge employee data into an entry for supervisor forms; the entry's own fields win."""
+    if form_type == 'supervisor' and employee_data:
+        return {**employee_data, **entry}
+    return entry
+
+
+def init_raw_payloads_table(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS raw_payloads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sha256 TEXT UNIQUE NOT NULL,
+            data BLOB NOT NULL,
+            created_at TEXT
+        )
+    ''')
+
+
+def store_raw_payload(conn, payload_json: str) -> int:
+    """Store a compact JSON response once and return its id. Identical responses share one row."""
+    payload_bytes = payload_json.encode('utf-8')
+    digest = hashlib.sha256(payload_bytes).hexdigest()
+    c = conn.cursor()
+    c.execute('INSERT OR IGNORE INTO raw_payloads (sha256, data, created_at) VALUES (?, ?, ?)',
+              (digest, compress_bytes(payload_bytes), datetime.datetime.now().isoformat()))
+    if c.rowcount:
+        return c.lastrowid
+    return c.execute('SELECT id FROM raw_payloads WHERE sha256 = ?', (digest,)).fetchone()[0]
+
+
+def load_raw_payload(conn, payload_id, payload_cache=None):
+    """Return the parsed response for a payload id, or None if it is missing."""
+    if payload_cache is not None and payload_id in payload_cache:
+        return payload_cache[payload_id]
+    row = conn.execute('SELECT data FROM raw_payloads WHERE id = ?', (payload_id,)).fetchone()
+    payload = fast_json.loads(decompress_bytes(row[0])) if row else None
+    if payload_cache is not None:
+        if len(payload_cache) >= PAYLOAD_CACHE_SIZE:
+            payload_cache.clear()
+        payload_cache[payload_id] = payload
+    return payload
+
+
+def payload_raw_columns(payload, entry_index, form_type):
+    """Rebuild the raw_* column values of one form from its response, as stored by the dual extraction."""
+    if entry_index is None:
+        payload_json = compact_json(payload)
+        return dict.fromkeys(RAW_COLUMNS, payload_json)
+    entry = merge_entry(payload['entries'][entry_index], response_employee_data(payload, form_type), form_type)
+    entry_json = compact_json(entry)
+    columns = dict.fromkeys(RAW_COLUMNS, entry_json)
+    columns['raw_gemini_json'] = entry_document_json(payload.get('form_type', DEFAULT_ENTRY_FORM_TYPE), entry_json)
+    return columns
+
+
+def hydrate_raw_columns(conn, form, payload_cache=None):
+    """
+    Decode the compressed text columns of a form dict and fill its NULL raw_*
+    columns from its raw payload. Every reader of stored forms goes through
+    this. Pass the same payload_cache dict when hydrating many forms.
+    """
+    decode_columns(form)
+    payload_id = form.get('raw_payload_id')
+    if not payload_id or all(form.get(column) is not None for column in RAW_COLUMNS):
+        return form
+    try:
+        payload = load_raw_payload(conn, payload_id, payload_cache)
+        if payload is None:
+            return form
+        rebuilt = payload_raw_columns(payload, form.get('raw_entry_index'), form.get('form_type'))
+    except (sqlite3.Error, ValueError, KeyError, IndexError, TypeError, zlib.error) as e:
+        print(f"Could not load raw payload {payload_id} for form {form.get('id')}: {e}")
+        return form
+    for column in RAW_COLUMNS:
+        if form.get(column) is None:
+            form[column] = rebuilt[column]
+    return form
+
+
+def load_raw_columns(conn, form_id, payload_cache=None):
+    """Return the hydrated raw_* columns of one stored form ({} if it does not exist)."""
+    c = conn.execute(f"SELECT id, form_type, raw_payload_id, raw_entry_index, {', '.join(RAW_COLUMNS)} FROM exception_forms WHERE id = ?", (form_id,))
+    row = c.fetchone()
+    if not row:
+        return {}
+    form = hydrate_raw_columns(conn, dict(zip([desc[0] for desc in c.description], row)), payload_cache)
+    return {column: form.get(column) for column in RAW_COLUMNS}
+
+
+def prune_raw_payloads(conn, payload_ids=None):
+    """Delete payloads no form references any more (only the given ids, if passed). Returns the number deleted."""
+    c = conn.cursor()
+    if payload_ids is None:
+        c.execute('DELETE FROM raw_payloads WHERE id NOT IN (SELECT raw_payload_id FROM exception_forms WHERE raw_payload_id IS NOT NULL)')
+        return c.rowcount
+    deleted = 0
+    for payload_id in set(payload_ids):
+        if payload_id is None:
+            continue
+        c.execute('DELETE FROM raw_payloads WHERE id = ? AND NOT EXISTS (SELECT 1 FROM exception_forms WHERE raw_payload_id = ?)',
+                  (payload_id, payload_id))
+        deleted += c.rowcount
+    return deleted
@@ -0,0 +1,258 @@
+# === remap.py ===
+"""
+Offline re-mapping of stored forms.
+
+When the alias tables in field_mapping change, remap_forms() rebuilds the
+mapped columns and overtime rows of existing forms from the raw Gemini JSON
+they already store, without calling Gemini again. Forms are streamed in
+id-ordered chunks; the mapping can run in a process pool, and only columns
+and rows whose values actually changed are written, one transaction per
+chunk. Forms a user has edited are skipped unless include_edited is set.
+
+Run from the command line (python remap.py --help) or through
+POST /api/forms/remap, which runs it on a background thread.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fast_json
+import field_mapping
+from field_mapping import process_single_form, combined_mapped_columns, pure_extraction_rows, COMBINED_MAPPED_FIELDS
+from db import FORM_ROW_FIELDS, insert_form_rows, bump_data_version, init_audit_db, log_audit, refresh_fingerprint
+from form_values import FINGERPRINT_FIELDS, stored_text
+from raw_payloads import RAW_COLUMNS, hydrate_raw_columns
+from audit_archive import archive_path, archived_months
+from form_patch import BULK_EDIT_AUDIT_ACTION
+
+REMAP_CHUNK_SIZE = 500
+# Upper bound on the process pool, whatever the caller asks for
+MAX_REMAP_WORKERS = os.cpu_count() or 1
+REMAP_EXTRACTION_MODES = ('combined', 'mapped')
+# Audit actions that mark a form as edited by hand
+EDIT_AUDIT_ACTIONS = ('edit',)
+
+_remap_lock = threading.Lock()
+_remap_state = {'status': 'idle'}
+
+
+def _quiet_mapping():
+    """Process pool initializer: keep workers from printing every unmapped key."""
+    field_mapping.REPORT_UNMAPPED_KEYS = False
+
+
+def _row_signature(row):
+    return tuple(stored_text(row.get(field)) for field in FORM_ROW_FIELDS)
+
+
+def remap_entry(task):
+    """
+    Map one stored entry. task is (form_id, form_type, raw_json).
+    Returns (form_id, columns, rows), or (form_id, None, error message).
+    """
+    form_id, form_type, raw_json = task
+    try:
+        data = fast_json.loads(raw_json)
+        mapped_form_data, mapped_rows = process_single_form(data, form_type)
+        rows = mapped_rows if mapped_rows else pure_extraction_rows(data)
+        return form_id, combined_mapped_columns(mapped_form_data), [row for row in rows if isinstance(row, dict)]
+    except Exception as e:
+        return form_id, None, str(e)
+
+
+def _edited_form_ids(conn):
+    """Forms with an edit in the audit trail, in forms.db or any archive."""
+    placeholders = ', '.join('?' * len(EDIT_AUDIT_ACTIONS))
+    edited = set()
+    for path in [None] + [archive_path(month) for month in archived_months()]:
+        audit_conn = conn if path is None else sqlite3.connect(path, timeout=10)
+        try:
+            c = audit_conn.execute(f"SELECT DISTINCT target_id FROM audit_trail WHERE target_type = 'form' AND action IN ({placeholders})",
+                                   EDIT_AUDIT_ACTIONS)
+            edited.update(row[0] for row in c.fetchall())
+            # A bulk edit leaves one entry listing the diff of every form it changed
+            for (details,) in audit_conn.execute("SELECT details FROM audit_trail WHERE target_type = 'forms' AND action = ?",
+                                                 (BULK_EDIT_AUDIT_ACTION,)):
+                try:
+                    edited.update(int(form_id) for form_id in fast_json.loads(details).get('forms', {}))
+                except (ValueError, TypeError, AttributeError):
+                    continue
+        except sqlite3.OperationalError:
+            pass  # No audit trail yet
+        finally:
+            if path is not None:
+                audit_conn.close()
+    return edited
+
+
+def _read_chunk(conn, after_id, chunk_size, form_type, payload_cache):
+    columns = ['id', 'form_type', 'extraction_mode', 'raw_payload_id', 'raw_entry_index'] + RAW_COLUMNS + COMBINED_MAPPED_FIELDS
+    mode_placeholders = ', '.join('?' * len(REMAP_EXTRACTION_MODES))
+    query = f"SELECT {', '.join(columns)} FROM exception_forms WHERE id > ? AND extraction_mode IN ({mode_placeholders})"
+    params = [after_id] + list(REMAP_EXTRACTION_MODES)
+    if form_type:
+        query += " AND form_type = ?"
+        params.append(form_type)
+    query += " ORDER BY id LIMIT ?"
+    params.append(chunk_size)
+    return [hydrate_raw_columns(conn, dict(zip(columns, row)), payload_cache) for row in conn.execute(query, params).fetchall()]
+
+
+def _read_rows(conn, first_id, last_id):
+    """Current rows of the forms in [first_id, last_id], grouped by form id."""
+    rows_by_form = {}
+    c = conn.execute(f"SELECT form_id, {', '.join(FORM_ROW_FIELDS)} FROM exception_form_rows WHERE form_id BETWEEN ? AND ? ORDER BY form_id, id",
+                     (first_id, last_id))
+    for row in c.fetchall():
+        rows_by_form.setdefault(row[0], []).append(dict(zip(FORM_ROW_FIELDS, row[1:])))
+    return rows_by_form
+
+
+def remap_forms(form_type=None, chunk_size=REMAP_CHUNK_SIZE, workers=0, dry_run=False, include_edited=False, progress=None):
+    """
+    Re-run the field mapping over every combined/mapped form and write what changed.
+    workers > 1 maps each chunk in a process pool of at most MAX_REMAP_WORKERS.
+    progress, if given, is called with the running stats after every chunk.
+    Returns the stats dict.
+    """
+    workers = min(workers or 0, MAX_REMAP_WORKERS)
+    stats = {
+        'scanned': 0, 'remapped': 0, 'changed_forms': 0, 'changed_columns': 0, 'changed_rows': 0,
+        'skipped_edited': 0, 'skipped_no_raw': 0, 'errors': 0, 'last_id': 0, 'dry_run': dry_run
+    }
+    start_time = time.time()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_quiet_mapping) if workers and workers > 1 else None
+    report_unmapped = field_mapping.REPORT_UNMAPPED_KEYS
+    field_mapping.REPORT_UNMAPPED_KEYS = False
+    conn = sqlite3.connect('forms.db', timeout=10)
+    try:
+        edited_ids = set() if include_edited else _edited_form_ids(conn)
+        payload_cache = {}
+        while True:
+            forms = _read_chunk(conn, stats['last_id'], chunk_size, form_type, payload_cache)
+            if not forms:
+                break
+            stats['scanned'] += len(forms)
+            stats['last_id'] = forms[-1]['id']
+
+            tasks = []
+            current = {}
+            for form in forms:
+                if form['id'] in edited_ids:
+                    stats['skipped_edited'] += 1
+                    continue
+                if form['extraction_mode'] == 'combined':
+                    raw_json = form.get('raw_extracted_data_mapped') or form.get('raw_extracted_data')
+                else:
+                    raw_json = form.get('raw_extracted_data')
+                if not raw_json:
+                    stats['skipped_no_raw'] += 1
+                    continue
+                tasks.append((form['id'], form['form_type'], raw_json))
+                current[form['id']] = form
+
+            if executor:
+                results = list(executor.map(remap_entry, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+            else:
+                results = [remap_entry(task) for task in tasks]
+            current_rows = _read_rows(conn, forms[0]['id'], forms[-1]['id'])
+
+            column_updates = []
+            row_updates = []
+            for form_id, columns, rows in results:
+                if columns is None:
+                    stats['errors'] += 1
+                    print(f"Re-map failed for form {form_id}: {rows}")
+                    continue
+                stats['remapped'] += 1
+                form = current[form_id]
+                changed = {field: value for field, value in columns.items() if stored_text(value) != stored_text(form.get(field))}
+                rows_changed = [_row_signature(row) for row in rows] != [_row_signature(row) for row in current_rows.get(form_id, [])]
+                if changed:
+                    column_updates.append((form_id, changed))
+                    stats['changed_columns'] += len(changed)
+                if rows_changed:
+                    row_updates.append((form_id, rows))
+                    stats['changed_rows'] += 1
+                if changed or rows_changed:
+                    stats['changed_forms'] += 1
+
+            if (column_updates or row_updates) and not dry_run:
+                c = conn.cursor()
+                for form_id, changed in column_updates:
+                    set_clause = ', '.join(f'{field} = ?' for field in changed)
+                    c.execute(f'UPDATE exception_forms SET {set_clause} WHERE id = ?', list(changed.values()) + [form_id])
+                    if any(field in changed for field in FINGERPRINT_FIELDS):
+                        refresh_fingerprint(conn, form_id)
+                for form_id, rows in row_updates:
+                    c.execute('DELETE FROM exception_form_rows WHERE form_id = ?', (form_id,))
+                    insert_form_rows(c, form_id, rows)
+                bump_data_version(conn)
+                conn.commit()
+
+            stats['elapsed_seconds'] = round(time.time() - start_time, 1)
+            print(f"Re-map: scanned {stats['scanned']} forms up to id {stats['last_id']}, {stats['changed_forms']} changed")
+            if progress:
+                progress(dict(stats))
+
+        if stats['changed_forms'] and not dry_run:
+            init_audit_db()
+            log_audit('system', 'remap', 'forms', None, fast_json.dumps(stats), conn=conn)
+            conn.commit()
+    finally:
+        field_mapping.REPORT_UNMAPPED_KEYS = report_unmapped
+        conn.close()
+        if executor:
+            executor.shutdown()
+    stats['elapsed_seconds'] = round(time.time() - start_time, 1)
+    return stats
+
+
+def get_remap_status():
+    with _remap_lock:
+        return dict(_remap_state)
+
+
+def start_remap_job(**options):
+    """Run remap_forms() on a background thread. Returns False if a re-map is already running."""
+    with _remap_lock:
+        if _remap_state.get('status') == 'running':
+            return False
+        _remap_state.clear()
+        _remap_state.update({'status': 'running', 'options': options, 'started_at': datetime.datetime.now().isoformat()})
+
+    def report(stats):
+        with _remap_lock:
+            _remap_state['stats'] = stats
+
+    def run():
+        try:
+            stats = remap_forms(progress=report, **options)
+            result = {'status': 'finished', 'stats': stats}
+        except Exception as e:
+            print(f"Re-map failed: {e}")
+            result = {'status': 'failed', 'error': str(e)}
+        with _remap_lock:
+            _remap_state.update(result)
+            _remap_state['finished_at'] = datetime.datetime.now().isoformat()
+
+    threading.Thread(target=run, name='remap', daemon=True).start()
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild mapped fields of stored forms from their raw Gemini JSON.')
+    parser.add_argument('--form-type', choices=['hourly', 'supervisor'])
+    parser.add_argument('--chunk-size', type=int, default=REMAP_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=0, help=f'Map in a pool of this many processes (at most {MAX_REMAP_WORKERS})')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--include-edited', action='store_true', help='Also re-map forms edited by users')
+    args = parser.parse_args()
+    result = remap_forms(form_type=args.form_type, chunk_size=args.chunk_size, workers=args.workers,
+                         dry_run=args.dry_run, include_edited=args.include_edited)
+    print(fast_json.dumps(result, indent=True))
@@ -0,0 +1,105 @@
+# === response_cache.py ===
+"""
+In-process response cache for the read-heavy dashboard endpoints.
+
+Responses are keyed on the endpoint, its URL/query arguments and the current
+data version (see db.get_data_version), so any write to forms.db makes older
+entries unreachable. Each cached response carries an ETag; clients that send
+it back in If-None-Match get a 304 without any SQL or serialization.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response, Response
+
+from db import get_data_version
+
+CACHE_MAX_ENTRIES = 256
+CACHE_TTL_SECONDS = 300
+
+
+class ResponseCache:
+    """Small thread-safe LRU store with a per-entry time-to-live."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+response_cache = ResponseCache()
+
+
+def _cache_key(data_version):
+    view_args = tuple(sorted((request.view_args or {}).items()))
+    query_args = tuple(sorted(request.args.items(multi=True)))
+    return (request.endpoint, view_args, query_args, data_version)
+
+
+def _etag_for(key):
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def cached_response(ttl=None):
+    """
+    Cache a GET view's successful responses and answer conditional requests.
+    Only 200 responses are stored; errors always go through to the view.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _cache_key(get_data_version())
+            etag = _etag_for(key)
+
+            if etag in request.if_none_match:
+                not_modified = Response(status=304)
+                not_modified.set_etag(etag)
+                not_modified.headers['Cache-Control'] = 'no-cache'
+                return not_modified
+
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, mimetype = cached
+                response = Response(body, status=200, mimetype=mimetype)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response_cache.set(key, (response.get_data(), response.mimetype), ttl)
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,191 @@
+# === search_index.py ===
+"""
+Full-text search over stored forms with SQLite FTS5.
+
+exception_forms_fts has one row per form (rowid = form id) with the
+searchable columns of the form and raw_text, the flattened values of its raw
+Gemini JSON. Triggers on exception_forms keep the plain columns in sync on
+insert, update and delete. raw_text cannot be built in SQL (raw JSON is
+compressed or lives in a shared raw payload), so index_raw_text() fills it
+when a form is stored or its raw JSON edited, and rebuild_raw_text() (python
+search_index.py) fills it for forms stored before the index existed.
+
+If the SQLite build has no FTS5, the index is simply not created and
+search_available() is False.
+"""
+import html
+import re
+import sqlite3
+
+import fast_json
+from raw_payloads import RAW_COLUMNS, hydrate_raw_columns, load_raw_columns
+
+FTS_TABLE = 'exception_forms_fts'
+# exception_forms columns mirrored into the index by the triggers
+SEARCH_COLUMNS = ['employee_name', 'pass_number', 'comments', 'overtime_location', 'report_loc', 'job_number']
+# bm25 weights, in index column order (SEARCH_COLUMNS, then raw_text)
+SEARCH_WEIGHTS = [10.0, 10.0, 2.0, 3.0, 3.0, 5.0, 1.0]
+SEARCH_RESULT_COLUMNS = ['id', 'pass_number', 'employee_name', 'form_type', 'status', 'upload_date', 'date_of_overtime', 'job_number']
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+HIGHLIGHT_OPEN = '<mark>'
+HIGHLIGHT_CLOSE = '</mark>'
+# Private-use characters FTS5 wraps matches in; swapped for the tags once the text is HTML-escaped
+_MATCH_OPEN = '\ue000'
+_MATCH_CLOSE = '\ue001'
+REBUILD_CHUNK_SIZE = 500
+
+_SEARCH_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def init_search_index(c):
+    """Create the FTS table and its triggers, filling it from exception_forms the first time. Returns False without FTS5."""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).fetchone()
+    if exists:
+        return True
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_columns = ', '.join(f'new.{column}' for column in SEARCH_COLUMNS)
+    try:
+        c.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({columns}, raw_text, tokenize = 'unicode61 remove_diacritics 2')")
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search disabled, FTS5 is not available: {e}")
+        return False
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS exception_forms_fts_insert AFTER INSERT ON exception_forms BEGIN
+            INSERT INTO {FTS_TABLE} (rowid, {columns}, raw_text) VALUES (new.id, {new_columns}, '');
+        END
+    ''')
+    set_clause = ', '.join(f'{column} = new.{column}' for column in SEARCH_COLUMNS)
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS exception_forms_fts_update AFTER UPDATE OF {columns} ON exception_forms BEGIN
+            UPDATE {FTS_TABLE} SET {set_clause} WHERE rowid = new.id;
+        END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS exception_forms_fts_delete AFTER DELETE ON exception_forms BEGIN
+            DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        END
+    ''')
+    c.execute(f"INSERT INTO {FTS_TABLE} (rowid, {columns}, raw_text) SELECT id, {columns}, '' FROM exception_forms")
+    return True
+
+
+def search_available(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).fetchone() is not None
+
+
+def _json_values(value, values):
+    if isinstance(value, dict):
+        for item in value.values():
+            _json_values(item, values)
+    elif isinstance(value, list):
+        for item in value:
+            _json_values(item, values)
+    elif isinstance(value, bool) or value is None:
+        return
+    else:
+        text = str(value).strip()
+        if text:
+            values[text] = None
+
+
+def flatten_raw_text(raw_columns):
+    """The distinct scalar values of a form's raw JSON columns, space separated."""
+    values = {}  # Ordered set
+    for column in RAW_COLUMNS:
+        text = raw_columns.get(column)
+        if not text:
+            continue
+        try:
+            _json_values(fast_json.loads(text), values)
+        except (ValueError, TypeError):
+            values[str(text)] = None
+    return ' '.join(values)
+
+
+def _set_raw_text(conn, form_id, raw_columns):
+    conn.execute(f'UPDATE {FTS_TABLE} SET raw_text = ? WHERE rowid = ?', (flatten_raw_text(raw_columns), form_id))
+
+
+def index_raw_text(conn, form_id):
+    """Refresh the raw_text of one form in the index, inside the caller's transaction."""
+    if search_available(conn):
+        _set_raw_text(conn, form_id, load_raw_columns(conn, form_id))
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every word must match, as a prefix. Raises ValueError if there is no word."""
+    tokens = _SEARCH_TOKEN.findall(text or '')
+    if not tokens:
+        raise ValueError('Search text has no words')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _highlight_html(text):
+    """HTML-escape form text marked by FTS5, then turn the match markers into <mark> tags."""
+    if text is None:
+        return None
+    return html.escape(text).replace(_MATCH_OPEN, HIGHLIGHT_OPEN).replace(_MATCH_CLOSE, HIGHLIGHT_CLOSE)
+
+
+def search_forms(conn, text, form_type=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    One page of forms matching text, best match first, as (results, has_more).
+    Each result has SEARCH_RESULT_COLUMNS, its bm25 rank, a highlighted
+    employee_name and a snippet of the best matching column, both HTML-escaped
+    with the matches in <mark> tags.
+    """
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    select = ', '.join(f'f.{column}' for column in SEARCH_RESULT_COLUMNS)
+    query = f'''
+        SELECT {select},
+               bm25({FTS_TABLE}, {weights}) AS rank,
+               highlight({FTS_TABLE}, 0, ?, ?) AS employee_name_highlight,
+               snippet({FTS_TABLE}, -1, ?, ?, '...', 12) AS snippet
+        FROM {FTS_TABLE} JOIN exception_forms f ON f.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH ?
+    '''
+    params = [_MATCH_OPEN, _MATCH_CLOSE, _MATCH_OPEN, _MATCH_CLOSE, build_match_query(text)]
+    if form_type:
+        query += ' AND f.form_type = ?'
+        params.append(form_type)
+    query += ' ORDER BY rank LIMIT ? OFFSET ?'
+    params.extend([limit + 1, offset])
+    columns = SEARCH_RESULT_COLUMNS + ['rank', 'employee_name_highlight', 'snippet']
+    results = [dict(zip(columns, row)) for row in conn.execute(query, params).fetchall()]
+    for result in results:
+        result['employee_name_highlight'] = _highlight_html(result['employee_name_highlight'])
+        result['snippet'] = _highlight_html(result['snippet'])
+    return results[:limit], len(results) > limit
+
+
+def rebuild_raw_text(db_path='forms.db', chunk_size=REBUILD_CHUNK_SIZE):
+    """Fill raw_text for every form, chunk by chunk. Returns the number of forms indexed."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        if not search_available(conn):
+            print('Full-text search index does not exist (FTS5 unavailable?)')
+            return 0
+        columns = ['id', 'form_type', 'raw_payload_id', 'raw_entry_index'] + RAW_COLUMNS
+        payload_cache = {}
+        last_id = 0
+        indexed = 0
+        while True:
+            rows = conn.execute(f"SELECT {', '.join(columns)} FROM exception_forms WHERE id > ? ORDER BY id LIMIT ?",
+                                (last_id, chunk_size)).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                form = hydrate_raw_columns(conn, dict(zip(columns, row)), payload_cache)
+                _set_raw_text(conn, form['id'], form)
+            conn.commit()
+            last_id = rows[-1][0]
+            indexed += len(rows)
+            print(f"Search index: raw text of {indexed} forms indexed (up to id {last_id})")
+        return indexed
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    rebuild_raw_text()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for the buffered audit writer: batching, background flushes,
+retry after a failed write and the final flush on close.
+"""
+
+import sqlite3
+import time
+
+import pytest
+
+from audit_sink import AuditSink
+
+
+def make_db(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE audit_trail (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, action TEXT, target_type TEXT,
+                target_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, details TEXT
+            )
+        ''')
+    conn.close()
+
+
+def audit_rows(path):
+    with sqlite3.connect(path) as conn:
+        rows = conn.execute('SELECT username, action, target_id, timestamp FROM audit_trail ORDER BY id').fetchall()
+    conn.close()
+    return rows
+
+
+def test_entries_are_buffered_until_flush(tmp_path):
+    path = str(tmp_path / 'forms.db')
+    make_db(path)
+    sink = AuditSink(path, flush_interval=60)
+    for form_id in range(3):
+        sink.log('jane', 'upload', 'form', form_id, 'Form uploaded')
+    assert audit_rows(path) == []
+    assert sink.flush() == 3
+    rows = audit_rows(path)
+    assert [row[2] for row in rows] == [0, 1, 2]
+    assert len(rows[0][3]) == len('2024-01-01 00:00:00.000')
+    sink.close()
+
+
+def test_background_writer_and_close(tmp_path):
+    path = str(tmp_path / 'forms.db')
+    make_db(path)
+    sink = AuditSink(path, flush_interval=0.05)
+    sink.log('jane', 'upload', 'form', 1)
+    deadline = time.time() + 5
+    while not audit_rows(path) and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(audit_rows(path)) == 1
+    sink.flush_interval = 60
+    sink.log('jane', 'edit', 'form', 1)
+    sink.close()
+    assert [row[1] for row in audit_rows(path)] == ['upload', 'edit']
+    # Entries logged after close are written straight away
+    sink.log('jane', 'delete', 'form', 1)
+    assert len(audit_rows(path)) == 3
+    with sqlite3.connect(path) as conn:
+        conn.execute('DROP TABLE audit_trail')
+    conn.close()
+    sink.log('jane', 'delete', 'form', 2)  # A failed write is logged, not raised into the caller
+
+
+def test_failed_flush_keeps_entries(tmp_path):
+    path = str(tmp_path / 'forms.db')
+    sink = AuditSink(path, flush_interval=60)
+    sink.log('jane', 'upload', 'form', 1)
+    with pytest.raises(sqlite3.OperationalError):
+        sink.flush()  # No audit_trail table yet
+    assert sink.pending() == 1
+    sink.max_pending = 2
+    sink.log('jane', 'upload', 'form', 2)  # A full buffer flushes synchronously; its failure must not reach the caller
+    assert sink.pending() == 2
+    make_db(path)
+    assert sink.flush() == 2
+    sink.close()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-batch deduplication of entries extracted from overlapping segments.
+"""
+
+from dedup import dedupe_entries
+
+
+def entry(rows=None, **fields):
+    form_data = {'pass_number': '1234567', 'date_of_overtime': '07/04/2024', 'overtime_hours': '2:00',
+                 'job_number': 'J-100', 'employee_name': 'JANE DOE', 'title': '', 'status': 'processed'}
+    form_data.update(fields)
+    return (form_data, rows or [], '{}')
+
+
+def test_exact_and_fuzzy_copies_collapse_to_most_complete():
+    half = entry()
+    quarter = entry(date_of_overtime='7/4/24', overtime_hours='2', job_number='j100')  # Same fingerprint
+    full_page = entry(employee_name='JANE D0E', title='Conductor', rows=[{'code': '48'}])  # OCR variant, more complete
+    other_slip = entry(overtime_hours='3:30')
+    kept, dropped = dedupe_entries([half, quarter, full_page, other_slip], 'supervisor')
+    assert dropped == 2
+    assert kept == [full_page, other_slip]
+
+
+def test_different_people_and_errors_are_kept():
+    a = entry()
+    b = entry(pass_number='7654321', employee_name='JOHN ROE')
+    no_pass = entry(pass_number='')
+    error = entry(status='error')
+    kept, dropped = dedupe_entries([a, b, no_pass, no_pass, error, error], 'supervisor')
+    assert dropped == 0
+    assert len(kept) == 6
+
+
+def test_dissimilar_details_are_not_merged():
+    a = entry(job_number='J-100', employee_name='JANE DOE', overtime_location='CONEY ISLAND YARD')
+    b = entry(job_number='X-999', employee_name='MARIA LOPEZ', overtime_location='JAMAICA')
+    kept, dropped = dedupe_entries([a, b], 'supervisor')
+    assert dropped == 0
+
+
+def test_hourly_slips_on_different_dates_are_kept():
+    def hourly(ot_date, rows):
+        return ({'pass_number': '1234567', 'actual_ot_date': ot_date, 'employee_name': 'JANE DOE', 'status': 'processed'}, rows, '{}')
+    first = hourly('07/01/2024', [{'code': '48', 'overtime_hh': '2', 'overtime_mm': '00'}])
+    second = hourly('07/02/2024', [{'code': '48', 'overtime_hh': '1', 'overtime_mm': '30'}])
+    copy = hourly('7/1/24', [{'code': '48', 'overtime_hh': '2', 'overtime_mm': '00'}])
+    other_rows = hourly('07/01/2024', [{'code': '12', 'overtime_hh': '3', 'overtime_mm': '00'}])
+    no_date = hourly('', first[1])
+    kept, dropped = dedupe_entries([first, second, copy, other_rows, no_date, no_date], 'hourly')
+    assert dropped == 1
+    assert kept == [first, second, other_rows, no_date, no_date]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test script for the export flattening shared by the XLSX, CSV and Parquet exports.
+Builds a throwaway forms database and checks the flattened rows, the CSV output
+and the typed columns used by the Parquet export.
+"""
+
+import csv
+import datetime
+import io
+import os
+import sqlite3
+import tempfile
+
+from exporter import open_export, iter_csv, OVERTIME_ROW_HEADERS, TYPED_EXPORT_COLUMNS
+from form_values import parse_overtime_minutes, parse_form_date, parse_flag
+
+
+def create_test_db():
+    """Create a minimal exception_forms / exception_form_rows database"""
+    db_dir = tempfile.mkdtemp()
+    conn = sqlite3.connect(os.path.join(db_dir, 'forms.db'))
+    conn.execute('''
+        CREATE TABLE exception_forms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, pass_number TEXT, employee_name TEXT,
+            form_type TEXT, extraction_mode TEXT, overtime_hours TEXT, date_of_overtime TEXT,
+            actual_ot_date TEXT, reason_rdo INTEGER DEFAULT 0, reason_other INTEGER DEFAULT 0,
+            raw_extracted_data TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE exception_form_rows (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, form_id INTEGER, code TEXT,
+            overtime_hh TEXT, overtime_mm TEXT, ta_job_no TEXT
+        )
+    ''')
+    conn.execute("INSERT INTO exception_forms (pass_number, employee_name, form_type, extraction_mode, overtime_hours, date_of_overtime, reason_rdo, raw_extracted_data) VALUES ('086345', 'John Doe', 'supervisor', 'combined', '1:30 + 2', '7/17/2025', 1, '{\"PASS\": \"086345\"}')")
+    conn.execute("INSERT INTO exception_forms (pass_number, employee_name, form_type, extraction_mode, actual_ot_date) VALUES ('123456', 'Jane Smith', 'hourly', 'combined', '2025-07-18')")
+    conn.execute("INSERT INTO exception_form_rows (form_id, code, overtime_hh, overtime_mm, ta_job_no) VALUES (2, '39', '0', '30', '09068')")
+    conn.execute("INSERT INTO exception_form_rows (form_id, code, overtime_hh, overtime_mm, ta_job_no) VALUES (2, '40', '1', '15', '09068')")
+    conn.commit()
+    return conn
+
+
+def test_value_parsers():
+    assert parse_overtime_minutes('1:30 + 2') == 210
+    assert parse_overtime_minutes('00:45') == 45
+    assert parse_overtime_minutes('3') == 180
+    assert parse_overtime_minutes('N/A') is None
+    assert parse_overtime_minutes('abc') is None
+    assert parse_form_date('7/17/2025') == datetime.date(2025, 7, 17)
+    assert parse_form_date('07/06/25') == datetime.date(2025, 7, 6)
+    assert parse_form_date('2025-07-18T10:00:00') == datetime.date(2025, 7, 18)
+    assert parse_form_date('sometime') is None
+    assert parse_flag(1) and parse_flag('Yes') and not parse_flag('0') and not parse_flag(None)
+
+
+def test_flattened_rows():
+    conn = create_test_db()
+    export_columns, headers, rows = open_export(conn)
+    rows = list(rows)
+    assert headers[-len(OVERTIME_ROW_HEADERS):] == OVERTIME_ROW_HEADERS
+    # One line for the supervisor form, two for the hourly form's overtime rows
+    assert len(rows) == 3
+    assert rows[0][0] == '1'
+    assert rows[1][0] == '2' and rows[1][len(export_columns) + 1] == '39'
+    assert rows[2][0] == '' and rows[2][len(export_columns) + 1] == '40'
+
+    _, _, hourly_rows = open_export(conn, form_type='hourly')
+    assert len(list(hourly_rows)) == 2
+
+
+def test_csv_export():
+    conn = create_test_db()
+    export_columns, headers, rows = open_export(conn)
+    text = ''.join(iter_csv(headers, rows, flush_rows=2))
+    parsed = list(csv.reader(io.StringIO(text)))
+    assert parsed[0] == headers
+    assert len(parsed) == 4
+
+
+def test_typed_columns():
+    conn = create_test_db()
+    export_columns, headers, rows = open_export(conn, typed=True)
+    rows = list(rows)
+    typed_start = len(headers) - len(TYPED_EXPORT_COLUMNS)
+    assert headers[typed_start] == 'Overtime Minutes'
+    supervisor, hourly_first, hourly_second = (row[typed_start:] for row in rows)
+    assert supervisor[0] == 210 and supervisor[2] == datetime.date(2025, 7, 17) and supervisor[3] is True
+    assert hourly_first[1] == 30 and hourly_second[1] == 75
+    assert hourly_first[2] == datetime.date(2025, 7, 18)
+
+
+if __name__ == "__main__":
+    print("=== EXPORT FORMAT TEST ===")
+    test_value_parsers()
+    test_flattened_rows()
+    test_csv_export()
+    test_typed_columns()
+    print("✅ All export format checks passed")
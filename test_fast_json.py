@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Test script for the fast_json facade.
+Checks that the orjson and standard json backends parse and serialize the
+same data, including the inputs orjson hands back to the standard module.
+"""
+
+import json
+
+import pytest
+
+import fast_json
+
+SAMPLE = {
+    'form_type': "SUPERVISOR'S OVERTIME AUTHORIZATION",
+    'entries': [
+        {'pass_number': '12345', 'overtime_hours': '2:30', 'rdo': True, 'rows': [{'code': 'A', 'amount': 1.5}]},
+        {'pass_number': None, 'employee_name': 'José Peña', 'rows': []},
+    ],
+    'count': 2,
+}
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def backend(request, monkeypatch):
+    if request.param == 'stdlib':
+        monkeypatch.setattr(fast_json, 'orjson', None)
+    elif fast_json.orjson is None:
+        pytest.skip('orjson is not installed')
+    return request.param
+
+
+def test_round_trip_matches_stdlib(backend):
+    text = fast_json.dumps(SAMPLE)
+    assert json.loads(text) == SAMPLE
+    assert fast_json.loads(text) == SAMPLE
+    assert fast_json.loads(text.encode('utf-8')) == SAMPLE
+    assert ' ' not in fast_json.dumps({'a': [1, 2], 'b': {'c': None}})
+
+
+def test_indent_and_sort_keys(backend):
+    text = fast_json.dumps({'b': 1, 'a': [1]}, indent=True, sort_keys=True)
+    assert text == json.dumps({'b': 1, 'a': [1]}, indent=2, sort_keys=True)
+
+
+def test_stdlib_fallbacks(backend):
+    assert str(fast_json.loads('{"a": NaN}')['a']) == 'nan'
+    assert fast_json.loads(fast_json.dumps({'big': 2 ** 70}))['big'] == 2 ** 70
+    assert fast_json.loads(fast_json.dumps({1: 'x'})) == {'1': 'x'}
+    with pytest.raises(json.JSONDecodeError):
+        fast_json.loads('{not json')
+
+
+def test_flask_provider_response():
+    flask = pytest.importorskip('flask')
+    app = flask.Flask(__name__)
+    app.json = fast_json.FastJSONProvider(app)
+    with app.app_context():
+        response = flask.jsonify({'forms': SAMPLE['entries'], 'total': 2})
+    assert response.mimetype == 'application/json'
+    assert json.loads(response.get_data()) == {'forms': SAMPLE['entries'], 'total': 2}
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Test script for the classifier fallback that maps Gemini keys no alias rule knows.
+The classification tests need scikit-learn and are skipped without it.
+"""
+
+import pytest
+
+import field_mapping
+from key_classifier import KeyClassifier, key_to_text
+
+
+def test_key_to_text():
+    assert key_to_text('overtimeLocation') == 'overtime location'
+    assert key_to_text('RC#_no.') == 'rc no'
+    assert key_to_text('employee_pass-number') == 'employee pass number'
+    assert key_to_text('###') == ''
+
+
+@pytest.fixture
+def classifier(tmp_path, monkeypatch):
+    pytest.importorskip('sklearn')
+    monkeypatch.chdir(tmp_path)  # Keep the trained artifact out of the repo
+    classifier = KeyClassifier(field_mapping.alias_training_data)
+    monkeypatch.setattr(field_mapping, 'KEY_CLASSIFIER', classifier)
+    return classifier
+
+
+def test_unknown_keys_are_classified(classifier):
+    form_data, _ = field_mapping.process_single_form({'jobNo': 'J-42', 'otHours': '2:30', 'acctNo': '7781'}, 'supervisor')
+    assert form_data['job_number'] == 'J-42'
+    assert form_data['overtime_hours'] == '2:30'
+    assert form_data['acct_number'] == '7781'
+
+
+def test_low_confidence_and_known_fields_are_left_alone(classifier):
+    form_data, _ = field_mapping.process_single_form({'passNumber': '111', 'employeePassNo': '222', 'zzz': 'x'}, 'supervisor')
+    assert form_data['pass_number'] == '111'
+    assert classifier.classify(['zzz', 'notes']) == {}
+
+
+def test_decisions_are_cached(classifier, monkeypatch):
+    classifier.classify(['jobNo', 'zzz'])
+    monkeypatch.setattr(classifier, '_get_model', lambda: pytest.fail('cached keys must not be re-classified'))
+    assert classifier.classify(['jobNo', 'zzz'])['jobNo'][0] == 'job_number'
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Test script for the streaming OCR parser: header fields, table rows,
+blank lines and Tesseract TSV input.
+"""
+
+from ocr_parser import iter_exception_form, parse_exception_form, iter_tsv_lines, parse_tesseract_tsv
+
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext"
+
+
+def tsv_words(line_num, words, conf=90):
+    return [f"5\t1\t1\t1\t{line_num}\t{i}\t0\t0\t10\t10\t{conf}\t{word}" for i, word in enumerate(words.split(), start=1)]
+
+
+def test_headers_and_rows():
+    lines = [
+        "Employee Name: Jane Doe",
+        "Pass Number 1234567",
+        "",
+        "Title Conductor",
+        "48 L 12 08 00 09 30 01 30 00 00 00 15 J-77",
+        "   ",
+        "39 A 7 12 00 12 30 00 30 00",
+    ]
+    form_data, rows = parse_exception_form(lines)
+    assert form_data['employee_name'] == 'Jane Doe'
+    assert form_data['pass_number'] == '1234567'
+    assert form_data['title'] == 'Conductor'
+    assert [row['code'] for row in rows] == ['48', '39']
+    assert rows[0]['code_description'] == 'Worked RDO'
+    assert rows[0]['ta_job_no'] == 'J-77'
+    # A ten-token row has no bonus minutes column
+    assert rows[1]['bonus_hh'] == '00' and rows[1]['bonus_mm'] == ''
+
+
+def test_events_are_streamed():
+    events = iter_exception_form(iter(["Pass Number 42", "48 L 12 08 00 09 30 01 30 00 00"]))
+    assert next(events) == ('header', 'pass_number', '42')
+    assert next(events)[0] == 'row'
+
+
+def test_tesseract_tsv():
+    tsv = [TSV_HEADER, "1\t1\t0\t0\t0\t0\t0\t0\t100\t100\t-1\t"]
+    tsv += tsv_words(1, "Pass Number 555")
+    tsv += tsv_words(2, "smudge", conf=12)
+    tsv += tsv_words(3, "48 L 12 08 00 09 30 01 30 00 00")
+    assert list(iter_tsv_lines(tsv)) == ["Pass Number 555", "smudge", "48 L 12 08 00 09 30 01 30 00 00"]
+    assert list(iter_tsv_lines("\n".join(tsv), min_confidence=50))[1] == "48 L 12 08 00 09 30 01 30 00 00"
+    form_data, rows = parse_tesseract_tsv(tsv)
+    assert form_data['pass_number'] == '555'
+    assert rows[0]['run_no'] == '12'
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script for the FTS5 form search: trigger sync, raw JSON values,
+prefix matching, highlighting and query sanitising.
+"""
+
+import json
+import sqlite3
+
+import pytest
+
+from search_index import init_search_index, index_raw_text, search_forms, build_match_query, rebuild_raw_text
+
+FORM_COLUMNS = ['pass_number', 'employee_name', 'comments', 'overtime_location', 'report_loc', 'job_number',
+                'form_type', 'status', 'upload_date', 'date_of_overtime', 'raw_payload_id', 'raw_entry_index',
+                'raw_gemini_json', 'raw_extracted_data', 'raw_extracted_data_pure', 'raw_extracted_data_mapped']
+
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE exception_forms (id INTEGER PRIMARY KEY AUTOINCREMENT, {', '.join(FORM_COLUMNS)})")
+    return conn
+
+
+def add_form(conn, **fields):
+    fields.setdefault('form_type', 'hourly')
+    c = conn.execute(f"INSERT INTO exception_forms ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})", list(fields.values()))
+    return c.lastrowid
+
+
+def ids(results):
+    return [result['id'] for result in results]
+
+
+def test_triggers_and_raw_values(tmp_path):
+    conn = make_db(str(tmp_path / 'forms.db'))
+    assert init_search_index(conn.cursor())
+    jane = add_form(conn, employee_name='Jane Doe', comments='late clear at Coney Island',
+                    raw_gemini_json=json.dumps({'remarks': 'signal trouble Jamaica', 'flag': True}))
+    maria = add_form(conn, employee_name='Maria Lopez', job_number='J-100', form_type='supervisor')
+    index_raw_text(conn, jane)
+    assert ids(search_forms(conn, 'coney isl')[0]) == [jane]
+    assert ids(search_forms(conn, 'jamaica')[0]) == [jane]
+    assert ids(search_forms(conn, 'true')[0]) == []  # Flags are not indexed
+    assert ids(search_forms(conn, 'j-100', form_type='supervisor')[0]) == [maria]
+    assert ids(search_forms(conn, 'j-100', form_type='hourly')[0]) == []
+    results, has_more = search_forms(conn, 'jane')
+    assert results[0]['employee_name_highlight'] == '<mark>Jane</mark> Doe' and not has_more
+
+    conn.execute("UPDATE exception_forms SET employee_name = 'Janet Smith' WHERE id = ?", (jane,))
+    assert ids(search_forms(conn, 'smith')[0]) == [jane]
+    assert ids(search_forms(conn, 'jamaica')[0]) == [jane]  # raw_text survives a column update
+    conn.execute('DELETE FROM exception_forms WHERE id = ?', (maria,))
+    assert ids(search_forms(conn, 'lopez')[0]) == []
+    conn.close()
+
+
+def test_existing_forms_are_indexed(tmp_path):
+    path = str(tmp_path / 'forms.db')
+    conn = make_db(path)
+    for i in range(5):
+        add_form(conn, employee_name=f'Worker {i}', raw_extracted_data=json.dumps({'note': f'tower {i}'}))
+    init_search_index(conn.cursor())
+    conn.commit()
+    assert len(search_forms(conn, 'worker')[0]) == 5
+    assert search_forms(conn, 'tower')[0] == []
+    conn.close()
+    assert rebuild_raw_text(path, chunk_size=2) == 5
+    conn = sqlite3.connect(path)
+    results, has_more = search_forms(conn, 'tower', limit=3)
+    assert len(results) == 3 and has_more
+    assert len(search_forms(conn, 'tower', limit=3, offset=3)[0]) == 2
+    conn.close()
+
+
+def test_highlights_are_html_escaped(tmp_path):
+    conn = make_db(str(tmp_path / 'forms.db'))
+    init_search_index(conn.cursor())
+    add_form(conn, employee_name='<script>alert(1)</script> Jane', comments='Jane & <b>co</b>')
+    result = search_forms(conn, 'jane')[0][0]
+    assert result['employee_name_highlight'] == '&lt;script&gt;alert(1)&lt;/script&gt; <mark>Jane</mark>'
+    assert '<script>' not in result['snippet'] and '<mark>Jane</mark>' in result['snippet']
+    conn.close()
+
+
+def test_match_query_is_sanitised():
+    assert build_match_query('J-100 "a') == '"J"* "100"* "a"*'
+    with pytest.raises(ValueError):
+        build_match_query(' -"* ')